@@ -0,0 +1,70 @@
+# BALANCED TEAM GENERATOR
+# ten players split into two fives has 126 distinct outcomes (252 combinations, each counted from both sides).
+# every split is scored at once as matrix products over the team masks below: the Elo win chance between the
+# two averages, the K/D gap and the head-to-head edge between the players who would face each other.
+
+import itertools
+import numpy as np
+import ratings
+
+TEAM_SIZE = 5
+# one row per split, True where the player is on team A. player 0 is always on team A so a split and its
+# mirror image aren't both listed
+SPLITS = np.array([
+    [index in team for index in range(TEAM_SIZE * 2)]
+    for team in itertools.combinations(range(TEAM_SIZE * 2), TEAM_SIZE) if 0 in team
+])
+
+# how much each imbalance counts towards a split's score, lower scores are more balanced
+RATING_WEIGHT = 0.6
+KD_WEIGHT = 0.25
+H2H_WEIGHT = 0.15
+H2H_CONFIDENCE = 10  # shared results at which the head-to-head edge counts half
+
+
+def score_splits(player_ratings, kd, wins):
+    """Score all 126 splits.
+
+    :param player_ratings: rating per player, length 10.
+    :param kd: K/D per player, length 10.
+    :param wins: 10x10, wins[i, j] is how often player i beat player j head to head.
+    :return: dict of per-split arrays: score, team A win chance, both teams' mean rating and K/D, h2h edge.
+    """
+    team_a = SPLITS.astype(np.float64)
+    team_b = 1 - team_a
+
+    rating_a = team_a @ player_ratings / TEAM_SIZE
+    rating_b = team_b @ player_ratings / TEAM_SIZE
+    win_chance = 1 / (1 + 10 ** ((rating_b - rating_a) / ratings.SCALE))
+
+    kd_a = team_a @ kd / TEAM_SIZE
+    kd_b = team_b @ kd / TEAM_SIZE
+    kd_gap = np.abs(kd_a - kd_b) / max(kd.mean(), 1e-9)
+
+    # sum over every (A player, B player) pair of their head-to-head results
+    decided = np.einsum('si,ij,sj->s', team_a, wins + wins.T, team_b)
+    lead = np.einsum('si,ij,sj->s', team_a, wins - wins.T, team_b)
+    h2h_edge = np.divide(lead, decided, out=np.zeros_like(lead), where=decided > 0)
+    h2h_weight = decided / (decided + H2H_CONFIDENCE)
+
+    score = (RATING_WEIGHT * np.abs(win_chance - 0.5) * 2
+             + KD_WEIGHT * kd_gap
+             + H2H_WEIGHT * np.abs(h2h_edge) * h2h_weight)
+    return {
+        'score': score, 'win_chance': win_chance, 'rating_a': rating_a, 'rating_b': rating_b,
+        'kd_a': kd_a, 'kd_b': kd_b, 'h2h_edge': h2h_edge
+    }
+
+
+def best_splits(names, player_ratings, kd, wins, count=3):
+    """The count most balanced splits as dicts with both rosters and what they were scored on."""
+    scored = score_splits(np.asarray(player_ratings, dtype=np.float64), np.asarray(kd, dtype=np.float64),
+                          np.asarray(wins, dtype=np.float64))
+    splits = []
+    for split in np.argsort(scored['score'], kind='stable')[:count]:
+        splits.append({
+            'team_a': [name for name, on_a in zip(names, SPLITS[split]) if on_a],
+            'team_b': [name for name, on_a in zip(names, SPLITS[split]) if not on_a],
+            **{key: float(values[split]) for key, values in scored.items()}
+        })
+    return splits
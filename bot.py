@@ -3,6 +3,7 @@
 
 import discord
 from discord.ext import commands
+from discord import app_commands
 from dotenv import load_dotenv
 import os
 import asyncio
@@ -12,13 +13,28 @@ import botutils
 from discord import ButtonStyle
 from discord.ui import View, Select, Modal, TextInput, Button
 from stats_manager import global_stats_manager
-import asyncpg
 from google.cloud import storage
 import requests
-from PIL import Image
 from google.oauth2 import service_account
 from io import BytesIO
 import time
+import outbound
+import resilience
+import export
+import pfp
+import workers
+import cpu_tasks
+import tempfile
+import hashlib
+from response_cache import responses
+from name_index import names
+from cache_events import listener
+from repository import repo
+import percentiles
+import ratings
+import balance
+import cache_events
+from percentiles import snapshot
 
 '''
 os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = 'packrunners.json'
@@ -56,19 +72,23 @@ intents.messages = True
 intents.guilds = True
 intents.message_content = True
 bot = commands.Bot(command_prefix='!', intents=intents)
+messages = outbound.Outbound(bot)
 
-correction_completed_event = asyncio.Event()
 pool = None
 
 async def init_db():
 
     global pool
+    if repo.pool is not None:
+        # on_ready fires again on every gateway reconnect, the pool is only created the first time
+        pool = repo.pool
+        return
     try:
         print("DB_NAME:", os.getenv('DB_NAME'))
         print("USER:", os.getenv('USER'))
         print("PASSWORD:", os.getenv('PASSWORD'))
         print("HOST_NAME:", os.getenv('HOST_NAME'))
-        pool = await asyncpg.create_pool(
+        pool = await repo.start(
             database= os.getenv('DB_NAME'),
             user= os.getenv('PGUSER'),
             password= os.getenv('PGPASSWORD'),
@@ -94,21 +114,32 @@ async def get_data(ctx):
     data = await fetch_data()
     if data:
         message = "\n".join([str(row) for row in data])
-        await ctx.send(message)
+        messages.send(ctx, message)
     else:
-        await ctx.send("Failed to fetch data or no data found.")
+        messages.send(ctx, "Failed to fetch data or no data found.")
 
 
 @bot.event
 async def on_ready():
     await init_db()
     print('Bot is ready and connected to the database!')
+    if repo.pool is not None:
+        listener.start()
+    # on_ready fires again on every reconnect, the index and the slash commands only need it once
+    if not names.loaded:
+        try:
+            await names.load()
+            await snapshot.load()
+            await bot.tree.sync()
+        except Exception as e:
+            print(f"Failed to set up slash commands: {e}")
 
 @bot.event
 async def on_close():
     global pool
     if pool:
-        await pool.close()
+        await repo.close()
+        pool = None
         print("Connection pool closed")
 
 # Define a function to start the bot
@@ -125,11 +156,9 @@ class ApplicationView(discord.ui.View):
 
         user_id = interaction.user.id
         # do we have a matching ID in the database?
-        async with pool.acquire() as connection:
-            existing_app = await connection.fetch('SELECT 1 FROM tms_apps WHERE discord_id = $1', user_id)
-            if existing_app:
-                await interaction.response.send_message("You have already submitted an application.", ephemeral=True)
-                return
+        if await repo.fetchval('application exists', user_id):
+            await interaction.response.send_message("You have already submitted an application.", ephemeral=True)
+            return
 
         modal = app_modal()
         await interaction.response.send_modal(modal)
@@ -149,13 +178,9 @@ class app_modal(Modal):
         tracker_link = self.children[1].value
         discord_id = interaction.user.id
         # check name match in db
-        async with pool.acquire() as connection:
-            player_id = await connection.fetchval('SELECT player_id FROM Players WHERE name = $1', handle)
-            # Insert the new application record
-            await connection.execute('''
-                INSERT INTO tms_apps (player_id, discord_id, name, tracker_link)
-                VALUES ($1, $2, $3, $4)
-            ''', player_id, discord_id , handle, tracker_link)
+        player_id = await repo.fetchval('player id', handle)
+        # Insert the new application record
+        await repo.execute('insert application', player_id, discord_id, handle, tracker_link)
         
         await botutils.add_to_sheet(handle, tracker_link, discord_id)
         return
@@ -170,23 +195,67 @@ async def start_application(ctx):
         color=discord.Color.orange()
     )
     view = ApplicationView()  # Use the persistent view
-    await ctx.send(embed=embed, view=view)
+    messages.send(ctx, embed=embed, view=view)
 
 
 
 @bot.command(name='list', help='Download a file with all registered player names')
 async def list_players(ctx):
-    async with pool.acquire() as connection:
-        player_names = await connection.fetch("SELECT name FROM Players ORDER BY name ASC")
-        player_names = [p['name'] for p in player_names]
+    player_names = [p['name'] for p in await repo.fetch('player names')]
 
-    # Write to a text file
-    with open('names.txt', 'w') as file:
-        file.write('\n'.join(player_names))
+    # Build the file in memory, the send may run after this handler returns
+    names_file = BytesIO('\n'.join(player_names).encode())
 
     # Send the file in Discord
-    with open('names.txt', 'rb') as file:
-        await ctx.reply("Here's the list of all registered players:", file=discord.File(file, 'names.txt'))
+    messages.reply(ctx, "Here's the list of all registered players:", file=discord.File(names_file, 'names.txt'))
+
+
+EXPORT_ROLE = os.getenv('EXPORT_ROLE')  # members with this role can export too, administrators always can
+
+
+def can_export(member):
+    """The whole stats history is behind this, like the token on the /export/ endpoint."""
+    if not isinstance(member, discord.Member):
+        return False  # a DM, no roles or permissions to check
+    if member.guild_permissions.administrator:
+        return True
+    return EXPORT_ROLE is not None and any(role.name == EXPORT_ROLE for role in member.roles)
+
+
+@bot.command(name='export', help='Export match stats as gzipped CSV or parquet. Filters: --player, --map, --since, --until, --format')
+@commands.cooldown(1, 60, commands.BucketType.user)
+async def export_stats(ctx, *options):
+    if not can_export(ctx.author):
+        messages.send(ctx, "You do not have permission to perform this action.")
+        return
+
+    try:
+        filters = export.parse_options(options)
+    except ValueError as e:
+        messages.reply(ctx, str(e))
+        return
+
+    # spooled to disk past a few MB, so a full export never has to fit in memory
+    export_file = tempfile.SpooledTemporaryFile(max_size=export.SPOOL_LIMIT)
+    try:
+        async with pool.acquire() as connection:
+            async for chunk in export.stream(connection, filters['format'], filters.get('player'), filters.get('map_name'), filters.get('since'), filters.get('until')):
+                await asyncio.to_thread(export_file.write, chunk)
+
+        size = export_file.tell()
+        limit = ctx.guild.filesize_limit if ctx.guild else 8 * 1024 * 1024
+        if size > limit:
+            messages.reply(ctx, f"The export is {size / 1024 / 1024:.1f}MB, over Discord's upload limit. Narrow it down with filters or use the /export/ endpoint.")
+            export_file.close()
+            return
+
+        export_file.seek(0)
+        # discord.File closes the spool once it has been sent
+        await messages.reply(ctx, "Here's your export:", file=discord.File(export_file, export.filename(filters['format'], filters.get('player'), filters.get('map_name'))))
+    except Exception as e:
+        export_file.close()
+        print(f"Export failed: {e}")
+        messages.reply(ctx, "The export failed, please try again later.")
 
 
 async def post_match_summary(team1_info, team2_info, gen_info):
@@ -207,54 +276,41 @@ async def post_match_summary(team1_info, team2_info, gen_info):
         team2_stats = "\n".join([f"{player}: Kills: {stats[0]}, Deaths: {stats[1]}, Assists: {stats[2]}" for player, stats in team2_info.items()])
         embed.add_field(name="Team 2 Stats", value=team2_stats, inline=False)
 
-        # Send the message with the embed
-        await channel.send(embed=embed)
+        # Queue the embed, summaries posted close together are merged into one message
+        messages.post_summary(channel, embed)
 
 
 
 @bot.command(name='map', help='Get map-specific data')
 async def map_stats(ctx, player: str, map_name: str):
     if pool is None:
-        await ctx.send("Database connection is not established.")
+        messages.send(ctx, "Database connection is not established.")
+        return
+
+    cached = responses.get('map', (player, map_name), [player])
+    if cached is not None:
+        messages.reply(ctx, embed=discord.Embed.from_dict(cached))
         return
+    versions = responses.versions([player])
 
     try:
-        # Fetch player_id based on player name
-        player_id = await pool.fetchval(
-            "SELECT player_id FROM Players WHERE name ILIKE $1", player
+        # the player and map lookups don't depend on each other, run them side by side
+        player_id, map_row = await asyncio.gather(
+            repo.fetchval('player id by name', player),
+            repo.fetchrow('map by name', map_name)
         )
         if not player_id:
-            await ctx.send("Player not found.")
+            messages.send(ctx, "Player not found.")
             return
-
-        # Fetch map_id based on map name
-        map_id = await pool.fetchval(
-            "SELECT map_id FROM Maps WHERE map_name ILIKE $1", map_name
-        )
-        if map_id is None:
-            await ctx.reply("Map not found.")
+        if map_row is None:
+            messages.reply(ctx, "Map not found.")
             return
-        
-        full_name = await pool.fetchval(
-            "SELECT full_name FROM Maps WHERE map_name ILIKE $1", map_name
-        )
+        map_id, full_name = map_row['map_id'], map_row['full_name']
         # Fetch player stats for the specific map dynamically
-        stats = await pool.fetchrow(
-            """
-            SELECT
-                COUNT(*) AS matches_played,
-                COUNT(*) FILTER (WHERE ps.result = 'w') AS matches_won,
-                COUNT(*) FILTER (WHERE ps.result = 'l') AS matches_lost,
-                SUM(ps.kills) AS total_kills,
-                SUM(ps.deaths) AS total_deaths
-            FROM Player_Stats ps
-            JOIN Matches m ON ps.match_id = m.match_id
-            WHERE ps.player_id = $1 AND m.map_id = $2
-            """, player_id, map_id
-        )
+        stats = await repo.fetchrow('player map stats', player_id, map_id)
 
         if not stats or stats['matches_played'] == 0:
-            await ctx.reply(f"No stats available for {player} on {full_name}.")
+            messages.reply(ctx, f"No stats available for {player} on {full_name}.")
             return
 
         # Calculate K/D ratio, handling division by zero
@@ -271,11 +327,12 @@ async def map_stats(ctx, player: str, map_name: str):
         embed.add_field(name="Total Kills", value=stats['total_kills'], inline=True)
         embed.add_field(name="Total Deaths", value=stats['total_deaths'], inline=True)
         embed.add_field(name="K/D Ratio", value=f"{kd_ratio:.2f}", inline=True)
+        responses.put('map', (player, map_name), versions, embed.to_dict())
 
         # Send the embed as a response
-        await ctx.reply(embed=embed)
+        messages.reply(ctx, embed=embed)
     except Exception as e:
-        await ctx.reply(f"An error occurred: {str(e)}")
+        messages.reply(ctx, f"An error occurred: {str(e)}")
         print(f"Error: {str(e)}")  # Log the error for debugging purposes
 
 
@@ -283,61 +340,84 @@ async def map_stats(ctx, player: str, map_name: str):
 @bot.command(name='h2h', help='Get the head-to-head record between two players')
 async def h2h(ctx, player1: str, player2: str):
 
-    # Ensure the database connection
-    async with pool.acquire() as connection:
+    cached = responses.get('h2h', (player1, player2), [player1, player2])
+    if cached is not None:
+        messages.reply(ctx, embed=discord.Embed.from_dict(cached), mention_author=True)
+        return
+    versions = responses.versions([player1, player2])
 
-        # do these players exist?
-        player1_exists = await botutils.check_player_exists(pool, player1)
-        player2_exists = await botutils.check_player_exists(pool, player2)
+    # one lookup answers both whether the players exist and who they are
+    players = await repo.fetch('h2h players', player1, player2)
+    found = {p['name'].lower() for p in players}
 
-        if not player1_exists or not player2_exists:
+    # do these players exist?
+    missing = [name for name in (player1, player2) if name.lower() not in found]
 
-            player_name = player1 if not player1_exists else player2
-            # Create an embed message
-            embed = discord.Embed(
-                title="Player Check",
-                description=f"Player name `{player_name}` does not exist in the database.",
-                color=discord.Color.red()  # Red color to indicate an issue or non-existence
-            )
-            embed.set_footer(text="Try checking the spelling or adding them if they're new.")
-            await ctx.send(embed=embed)
-            return
+    if missing:
 
-        # Fetch the H2H record
-        record = await fetch_h2h_record(connection, player1, player2)
+        player_name = missing[0]
+        # Create an embed message
+        embed = discord.Embed(
+            title="Player Check",
+            description=f"Player name `{player_name}` does not exist in the database.",
+            color=discord.Color.red()  # Red color to indicate an issue or non-existence
+        )
+        embed.set_footer(text="Try checking the spelling or adding them if they're new.")
+        messages.send(ctx, embed=embed)
+        return
 
-        if not record:
-            await ctx.send("No head-to-head record found between these players.")
-            return
+    # Fetch the H2H record
+    record = await fetch_h2h_record(players, player1, player2)
 
-        # change to default pfp if no PFP found in db
-        if record['player_one_pic'] is None:
-            record['player_one_pic'] = default_pfp
-        if record['player_two_pic'] is None:
-            record['player_two_pic'] = default_pfp
+    if not record:
+        messages.send(ctx, "No head-to-head record found between these players.")
+        return
 
-        merged_url = await merge_images(url1=record['player_one_pic'], url2=record['player_two_pic'], standard_size=(256, 256))
-        merged_url = generate_image_url(merged_url)
-        # Constructing the record description based on player wins
-        record_description = f"{record['player_one_name']} has a record of {record['player_one_wins']}-{record['player_two_wins']} against {record['player_two_name']} all-time."
+    # change to default pfp if no PFP found in db
+    if record['player_one_pic'] is None:
+        record['player_one_pic'] = default_pfp
+    if record['player_two_pic'] is None:
+        record['player_two_pic'] = default_pfp
 
-        # Create and send an embed with the record and merged image
-        embed = discord.Embed(
-            title="Head-to-Head Record",
-            description=record_description,
-            color=discord.Color.red()
-        )
-        embed.set_image(url=merged_url) 
+    merged_image = await merge_images(url1=record['player_one_pic'], url2=record['player_two_pic'], standard_size=(256, 256))
+    # Constructing the record description based on player wins
+    record_description = f"{record['player_one_name']} has a record of {record['player_one_wins']}-{record['player_two_wins']} against {record['player_two_name']} all-time."
+
+    # Create and send an embed with the record and merged image
+    embed = discord.Embed(
+        title="Head-to-Head Record",
+        description=record_description,
+        color=discord.Color.red()
+    )
+    if record['shared_matches']:
+        player_one_kd = record['player_one_kills'] / record['player_one_deaths'] if record['player_one_deaths'] > 0 else float(record['player_one_kills'])
+        player_two_kd = record['player_two_kills'] / record['player_two_deaths'] if record['player_two_deaths'] > 0 else float(record['player_two_kills'])
+        embed.add_field(name="Shared Matches", value=f"```{record['shared_matches']}```", inline=True)
+        embed.add_field(name=f"{record['player_one_name']} K/D", value=f"```{player_one_kd:.2f}```", inline=True)
+        embed.add_field(name=f"{record['player_two_name']} K/D", value=f"```{player_two_kd:.2f}```", inline=True)
+        map_lines = [f"**{name}:** {wins_one}-{wins_two} ({played} played)" for name, wins_one, wins_two, played in record['maps'][:10]]
+        embed.add_field(name="By Map", value="\n".join(map_lines), inline=False)
+    # the embed is cached with this URL, so every pair and picture version gets its own object. the ids go in
+    # display order since the layout follows it, and the picture urls stay the same when a player replaces theirs
+    picture_version = hashlib.sha256(merged_image).hexdigest()[:16]
+    merged_name = f"h2h_{record['player_one_id']}_{record['player_two_id']}_{picture_version}.png"
+    try:
+        merged_url = generate_image_url(await upload_to_cloud_storage(merged_image, merged_name))
+    except Exception as e:
+        # storage is down, attach the image to the message instead
+        print(f"Could not upload merged image: {e}")
+        embed.set_image(url="attachment://merged_h2h.png")
+        messages.reply(ctx, embed=embed, file=discord.File(BytesIO(merged_image), "merged_h2h.png"), mention_author=True)
+        return
+    embed.set_image(url=merged_url) 
+    # only cached with the uploaded image, an attachment would have to be rebuilt every time
+    responses.put('h2h', (player1, player2), versions, embed.to_dict())
 
-        await ctx.reply(embed=embed, mention_author=True)
+    messages.reply(ctx, embed=embed, mention_author=True)
 
 
-async def fetch_h2h_record(connection, player1, player2):
-    # Fetch player details for both players
-    players = await connection.fetch(
-        "SELECT player_id, name, profile_pic_url FROM Players WHERE name ILIKE $1 OR name ILIKE $2",
-        player1, player2
-    )
+async def fetch_h2h_record(players, player1, player2):
+    # players is the 'h2h players' lookup for both names
     if len(players) < 2:
         return None  # Ensure both players are found
 
@@ -346,20 +426,20 @@ async def fetch_h2h_record(connection, player1, player2):
     player1_data = player_data.get(player1.lower())
     player2_data = player_data.get(player2.lower())
 
-    # Fetch the H2H records
-    h2h_query = """
-        SELECT 
-            player_one_id, player_two_id, player_one_wins, player_two_wins
-        FROM H2H_Records
-        WHERE (player_one_id = $1 AND player_two_id = $2) 
-           OR (player_one_id = $2 AND player_two_id = $1)
-    """
-    record = await connection.fetchrow(h2h_query, player1_data['player_id'], player2_data['player_id'])
+    # Fetch the H2H record and the per-map stats of their shared matches together,
+    # the per-map stats are keyed like H2H_Records with the lower player_id first
+    low_id, high_id = sorted((player1_data['player_id'], player2_data['player_id']))
+    record, details = await asyncio.gather(
+        repo.fetchrow('h2h record', player1_data['player_id'], player2_data['player_id']),
+        repo.fetch('h2h pair stats', low_id, high_id)
+    )
     if not record:
         return None
 
     # Create a correctly ordered response based on input order, not player_id
     response = {
+        'player_one_id': player1_data['player_id'],
+        'player_two_id': player2_data['player_id'],
         'player_one_name': player1_data['name'],
         'player_two_name': player2_data['name'],
         'player_one_wins': None,
@@ -376,29 +456,43 @@ async def fetch_h2h_record(connection, player1, player2):
         response['player_one_wins'] = record['player_two_wins']
         response['player_two_wins'] = record['player_one_wins']
 
+    # Per-map stats of their shared matches
+    first, second = ('player_one', 'player_two') if player1_data['player_id'] == low_id else ('player_two', 'player_one')
+    response['shared_matches'] = sum(row['shared_matches'] for row in details)
+    response['player_one_kills'] = sum(row[f'{first}_kills'] for row in details)
+    response['player_one_deaths'] = sum(row[f'{first}_deaths'] for row in details)
+    response['player_two_kills'] = sum(row[f'{second}_kills'] for row in details)
+    response['player_two_deaths'] = sum(row[f'{second}_deaths'] for row in details)
+    response['maps'] = [
+        (row['map_name'], row[f'{first}_wins'], row[f'{second}_wins'], row['shared_matches']) for row in details
+    ]
+
     return response
 
 
-async def merge_images(url1, url2, standard_size=(256, 256)):
+def download_image(url):
+    response = requests.get(url, timeout=resilience.POLICIES['gcs_read']['deadline'])
+    response.raise_for_status()
+    return response.content
 
-    response1 = requests.get(url1)
-    response2 = requests.get(url2)
-    image1 = Image.open(BytesIO(response1.content))
-    image2 = Image.open(BytesIO(response2.content))
 
-    image1 = image1.resize(standard_size)
-    image2 = image2.resize(standard_size)
-
-    dst = Image.new('RGB', (standard_size[0] * 2, standard_size[1]))
-    dst.paste(image1, (0, 0))
-    dst.paste(image2, (standard_size[0], 0))
+async def merge_images(url1, url2, standard_size=(256, 256)):
+    """Download both pictures and return the side by side composite as PNG bytes."""
+    content1, content2 = await asyncio.gather(
+        resilience.call('gcs_read', download_image, url1),
+        resilience.call('gcs_read', download_image, url2)
+    )
+    # decoding, resizing and PNG encoding run in a worker process
+    return await workers.cpu_pool.run(cpu_tasks.merge_pictures, content1, content2, standard_size)
 
-    img_byte_arr = BytesIO()
-    dst.save(img_byte_arr, format='PNG')
-    img_byte_arr.seek(0)
 
-    file_name = "merged_h2h.png"
-    return await upload_to_cloud_storage(img_byte_arr.getvalue(), file_name)
+def store_blob(path, data, content_type):
+    """Blocking upload of one object, cache control is set so discord always sees the latest version."""
+    blob = bucket.blob(path)
+    blob.upload_from_string(data, content_type=content_type)
+    blob.cache_control = "no-cache, max-age=0"  # Advises no caching
+    blob.patch()  # Apply the cache control settings
+    return f"https://storage.googleapis.com/{bucket.name}/{blob.name}"
 
 
 async def upload_to_cloud_storage(image_bytes, file_name):
@@ -406,16 +500,8 @@ async def upload_to_cloud_storage(image_bytes, file_name):
     # Prefix the file name with 'merged/' to store it in the correct folder
     merged_file_name = f"merged/{file_name}"
     
-    # Create a blob in the bucket at the specified path
-    blob = bucket.blob(merged_file_name)
-    blob.upload_from_string(image_bytes, content_type='image/png')  # Assuming content type is JPEG
-
-    # Set cache control settings
-    blob.cache_control = "no-cache, max-age=0"
-    blob.patch()  # Apply the cache control settings
-
-    # Construct and return the public URL for the uploaded image
-    public_url = f"https://storage.googleapis.com/{bucket.name}/{blob.name}"
+    # Upload the blob at the specified path and return its public URL
+    public_url = await resilience.call('gcs', store_blob, merged_file_name, image_bytes, 'image/png')
     print(public_url)
     return public_url
 
@@ -427,68 +513,395 @@ def generate_image_url(base_url):
 
 
 # !player command, for tournament stats
-@bot.command(name='player', help='Displays general statistics of a player')
-async def player_stats(ctx, player_name: str):
-    async with pool.acquire() as connection:
-        query = """
-        SELECT 
-            P.name AS registered_name,
-            P.profile_pic_url,
-            COALESCE(SUM(PS.kills), 0) AS total_kills,
-            COALESCE(SUM(PS.deaths), 0) AS total_deaths,
-            COUNT(PS.player_id) AS matches_played,
-            COALESCE(SUM(CASE WHEN PS.result = 'w' THEN 1 ELSE 0 END), 0) AS matches_won,
-            COALESCE(SUM(CASE WHEN PS.result = 'l' THEN 1 ELSE 0 END), 0) AS matches_lost,
-            COALESCE(SUM(PS.assists), 0) AS total_assists
-        FROM Players P
-        LEFT JOIN Player_Stats PS ON P.player_id = PS.player_id
-        WHERE P.name ILIKE $1
-        GROUP BY P.profile_pic_url, P.name;
-        """
-        player = await connection.fetchrow(query, player_name)
-
-        if not player:
-                embed = discord.Embed(
-                title="Player Check",
-                description=f"Player name `{player_name}` does not exist in the database.",
-                color=discord.Color.red()  # Red color to indicate an issue or non-existence
-                )
-                embed.set_footer(text="Try checking the spelling or adding them if they're new.")
-                await ctx.reply(embed=embed)
-                return
+@bot.command(name='player', help='Displays general statistics of a player. Add --season N or --last 30d to narrow it down')
+async def player_stats(ctx, player_name: str, *options):
+    try:
+        season, window = botutils.parse_stats_window(options)
+    except ValueError as e:
+        messages.reply(ctx, str(e))
+        return
+
+    # rolling windows move with the clock, so only all-time and season answers are cached.
+    # all-time answers rank the player against everyone, so they also go stale with the percentile snapshot
+    cacheable = window is None
+    ranked = cacheable and season is None and snapshot.loaded
+    cache_args = (player_name, season, snapshot.version if ranked else None)
+    if cacheable:
+        cached = responses.get('player', cache_args, [player_name])
+        if cached is not None:
+            messages.reply(ctx, embed=discord.Embed.from_dict(cached), mention_author=True)
+            return
+        versions = responses.versions([player_name])
+
+    if season is not None:
+        # season totals are kept up to date by write.py, no need to touch Player_Stats
+        player = await repo.fetchrow('player season stats', player_name, season)
+        title_suffix = f" (Season {season})"
+    elif window is not None:
+        player = await repo.fetchrow('player window stats', player_name, window)
+        title_suffix = f" (Last {options[-1]})"
+    else:
+        player = await repo.fetchrow('player stats', player_name)
+        title_suffix = ""
+
+    if not player:
+            embed = discord.Embed(
+            title="Player Check",
+            description=f"Player name `{player_name}` does not exist in the database.",
+            color=discord.Color.red()  # Red color to indicate an issue or non-existence
+            )
+            embed.set_footer(text="Try checking the spelling or adding them if they're new.")
+            messages.reply(ctx, embed=embed)
+            return
+
+    kd_ratio = player['total_kills'] / player['total_deaths'] if player['total_deaths'] > 0 else float(player['total_kills'])
+    win_rate = (player['matches_won'] / player['matches_played'] * 100) if player['matches_played'] > 0 else 0
+    assists_per_game = player['total_assists'] / player['matches_played'] if player['matches_played'] > 0 else 0
+
+    kd_label, win_rate_label = "Overall KD", "Win Rate"
+    if ranked and player['matches_played'] > 0:
+        kd_label += f" ({botutils.ordinal(snapshot.percentile('kd', kd_ratio))} percentile)"
+        win_rate_label += f" ({botutils.ordinal(snapshot.percentile('win_rate', win_rate))} percentile)"
+
+    # Use monospaced font for alignment
+    stats_description = (
+        f"**{kd_label}:** ```{kd_ratio:.2f}```\n"
+        f"**{win_rate_label}:** ```{win_rate:.1f}%```\n"
+        f"**Total Maps Played:** ```{player['matches_played']}```\n"
+        f"**Assists Per Game:** ```{assists_per_game:.1f}```"
+    )
+
+    # Create the embed
+    embed = discord.Embed(
+        title=f"Player Statistics for {player['registered_name']}{title_suffix}",
+        description=stats_description,
+        color=discord.Color.red()
+    )
+    embed.set_thumbnail(url=player['profile_pic_url'])
+    embed.set_footer(text="Statistics are updated in real-time based on available data.")
+    if cacheable:
+        responses.put('player', cache_args, versions, embed.to_dict())
+
+    messages.reply(ctx, embed=embed, mention_author=True)
+
+
+
+
+
+# metric, label and format of each line in a !compare column
+COMPARE_FIELDS = [
+    ('kd', "K/D", "{:.2f}"),
+    ('win_rate', "Win Rate", "{:.1f}%"),
+    ('assists_per_game', "Assists Per Game", "{:.1f}"),
+    ('matches_played', "Maps Played", "{:.0f}"),
+]
 
-        kd_ratio = player['total_kills'] / player['total_deaths'] if player['total_deaths'] > 0 else float(player['total_kills'])
-        win_rate = (player['matches_won'] / player['matches_played'] * 100) if player['matches_played'] > 0 else 0
-        assists_per_game = player['total_assists'] / player['matches_played'] if player['matches_played'] > 0 else 0
 
-        # Use monospaced font for alignment
-        stats_description = (
-            f"**Overall KD:** ```{kd_ratio:.2f}```\n"
-            f"**Win Rate:** ```{win_rate:.1f}%```\n"
-            f"**Total Maps Played:** ```{player['matches_played']}```\n"
-            f"**Assists Per Game:** ```{assists_per_game:.1f}```"
+@bot.command(name='compare', help='Compare the all-time stats of two to four players, with percentile ranks')
+async def compare_players(ctx, *players):
+    if not 2 <= len(players) <= 4:
+        messages.reply(ctx, "Usage: `!compare player1 player2 [player3] [player4]`")
+        return
+    if not snapshot.loaded:
+        messages.reply(ctx, "Stats are still loading, try again in a moment.")
+        return
+
+    # served from the percentile snapshot, no query needed
+    stats = [snapshot.player(player_name) for player_name in players]
+    missing = [player_name for player_name, player in zip(players, stats) if player is None]
+    if missing:
+        embed = discord.Embed(
+            title="Player Check",
+            description=f"Player name `{missing[0]}` does not exist in the database or has no matches yet.",
+            color=discord.Color.red()
         )
+        embed.set_footer(text="Try checking the spelling or adding them if they're new.")
+        messages.reply(ctx, embed=embed)
+        return
+
+    embed = discord.Embed(title="Player Comparison", color=discord.Color.red())
+    for player in stats:
+        lines = [
+            f"**{label}:** {value_format.format(player[metric][0])} ({botutils.ordinal(player[metric][1])})"
+            for metric, label, value_format in COMPARE_FIELDS
+        ]
+        embed.add_field(name=player['name'], value="\n".join(lines), inline=True)
+    embed.set_footer(text=f"Percentiles are among players with at least {percentiles.MIN_MATCHES} maps played.")
+    messages.reply(ctx, embed=embed, mention_author=True)
+
+
+@bot.command(name='rating', help='Show the skill rating of a player')
+async def player_rating(ctx, player_name: str):
+    row = await repo.fetchrow('player rating', player_name, ratings.LEADERBOARD_MIN_MATCHES)
+    if row is None:
+        embed = discord.Embed(
+            title="Player Check",
+            description=f"Player name `{player_name}` does not exist in the database or has no rated matches yet.",
+            color=discord.Color.red()
+        )
+        embed.set_footer(text="Try checking the spelling or adding them if they're new.")
+        messages.reply(ctx, embed=embed)
+        return
+
+    if row['matches_rated'] >= ratings.LEADERBOARD_MIN_MATCHES:
+        rank = f"#{row['rank']}"
+    else:
+        rank = f"Unranked ({ratings.LEADERBOARD_MIN_MATCHES - row['matches_rated']} more maps to go)"
+    embed = discord.Embed(
+        title=f"Skill Rating for {row['name']}",
+        description=(
+            f"**Rating:** ```{row['rating']:.0f}```\n"
+            f"**Peak:** ```{row['peak_rating']:.0f}```\n"
+            f"**Rank:** ```{rank}```\n"
+            f"**Maps Rated:** ```{row['matches_rated']}```"
+        ),
+        color=discord.Color.red()
+    )
+    messages.reply(ctx, embed=embed, mention_author=True)
+
 
-        # Create the embed
+@bot.command(name='leaderboard', help='Show the highest rated players. Add a number to show up to 25')
+async def rating_leaderboard(ctx, count: int = 10):
+    count = max(1, min(count, 25))
+    rows = await repo.fetch('rating leaderboard', ratings.LEADERBOARD_MIN_MATCHES, count)
+    if not rows:
+        messages.reply(ctx, f"Nobody has {ratings.LEADERBOARD_MIN_MATCHES} rated maps yet.")
+        return
+
+    lines = [f"`{rank:>2}.` **{row['name']}** {row['rating']:.0f} ({row['matches_rated']} maps)" for rank, row in enumerate(rows, start=1)]
+    embed = discord.Embed(title="Rating Leaderboard", description="\n".join(lines), color=discord.Color.red())
+    embed.set_footer(text=f"Players need {ratings.LEADERBOARD_MIN_MATCHES} rated maps to be ranked.")
+    messages.reply(ctx, embed=embed, mention_author=True)
+
+
+@bot.command(name='balance', help='Split ten players into the most balanced two teams of five')
+async def balance_teams(ctx, *players):
+    lowered = [player_name.lower() for player_name in players]
+    if len(players) != balance.TEAM_SIZE * 2 or len(set(lowered)) != len(lowered):
+        messages.reply(ctx, "Usage: `!balance p1 p2 p3 p4 p5 p6 p7 p8 p9 p10` with ten different players")
+        return
+
+    rows, h2h_rows = await asyncio.gather(repo.fetch('balance players', lowered), repo.fetch('balance h2h', lowered))
+    found = {row['name'].lower(): row for row in rows}
+    missing = [player_name for player_name in players if player_name.lower() not in found]
+    if missing:
         embed = discord.Embed(
-            title=f"Player Statistics for {player['registered_name']}",
-            description=stats_description,
+            title="Player Check",
+            description=f"Player name `{missing[0]}` does not exist in the database.",
             color=discord.Color.red()
         )
-        embed.set_thumbnail(url=player['profile_pic_url'])
-        embed.set_footer(text="Statistics are updated in real-time based on available data.")
+        embed.set_footer(text="Try checking the spelling or adding them if they're new.")
+        messages.reply(ctx, embed=embed)
+        return
+
+    ordered = [found[name] for name in lowered]
+    # players without matches count as an even 1.0 K/D
+    kd = [
+        row['total_kills'] / row['total_deaths'] if row['total_deaths'] else float(row['total_kills'] or 1.0)
+        for row in ordered
+    ]
+    slot = {name: index for index, name in enumerate(lowered)}
+    wins = [[0] * len(lowered) for _ in lowered]
+    for row in h2h_rows:
+        wins[slot[row['player_one']]][slot[row['player_two']]] = row['player_one_wins']
+        wins[slot[row['player_two']]][slot[row['player_one']]] = row['player_two_wins']
+
+    splits = balance.best_splits([row['name'] for row in ordered], [row['rating'] for row in ordered], kd, wins)
+    embed = discord.Embed(title="Balanced Teams", color=discord.Color.red())
+    for option, split in enumerate(splits, start=1):
+        embed.add_field(
+            name=f"Option {option}",
+            value=(
+                f"**Team A:** {', '.join(split['team_a'])}\n"
+                f"**Team B:** {', '.join(split['team_b'])}\n"
+                f"Rating {split['rating_a']:.0f} vs {split['rating_b']:.0f}, "
+                f"win chance {split['win_chance'] * 100:.0f}% / {(1 - split['win_chance']) * 100:.0f}%\n"
+                f"K/D {split['kd_a']:.2f} vs {split['kd_b']:.2f}, head-to-head edge {split['h2h_edge'] * 100:+.0f}% for Team A"
+            ),
+            inline=False
+        )
+    embed.set_footer(text="Scored on skill rating, all-time K/D and head-to-head records across all 126 splits.")
+    messages.reply(ctx, embed=embed, mention_author=True)
+
 
-        await ctx.reply(embed=embed, mention_author=True)
+HISTORY_PAGE_SIZE = 10
 
 
+def match_outcome(result, score):
+    """Win, Loss or Draw. Player_Stats stores a draw as 'l' for both sides, only the score tells them apart."""
+    if result == 'w':
+        return "Win"
+    team1_score, _, team2_score = score.replace(' ', '').partition('-')
+    return "Draw" if team1_score == team2_score else "Loss"
 
 
+class HistoryView(View):
+    """Newer/Older buttons over a player's match history.
+
+    Pages are fetched by keyset, starting after the last (match_date, match_id) of the page before, and the
+    next page is fetched in the background while the current one is being read. Pages already seen are kept,
+    going back never queries again.
+    """
+
+    def __init__(self, author_id, player_id, player_name):
+        super().__init__(timeout=300)
+        self.author_id = author_id
+        self.player_id = player_id
+        self.player_name = player_name
+        self.pages = []       # rows of every page fetched so far
+        self.has_more = []    # whether a page has one after it
+        self.index = 0
+        self.prefetch = None
+        self.message = None
+        self.turning = asyncio.Lock()  # a double click waits for the first one instead of loading a page twice
+
+    async def fetch_page(self, after=None):
+        # one row past the page tells whether there is a next one without counting
+        if after is None:
+            rows = await repo.fetch('history first page', self.player_id, HISTORY_PAGE_SIZE + 1)
+        else:
+            rows = await repo.fetch('history page', self.player_id, after['match_date'], after['match_id'], HISTORY_PAGE_SIZE + 1)
+        return rows[:HISTORY_PAGE_SIZE], len(rows) > HISTORY_PAGE_SIZE
+
+    async def load_first(self):
+        rows, has_more = await self.fetch_page()
+        self.pages.append(rows)
+        self.has_more.append(has_more)
+        self.prefetch_next()
+
+    def prefetch_next(self):
+        if self.has_more[-1] and self.prefetch is None:
+            self.prefetch = asyncio.create_task(self.fetch_page(self.pages[-1][-1]))
+
+    def embed(self):
+        rows = self.pages[self.index]
+        lines = [
+            f"`{row['match_date']:%Y-%m-%d}` **{row['map_name']}** {row['score']} "
+            f"{match_outcome(row['result'], row['score'])} - {row['kills']}/{row['deaths']}/{row['assists']}"
+            for row in rows
+        ]
+        embed = discord.Embed(
+            title=f"Match History for {self.player_name}",
+            description="\n".join(lines) or "No matches played yet.",
+            color=discord.Color.red()
+        )
+        embed.set_footer(text=f"Page {self.index + 1} - K/D/A per map, newest first")
+        self.newer.disabled = self.index == 0
+        self.older.disabled = not self.has_more[self.index]
+        return embed
+
+    async def interaction_check(self, interaction: discord.Interaction):
+        if interaction.user.id != self.author_id:
+            await interaction.response.send_message("Only the person who asked can turn the pages.", ephemeral=True)
+            return False
+        return True
+
+    @discord.ui.button(label="Newer", style=ButtonStyle.grey)
+    async def newer(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.index = max(self.index - 1, 0)
+        await interaction.response.edit_message(embed=self.embed(), view=self)
+
+    @discord.ui.button(label="Older", style=ButtonStyle.grey)
+    async def older(self, interaction: discord.Interaction, button: discord.ui.Button):
+        async with self.turning:
+            if not self.has_more[self.index]:
+                await interaction.response.edit_message(embed=self.embed(), view=self)
+                return
+            if self.index + 1 == len(self.pages):
+                self.prefetch_next()
+                try:
+                    rows, has_more = await self.prefetch
+                except Exception as e:
+                    print(f"Failed to fetch match history: {e}")
+                    await interaction.response.send_message("Couldn't load the next page, try again.", ephemeral=True)
+                    return
+                finally:
+                    self.prefetch = None
+                self.pages.append(rows)
+                self.has_more.append(has_more)
+            self.index += 1
+            await interaction.response.edit_message(embed=self.embed(), view=self)
+            if self.index + 1 == len(self.pages):
+                self.prefetch_next()
+
+    async def on_timeout(self):
+        if self.prefetch is not None:
+            self.prefetch.cancel()
+        if self.message is not None:
+            try:
+                await self.message.edit(view=None)
+            except discord.HTTPException:
+                pass
+
+
+@bot.command(name='history', help='Page through the matches of a player, newest first')
+async def match_history(ctx, player_name: str):
+    player = await repo.fetchrow('player name and id', player_name)
+    if player is None:
+        embed = discord.Embed(
+            title="Player Check",
+            description=f"Player name `{player_name}` does not exist in the database.",
+            color=discord.Color.red()
+        )
+        embed.set_footer(text="Try checking the spelling or adding them if they're new.")
+        messages.reply(ctx, embed=embed)
+        return
+
+    view = HistoryView(ctx.author.id, player['player_id'], player['name'])
+    await view.load_first()
+    try:
+        view.message = await messages.reply(ctx, embed=view.embed(), view=view, mention_author=True)
+    except Exception:
+        view.stop()
+
+
+# slash versions of the stat commands, their name arguments autocomplete from name_index.py so a typo
+# never costs a round trip. each one runs the prefix command with a context built from the interaction.
+
+async def complete_player(interaction: discord.Interaction, current: str):
+    return [app_commands.Choice(name=name, value=name) for name in names.players.complete(current)]
+
+
+async def complete_map(interaction: discord.Interaction, current: str):
+    return [app_commands.Choice(name=name, value=name) for name in names.maps.complete(current)]
+
+
+async def interaction_context(interaction):
+    ctx = await commands.Context.from_interaction(interaction)
+    # the commands can take longer than the 3 seconds discord allows for a first response
+    await ctx.defer()
+    return ctx
+
+
+@bot.tree.command(name='player', description='Displays general statistics of a player')
+@app_commands.describe(season='Only this season', last='Only the last stretch of time, e.g. 30d, 2w or 12h')
+@app_commands.autocomplete(player_name=complete_player)
+async def player_slash(interaction: discord.Interaction, player_name: str, season: int = None, last: str = None):
+    options = []
+    if season is not None:
+        options += ['--season', str(season)]
+    if last is not None:
+        options += ['--last', last]
+    await player_stats(await interaction_context(interaction), player_name, *options)
+
+
+@bot.tree.command(name='h2h', description='Get the head-to-head record between two players')
+@app_commands.autocomplete(player1=complete_player, player2=complete_player)
+async def h2h_slash(interaction: discord.Interaction, player1: str, player2: str):
+    await h2h(await interaction_context(interaction), player1, player2)
+
+
+@bot.tree.command(name='map', description='Get map-specific data')
+@app_commands.autocomplete(player=complete_player, map_name=complete_map)
+async def map_slash(interaction: discord.Interaction, player: str, map_name: str):
+    await map_stats(await interaction_context(interaction), player, map_name)
+
 
 @bot.command(name='pfp', help='Upload a new profile picture')
 async def upload_pfp(ctx, player_name: str):
 
     # does the username exist?
-    if not await botutils.check_player_exists(pool, player_name):
+    if not await botutils.check_player_exists(player_name):
         # Create an embed message
         embed = discord.Embed(
             title="Player Check",
@@ -496,13 +909,11 @@ async def upload_pfp(ctx, player_name: str):
             color=discord.Color.red()  # Red color to indicate an issue or non-existence
         )
         embed.set_footer(text="Try checking the spelling or adding them if they're new.")
-        await ctx.send(embed=embed)
+        messages.send(ctx, embed=embed)
         return
 
     # Inform the user and start a DM session
-    if ctx.author.dm_channel is None:
-        await ctx.author.create_dm()
-    await ctx.author.dm_channel.send("Please send the new profile picture as an attachment.")
+    messages.send_dm(ctx.author.id, "Please send the new profile picture as an attachment.")
     
     # Listen for the next message from this user in DM
     def check(message):
@@ -511,78 +922,94 @@ async def upload_pfp(ctx, player_name: str):
     try:
         message = await bot.wait_for('message', check=check, timeout=300.0)  # 5 minutes timeout
     except asyncio.TimeoutError:
-        await ctx.author.dm_channel.send("You did not send an image in time. Please try the command again if you wish to update your profile picture.")
+        messages.send_dm(ctx.author.id, "You did not send an image in time. Please try the command again if you wish to update your profile picture.")
         return
 
     attachment = message.attachments[0]  # Corrected to use the received message in DM
     file_extension = os.path.splitext(attachment.filename)[1].lower()
     if file_extension not in ['.png', '.jpg', '.jpeg', '.gif']:
-        await ctx.author.dm_channel.send("Please upload a valid image file (png, jpg, jpeg, gif).")
+        messages.send_dm(ctx.author.id, "Please upload a valid image file (png, jpg, jpeg, gif).")
         return
 
-    # Set the filename in the bucket
+    # Set the filenames in the bucket
     file_path = f"images/{ctx.author.id}{file_extension}"
-    blob = bucket.blob(file_path)
+    variant_paths = {name: f"images/{ctx.author.id}_{name}.png" for name in pfp.VARIANTS}
 
-    # Download the image from Discord and upload to Google Cloud Storage
+    # Download the image from Discord, check it and cut the pre-sized variants readers use
     image_data = await attachment.read()
-    blob.upload_from_string(image_data, content_type=attachment.content_type)
-    blob.cache_control = "no-cache, max-age=0"  # Advises no caching
-    blob.patch()  # Apply the cache control settings
+    try:
+        variants = await pfp.process_upload(image_data)
+    except pfp.InvalidImage as e:
+        messages.send_dm(ctx.author.id, f"That image can't be used: {e}.")
+        return
 
-    # Form the public URL
-    public_url = f"https://storage.googleapis.com/{bucket.name}/{blob.name}"
+    # Upload the original and the variants to Google Cloud Storage
+    try:
+        public_url, *variant_urls = await asyncio.gather(
+            resilience.call('gcs', store_blob, file_path, image_data, attachment.content_type),
+            *(resilience.call('gcs', store_blob, variant_paths[name], variants[name], 'image/png') for name in pfp.VARIANTS)
+        )
+        variant_urls = dict(zip(pfp.VARIANTS, variant_urls))
+    except Exception as e:
+        messages.send_dm(ctx.author.id, "Image storage is unavailable right now, please try again later.")
+        print(f"Profile picture upload error: {e}")
+        return
 
-    # Use the global pool to execute the update
     try:
-        async with pool.acquire() as connection:
-            await connection.execute(
-                "UPDATE Players SET profile_pic_url = $1 WHERE name ILIKE $2",
-                public_url, player_name
-            )
-        await ctx.author.dm_channel.send(f"Profile picture for {player_name} uploaded successfully! URL: {public_url}")
+        await repo.execute('update pfp', public_url, variant_urls['h2h'], variant_urls['thumb'], player_name)
+        responses.bump([player_name])  # the picture shows up in cached !player and !h2h embeds
+        messages.send_dm(ctx.author.id, f"Profile picture for {player_name} uploaded successfully! URL: {public_url}")
     except Exception as e:
-        await ctx.author.dm_channel.send(f"Failed to update profile picture for {player_name} in the database.")
+        messages.send_dm(ctx.author.id, f"Failed to update profile picture for {player_name} in the database.")
         print(f"Database update error: {e}")
+        return
+
+    # the picture is saved either way, other processes just keep their cached embeds a while longer
+    try:
+        await cache_events.notify('pfp', [player_name])
+    except Exception as e:
+        print(f"Failed to notify other processes of the new picture for {player_name}: {e}")
 
 
 class ConfirmationModal(Modal):
-    def __init__(self, title="Enter the correct value", player=None, team1_info=None, team2_info=None, selected_stat=None):
+    def __init__(self, title="Enter the correct value", player=None, match_key=None, match_keys=None, selected_stat=None):
         super().__init__(title=title)
         self.player = player
         self.selected_stat = selected_stat
-        self.team1_info = team1_info
-        self.team2_info = team2_info
+        self.match_key = match_key
+        self.match_keys = match_keys
         self.add_item(TextInput(label="Value:", placeholder="Enter the correct value"))
 
     async def on_submit(self, interaction: discord.Interaction):
         corrected_value = self.children[0].value
         # Determine which team the player is in and the index for the stat
-        team = 'team1' if self.player in global_stats_manager.get_team_info('team1') else 'team2'
+        team = global_stats_manager.find_team(self.player, self.match_key)
         stat_indices = {'Kills': 0, 'Deaths': 1, 'Assists': 2}
         
         if self.selected_stat in stat_indices:
             # For numerical stats like Kills, Deaths, Assists
             stat_index = stat_indices[self.selected_stat]
-            global_stats_manager.update_stat(team, self.player, stat_index, int(corrected_value))
+            global_stats_manager.update_stat(team, self.player, stat_index, int(corrected_value), self.match_key)
         elif self.selected_stat == "Name":
             # Special case for updating names
-            global_stats_manager.update_name(team, corrected_value, self.player)
+            global_stats_manager.update_name(team, corrected_value, self.player, self.match_key)
+        # keep the durable copy in step so a restart doesn't lose the correction
+        await global_stats_manager.persist(self.match_key)
             
         embed = discord.Embed(title="Your Modal Results", color=discord.Color.blurple())
         embed.add_field(name="Corrected Value", value=corrected_value, inline=False)
-        embed.add_field(name="Updated stats: Team 1", value=botutils.format_player_stats(global_stats_manager.get_team_info('team1')), inline=False)
-        embed.add_field(name="Updated stats: Team 2", value=botutils.format_player_stats(global_stats_manager.get_team_info('team2')), inline=False)
+        embed.add_field(name="Updated stats: Team 1", value=botutils.format_player_stats(global_stats_manager.get_team_info('team1', self.match_key)), inline=False)
+        embed.add_field(name="Updated stats: Team 2", value=botutils.format_player_stats(global_stats_manager.get_team_info('team2', self.match_key)), inline=False)
         await interaction.response.send_message(embed=embed, ephemeral=True)
         # Reinstate the confirmation view to allow further corrections
-        view = ConfirmationView(interaction.user.id, self.team1_info, self.team2_info)
+        view = ConfirmationView(interaction.user.id, self.match_keys)
         await interaction.followup.send("Would you like to make more corrections?", view=view)
 
 class StatCorrectionSelect(Select):
-    def __init__(self, player, team1_info, team2_info):
+    def __init__(self, player, match_key, match_keys):
         self.player = player
-        self.team1_info = team1_info
-        self.team2_info = team2_info
+        self.match_key = match_key
+        self.match_keys = match_keys
         options = [
             discord.SelectOption(label="Name", description="Correct the player's name"),
             discord.SelectOption(label="Kills", description="Correct the number of kills"),
@@ -594,65 +1021,110 @@ class StatCorrectionSelect(Select):
     async def callback(self, interaction: discord.Interaction):
         selected_stat = self.values[0]
         modal = ConfirmationModal(title=f"Correcting {selected_stat} for {self.player}", 
-                                  player=self.player, team1_info=self.team1_info, team2_info=self.team2_info, selected_stat=self.values[0])
+                                  player=self.player, match_key=self.match_key, match_keys=self.match_keys, selected_stat=self.values[0])
         await interaction.response.send_modal(modal)
 
 class PlayerSelect(Select):
-    def __init__(self, team1_info, team2_info):
-        self.team1_info = team1_info
-        self.team2_info = team2_info
+    def __init__(self, match_key, match_keys, custom_id=None):
+        self.match_key = match_key
+        self.match_keys = match_keys
+        team1_info = global_stats_manager.get_team_info('team1', match_key) or {}
+        team2_info = global_stats_manager.get_team_info('team2', match_key) or {}
         options = [
             discord.SelectOption(label=player, description="Team 1") for player in team1_info
         ] + [
             discord.SelectOption(label=player, description="Team 2") for player in team2_info
         ]
-        super().__init__(placeholder="Choose a player to correct", min_values=1, max_values=1, options=options)
+        kwargs = {'custom_id': custom_id} if custom_id else {}
+        super().__init__(placeholder="Choose a player to correct", min_values=1, max_values=1, options=options, **kwargs)
 
     async def callback(self, interaction: discord.Interaction):
         selected_player = self.values[0]
         self.view.clear_items()  # Clear previous items in the view
-        self.view.add_item(StatCorrectionSelect(selected_player, self.team1_info, self.team2_info))
+        self.view.add_item(StatCorrectionSelect(selected_player, self.match_key, self.match_keys))
         await interaction.response.edit_message(content=f"You selected {selected_player}. What needs correction?", view=self.view)
 
+class MatchSelect(Select):
+    def __init__(self, match_keys, custom_id):
+        self.match_keys = match_keys
+        options = []
+        # discord allows 25 options per select, /upload/batch/ caps batches at that (MAX_BATCH_MATCHES)
+        for index, match_key in enumerate(match_keys, start=1):
+            gen_info = global_stats_manager.get_gen_info(match_key) or ['?', '?', '?']
+            options.append(discord.SelectOption(label=f"Match {index}", value=match_key, description=f"{gen_info[0]} {gen_info[2]}"))
+        super().__init__(placeholder="Choose a match to correct", min_values=1, max_values=1, options=options, custom_id=custom_id)
+
+    async def callback(self, interaction: discord.Interaction):
+        selected_match = self.values[0]
+        self.view.clear_items()
+        self.view.add_item(PlayerSelect(selected_match, self.match_keys))
+        await interaction.response.edit_message(content="Which player needs correction?", view=self.view)
+
 class ConfirmationView(View):
-    def __init__(self, user_id, team1_info, team2_info):
+    def __init__(self, user_id, match_keys):
         super().__init__(timeout=None)
         self.user_id = user_id
-        self.team1_info = team1_info
-        self.team2_info = team2_info
-        self.add_item(PlayerSelect(team1_info, team2_info))
+        self.match_keys = match_keys
+        # custom ids are unique per review so the view can be re-attached after a restart
+        match = global_stats_manager.get_match(match_keys[0])
+        batch_key = match['batch_key'] if match else match_keys[0]
+        self.confirm_done.custom_id = f"confirm_done:{batch_key}"
+        # a batch picks the match first, a single upload goes straight to its players
+        if len(match_keys) > 1:
+            self.add_item(MatchSelect(match_keys, custom_id=f"match_select:{batch_key}"))
+        else:
+            self.add_item(PlayerSelect(match_keys[0], match_keys, custom_id=f"player_select:{batch_key}"))
 
     @discord.ui.button(label="Done", style=ButtonStyle.green, custom_id="confirm_done")
     async def confirm_done(self, interaction: discord.Interaction, button: discord.ui.Button):
         await interaction.response.send_message("Corrections are complete. Thank you!", ephemeral=True)
-        correction_completed_event.set()
-        
+        for match_key in self.match_keys:
+            global_stats_manager.mark_confirmed(match_key)
+
 
-async def confirm_stats(user_id, team1_info, team2_info):
-    user = await bot.fetch_user(user_id)
+def match_review_embed(match_key, index):
+    gen_info = global_stats_manager.get_gen_info(match_key) or ['?', '?', '?']
+    embed = discord.Embed(
+        title=f"Match {index}",
+        description=f"**Map:** {gen_info[0]}\n**Match Type:** {gen_info[1]}\n**Score:** {gen_info[2]}",
+        color=discord.Color.blurple()
+    )
+    embed.add_field(name="Team 1", value=botutils.format_player_stats(global_stats_manager.get_team_info('team1', match_key)) or "-", inline=False)
+    embed.add_field(name="Team 2", value=botutils.format_player_stats(global_stats_manager.get_team_info('team2', match_key)) or "-", inline=False)
+    return embed
+
+
+async def confirm_stats(user_id, match_keys):
+    """Send one review for every pending match and wait until the user marks them done."""
+    user = await messages.get_user(user_id)
     if user:
-        raw_team1 = botutils.format_player_stats(team1_info)
-        raw_team2 = botutils.format_player_stats(team2_info)
-        dm_channel = await user.create_dm()
-        view = ConfirmationView(user_id, team1_info, team2_info)
-        await dm_channel.send("Please review the stats and make corrections as needed.\n" + raw_team1 + "\n" + raw_team2, view=view)
-        await correction_completed_event.wait()  # Wait until the corrections are confirmed as done
-        correction_completed_event.clear()  # Reset the event for future use
+        embeds = [match_review_embed(match_key, index) for index, match_key in enumerate(match_keys, start=1)]
+        # discord allows 10 embeds per message
+        for start in range(0, len(embeds), 10):
+            messages.send_dm(user_id, embeds=embeds[start:start+10])
+        view = ConfirmationView(user_id, match_keys)
+        messages.send_dm(user_id, "Please review the stats and make corrections as needed.", view=view)
+        # Wait until the corrections are confirmed as done
+        await asyncio.gather(*(global_stats_manager.wait_for_confirmation(match_key) for match_key in match_keys))
+
+
+def register_confirmation_view(user_id, match_keys):
+    """Re-attach the review buttons of a message sent before a restart."""
+    bot.add_view(ConfirmationView(user_id, match_keys))
 
 
 # obtain correction from user mid-pipeline
 async def prompt_correction(user_id, extracted_name):
-    user = await bot.fetch_user(user_id)
+    user = await messages.get_user(user_id)
     if user:
-        dm_channel = await user.create_dm()
         message = (f"OCR extracted the name '{extracted_name}'. "
                    "Please reply with the correct name.")
-        await dm_channel.send(message)
+        messages.send_dm(user_id, message)
 
 @bot.command(name='upload', help='Fetch a screenshot from users and provide an access code.')
 async def upload(ctx):
     if not ctx.author.guild_permissions.administrator:
-        await ctx.send("You do not have permission to perform this action.")
+        messages.send(ctx, "You do not have permission to perform this action.")
         return
 
     # Generate a temporary access code
@@ -661,10 +1133,12 @@ async def upload(ctx):
     # Send the access code to the user's DM
     try:
         message = f"Your access code is: ```{access_code}```\nIt will expire in 5 minutes."
-        await ctx.author.send(message)
-        await ctx.send("Access code sent to your DMs.")
+        # wait for this one, a closed DM has to be reported back
+        await messages.send_dm(ctx.author.id, message)
+        messages.send(ctx, "Access code sent to your DMs.")
         # Prepare to send the access code and user ID to the backend
-        backend_url = 'http://127.0.0.1:8000/store_access_code/'
+        # in a split deployment the API runs apart from the bot, BACKEND_URL points at it
+        backend_url = os.getenv('BACKEND_URL', 'http://127.0.0.1:8000') + '/store_access_code/'
         json_data = {
             'user_id': str(ctx.author.id),
             'access_code': access_code
@@ -678,8 +1152,8 @@ async def upload(ctx):
                     print("Access code successfully sent to backend.")
                 else:
                     print("Failed to send access code to backend.")
-                    await ctx.send("Failed to process access code.")
+                    messages.send(ctx, "Failed to process access code.")
     except Exception as e:
         print(f"Error: {str(e)}")
-        await ctx.send("Failed to send DM. Please check your DM settings.")
+        messages.send(ctx, "Failed to send DM. Please check your DM settings.")
 
@@ -2,7 +2,10 @@
 
 import gspread
 import os
+import re
+import datetime
 from google.oauth2 import service_account
+from repository import repo
 
 STAT_TYPE_ORDER = ["Kills", "Deaths", "Assists"]
 
@@ -13,21 +16,49 @@ def format_player_stats(team_info):
     return formatted_message
 
 
-async def check_player_exists(pool, player_name):
+async def check_player_exists(player_name):
     """
     Check if a player exists in the database by name.
 
-    :param connection: The database connection object.
     :param player_name: The name of the player to check.
     :return: True if the player exists, False otherwise.
     """
+    return await repo.fetchval('player exists', player_name)
+    
 
-    async with pool.acquire() as connection:
+def ordinal(number):
+    """1 -> 1st, 2 -> 2nd, 11 -> 11th, 87 -> 87th."""
+    if 10 <= number % 100 <= 20:
+        return f"{number}th"
+    return f"{number}{ {1: 'st', 2: 'nd', 3: 'rd'}.get(number % 10, 'th') }"
+
+
+WINDOW_UNITS = {'d': 'days', 'w': 'weeks', 'h': 'hours'}
+
+def parse_stats_window(options):
+    """
+    Parse the optional filters of the !player command.
+
+    :param options: The words after the player name, e.g. ("--season", "2") or ("--last", "30d").
+    :return: (season number or None, timedelta or None). Raises ValueError on anything else.
+    """
+    season, window = None, None
+    options = list(options)
+    while options:
+        flag = options.pop(0).lower()
+        if not options:
+            raise ValueError(f"`{flag}` needs a value")
+        value = options.pop(0).lower()
+        if flag == '--season' and value.isdigit():
+            season = int(value)
+        elif flag == '--last' and (match := re.fullmatch(r'(\d+)([dwh])', value)):
+            window = datetime.timedelta(**{WINDOW_UNITS[match.group(2)]: int(match.group(1))})
+        else:
+            raise ValueError(f"Unknown option `{flag} {value}`, use `--season N` or `--last 30d`")
+    if season is not None and window is not None:
+        raise ValueError("Use either `--season` or `--last`, not both")
+    return season, window
 
-        query = "SELECT EXISTS(SELECT 1 FROM Players WHERE name ILIKE $1)"
-        exists = await connection.fetchval(query, player_name)
-        return exists
-    
 
 async def add_to_sheet(name, tracker_link, discord_id):
     # Define the scope of the application
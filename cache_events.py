@@ -0,0 +1,117 @@
+# CROSS-PROCESS CACHE INVALIDATION
+# the response cache, the name index and the percentile snapshot live in process memory, so a write made by
+# another process (an API worker, a second bot, backfill.py) would go unnoticed until a restart. every write
+# that changes what they show sends a NOTIFY on one channel and each process LISTENs on a pooled connection.
+#
+#   match    players in a written match: their cached answers, autocomplete and the percentile snapshot
+#   pfp      a new profile picture: cached answers showing that player
+#   player   a newly registered player: autocomplete
+#   all      anything that can touch everyone (reconcile repairs): every cached answer and the snapshot
+#   reload   bulk changes that also add players (backfill imports): all of the above plus the name index
+#
+# notifications sent inside a transaction are only delivered once it commits, and dropped if it rolls back.
+# a process skips its own events, it already updated its caches when it wrote. while the listening connection
+# is down events are lost, so after a reconnect everything is reloaded instead.
+
+import os
+import json
+import uuid
+import asyncio
+from repository import repo
+from response_cache import responses
+from name_index import names
+from percentiles import snapshot
+
+CHANNEL = 'prstats_cache'
+HEALTH_INTERVAL = float(os.getenv('CACHE_LISTEN_HEALTH_INTERVAL', 30))  # seconds between checks of the connection
+RECONNECT_DELAY = 5
+ORIGIN = uuid.uuid4().hex  # tells this process' own events apart, pids repeat across hosts
+
+
+async def notify(kind, players=(), connection=None):
+    """Send a cache event, on connection when given so it goes out with that transaction's commit."""
+    payload = json.dumps({'kind': kind, 'players': list(players), 'origin': ORIGIN})
+    await repo.execute('notify cache', CHANNEL, payload, connection=connection)
+
+
+class CacheListener:
+    def __init__(self):
+        self.task = None
+        self.connected = False
+        self.received = 0
+        self.reconnects = 0
+
+    def start(self):
+        """Start listening once the repository pool exists, later calls do nothing."""
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._listen())
+
+    async def _listen(self):
+        first = True
+        while True:
+            try:
+                async with repo.pool.acquire() as connection:
+                    await connection.add_listener(CHANNEL, self.on_notify)
+                    self.connected = True
+                    if not first:
+                        # whatever was sent while the connection was down is gone
+                        self.reconnects += 1
+                        await refresh_all()
+                    first = False
+                    try:
+                        while True:
+                            await asyncio.sleep(HEALTH_INTERVAL)
+                            await connection.fetchval("SELECT 1")
+                    finally:
+                        self.connected = False
+                        if not connection.is_closed():
+                            await connection.remove_listener(CHANNEL, self.on_notify)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Cache listener lost its connection: {e}")
+            await asyncio.sleep(RECONNECT_DELAY)
+
+    def on_notify(self, connection, pid, channel, payload):
+        try:
+            event = json.loads(payload)
+        except ValueError:
+            print(f"Ignoring malformed cache event: {payload!r}")
+            return
+        if event.get('origin') == ORIGIN:
+            return
+        self.received += 1
+        apply_event(event['kind'], event.get('players', []))
+
+    def stats(self):
+        return {'connected': self.connected, 'received': self.received, 'reconnects': self.reconnects}
+
+
+async def refresh_all():
+    responses.bump()
+    snapshot.schedule_refresh()
+    try:
+        await names.load()
+    except Exception as e:
+        print(f"Failed to reload the name index: {e}")
+
+
+def apply_event(kind, players):
+    if kind == 'match':
+        responses.bump(players)
+        names.add_players(players)
+        snapshot.schedule_refresh()
+    elif kind == 'pfp':
+        responses.bump(players)
+    elif kind == 'player':
+        names.add_players(players)
+    elif kind == 'all':
+        responses.bump()
+        snapshot.schedule_refresh()
+    elif kind == 'reload':
+        asyncio.create_task(refresh_all())
+    else:
+        print(f"Ignoring unknown cache event '{kind}'")
+
+
+listener = CacheListener()
@@ -0,0 +1,71 @@
+# CPU-BOUND TASKS RUN IN THE WORKER PROCESSES
+# every function here is top level and takes and returns plain picklable values, so workers.py can ship
+# it to a pool process. keep the imports light: each worker imports this module, never bot or utilities.
+
+import os
+from io import BytesIO
+import cv2
+import ocr_cache
+
+# loaded once per worker process by warm()
+model, device = None, None
+
+
+def warm():
+    """Pool initializer, loads the 6/9 CNN so the first upload a worker sees doesn't pay for it."""
+    global model, device
+    import torch
+    from model_handling import load_model
+    torch.set_num_threads(1)  # one process per core already, don't let torch oversubscribe
+    model, device = load_model('models')
+    model.eval()
+
+
+def slice_cells(image_path):
+    """Cut the stats image into its 5x3 grid of cells. Returns rows of (PNG bytes, saved crop path, cache key)."""
+    img = cv2.imread(image_path)
+    row_height = img.shape[0] // 5
+    # one crop directory per source image so concurrent uploads keep their cells apart, kept beside the image
+    # so whoever cleans up the image's directory removes the crops too
+    cropped_dir = os.path.join(os.path.dirname(image_path), 'chars_cropped', os.path.splitext(os.path.basename(image_path))[0])
+    os.makedirs(cropped_dir, exist_ok=True)
+
+    cells = []
+    for i in range(5):
+        row_img = img[i*row_height:(i+1)*row_height, :]
+        char_width = row_img.shape[1] // 3
+
+        row_cells = []
+        for j in range(3):
+            margin_w = int(0.1 * char_width)
+            margin_h = int(0.1 * row_height)
+            char_img = row_img[margin_h:-margin_h, (j*char_width+margin_w):((j+1)*char_width-margin_w)]
+            char_path = os.path.join(cropped_dir, f'row_{i+1}_char_{j+1}.png')
+            cv2.imwrite(char_path, char_img)
+            _, buffer = cv2.imencode('.png', char_img)
+            row_cells.append((buffer.tobytes(), char_path, ocr_cache.cell_key(char_img)))
+        cells.append(row_cells)
+    return cells
+
+
+def classify_six_nine(char_paths):
+    """Run the CNN over cells OCR read as 6 or 9. Returns '6' or '9' for each path."""
+    from model_handling import preprocess_image, predict
+    if model is None:
+        warm()
+    return ['6' if predict(model, device, preprocess_image(char_path)) == 0 else '9' for char_path in char_paths]
+
+
+def merge_pictures(content1, content2, standard_size=(256, 256)):
+    """Place two pictures side by side and return the composite as PNG bytes."""
+    from PIL import Image
+    image1 = Image.open(BytesIO(content1)).convert('RGB').resize(standard_size)
+    image2 = Image.open(BytesIO(content2)).convert('RGB').resize(standard_size)
+
+    dst = Image.new('RGB', (standard_size[0] * 2, standard_size[1]))
+    dst.paste(image1, (0, 0))
+    dst.paste(image2, (standard_size[0], 0))
+
+    output = BytesIO()
+    dst.save(output, format='PNG')
+    return output.getvalue()
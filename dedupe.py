@@ -0,0 +1,63 @@
+# UPLOAD DEDUPLICATION MODULE
+# a submission is fingerprinted by its four screenshots plus form fields so that
+# resubmitting the same match returns the stored result instead of writing it twice
+
+import asyncio
+import hashlib
+import json
+
+IMAGE_LABELS = ["team1_names", "team2_names", "team1_stats", "team2_stats"]
+
+# fingerprints currently being processed in this process, mapped to a future of their result
+in_flight = {}
+
+
+def fingerprint(images, map_name, match_type, final_score):
+    """Hash the raw image bytes and normalised form fields into a stable submission id."""
+    digest = hashlib.sha256()
+    for label in IMAGE_LABELS:
+        data = images.get(label) or b''
+        digest.update(label.encode())
+        digest.update(len(data).to_bytes(8, 'big'))
+        digest.update(data)
+    for field in (map_name.strip().lower(), match_type.strip().lower(), final_score.replace(' ', '')):
+        digest.update(b'\0')
+        digest.update(field.encode())
+    return digest.hexdigest()
+
+
+async def fetch_result(connection, upload_fingerprint):
+    """Return the stored result for a fingerprint, or None if it was never written."""
+    result = await connection.fetchval(
+        "SELECT result FROM Upload_Fingerprints WHERE fingerprint = $1", upload_fingerprint
+    )
+    return json.loads(result) if result is not None else None
+
+
+async def record_result(connection, upload_fingerprint, match_id, result):
+    """Store the result of a written upload. Run inside the write transaction so both land together."""
+    await connection.execute(
+        "INSERT INTO Upload_Fingerprints (fingerprint, match_id, result) VALUES ($1, $2, $3::jsonb)",
+        upload_fingerprint, match_id, json.dumps(result)
+    )
+
+
+def claim(upload_fingerprint):
+    """Mark a fingerprint as in progress. Returns the existing future if another request already owns it."""
+    existing = in_flight.get(upload_fingerprint)
+    if existing is not None:
+        return existing, False
+    future = asyncio.get_running_loop().create_future()
+    in_flight[upload_fingerprint] = future
+    return future, True
+
+
+def release(upload_fingerprint, result=None, error=None):
+    future = in_flight.pop(upload_fingerprint, None)
+    if future is None or future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+        future.exception()  # mark retrieved so an unawaited failure isn't logged
+    else:
+        future.set_result(result)
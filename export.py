@@ -0,0 +1,154 @@
+# BULK STATS EXPORT
+# streams Player_Stats joined with Matches, Maps and Players out of postgres with COPY and compresses
+# it chunk by chunk, so exporting the full history uses constant memory and never stalls the event loop
+
+import asyncio
+import datetime
+import tempfile
+import zlib
+
+try:
+    import pyarrow  # optional, only needed for parquet exports
+    import pyarrow.csv
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+FORMATS = ('csv', 'parquet')
+QUEUE_DEPTH = 16                 # compressed chunks buffered ahead of a slow reader
+SPOOL_LIMIT = 8 * 1024 * 1024    # parquet staging stays in memory up to this size, then moves to disk
+READ_SIZE = 256 * 1024
+
+# column order of the export, match_date first so the filters below can prune Player_Stats partitions
+EXPORT_QUERY = """
+    SELECT PS.match_date, PS.match_id, MP.map_name AS map, MT.description AS match_type, M.score,
+           P.name AS player, PS.kills, PS.deaths, PS.assists, PS.result
+    FROM Player_Stats PS
+    JOIN Matches M ON M.match_id = PS.match_id
+    JOIN Maps MP ON MP.map_id = M.map_id
+    JOIN Match_Types MT ON MT.match_type_id = M.match_type_id
+    JOIN Players P ON P.player_id = PS.player_id
+"""
+
+
+def build_query(player=None, map_name=None, since=None, until=None):
+    """Return the export query and its arguments for the given filters. since/until are dates, until is inclusive."""
+    conditions, args = [], []
+    if player:
+        args.append(player)
+        conditions.append(f"lower(P.name) = lower(${len(args)})")
+    if map_name:
+        args.append(map_name)
+        conditions.append(f"lower(MP.map_name) = lower(${len(args)})")
+    if since:
+        args.append(datetime.datetime.combine(since, datetime.time.min))
+        conditions.append(f"PS.match_date >= ${len(args)}")
+    if until:
+        args.append(datetime.datetime.combine(until + datetime.timedelta(days=1), datetime.time.min))
+        conditions.append(f"PS.match_date < ${len(args)}")
+    query = EXPORT_QUERY
+    if conditions:
+        query += "    WHERE " + " AND ".join(conditions) + "\n"
+    return query + "    ORDER BY PS.match_date, PS.match_id, P.name", args
+
+
+def parse_options(options):
+    """Parse `--player X --map Y --since 2024-01-01 --until 2024-02-01 --format parquet` into keyword filters."""
+    filters = {'format': 'csv'}
+    names = {'--player': 'player', '--map': 'map_name', '--since': 'since', '--until': 'until', '--format': 'format'}
+    options = list(options)
+    while options:
+        flag = options.pop(0).lower()
+        if flag not in names or not options:
+            raise ValueError(f"Unknown option `{flag}`, use {', '.join(f'`{name}`' for name in names)}")
+        value = options.pop(0)
+        if flag in ('--since', '--until'):
+            try:
+                value = datetime.date.fromisoformat(value)
+            except ValueError:
+                raise ValueError(f"`{flag}` expects a date like 2024-01-31")
+        filters[names[flag]] = value
+    filters['format'] = filters['format'].lower()
+    check_format(filters['format'])
+    return filters
+
+
+def check_format(export_format):
+    if export_format not in FORMATS:
+        raise ValueError(f"Format must be one of {', '.join(FORMATS)}")
+    if export_format == 'parquet' and pyarrow is None:
+        raise ValueError("Parquet exports need pyarrow installed, use csv instead")
+
+
+def filename(export_format, player=None, map_name=None, **_):
+    parts = ['prstats'] + [part.lower().replace(' ', '_') for part in (player, map_name) if part]
+    parts.append(datetime.date.today().isoformat())
+    return '_'.join(parts) + ('.csv.gz' if export_format == 'csv' else '.parquet')
+
+
+async def stream(connection, export_format='csv', player=None, map_name=None, since=None, until=None):
+    """Async generator of the export file's bytes. The connection is held until the generator finishes."""
+    check_format(export_format)
+    query, args = build_query(player, map_name, since, until)
+    chunks = stream_csv(connection, query, args) if export_format == 'csv' else stream_parquet(connection, query, args)
+    async for chunk in chunks:
+        yield chunk
+
+
+async def stream_csv(connection, query, args):
+    """COPY the query out as CSV and gzip it as the rows arrive."""
+    queue = asyncio.Queue(maxsize=QUEUE_DEPTH)
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31 writes a gzip header
+
+    async def compress(chunk):
+        data = await asyncio.to_thread(compressor.compress, chunk)
+        if data:
+            # blocks the COPY while the reader is behind, which is what keeps memory flat
+            await queue.put(data)
+
+    async def produce():
+        try:
+            await connection.copy_from_query(query, *args, output=compress, format='csv', header=True)
+            await queue.put(compressor.flush())
+        finally:
+            await queue.put(None)
+
+    task = asyncio.create_task(produce())
+    try:
+        while (data := await queue.get()) is not None:
+            yield data
+        await task  # surface a failed COPY instead of ending the file silently
+    finally:
+        task.cancel()
+
+
+# parquet needs the whole file before its footer can be written, so the CSV from COPY is staged in a
+# spooled temp file, converted batch by batch in a thread, and the result is streamed back out
+PARQUET_SCHEMA = {
+    'match_date': 'timestamp[us]', 'match_id': 'int32', 'map': 'string', 'match_type': 'string',
+    'score': 'string', 'player': 'string', 'kills': 'int32', 'deaths': 'int32', 'assists': 'int32',
+    'result': 'string'
+}
+
+
+def csv_to_parquet(source, target):
+    source.seek(0)
+    convert = pyarrow.csv.ConvertOptions(column_types={name: pyarrow.type_for_alias(alias) for name, alias in PARQUET_SCHEMA.items()})
+    reader = pyarrow.csv.open_csv(source, convert_options=convert)
+    with pyarrow.parquet.ParquetWriter(target, reader.schema, compression='zstd') as writer:
+        for batch in reader:
+            writer.write_batch(batch)
+    target.seek(0)
+
+
+async def stream_parquet(connection, query, args):
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_LIMIT) as staged, \
+            tempfile.SpooledTemporaryFile(max_size=SPOOL_LIMIT) as converted:
+
+        async def stage(chunk):
+            await asyncio.to_thread(staged.write, chunk)
+
+        await connection.copy_from_query(query, *args, output=stage, format='csv', header=True)
+        await asyncio.to_thread(csv_to_parquet, staged, converted)
+        while data := await asyncio.to_thread(converted.read, READ_SIZE):
+            yield data
@@ -3,19 +3,44 @@
 
 import uvicorn
 import os
+import argparse
+import shutil
+import tempfile
 import datetime
 import utilities
 import asyncio
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form
+from typing import List
+import asyncpg
+import dedupe
+import pending_store
+import resilience
+import migrations
+import export
+import reconcile
+import workers
+import cache_events
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Query, Response
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from write import write_match_data
+from write import write_matches, matches_committed
 from pydantic import BaseModel
-from bot import start_bot, confirm_stats, post_match_summary
+from bot import bot, start_bot, confirm_stats, post_match_summary, register_confirmation_view
 from stats_manager import global_stats_manager
+from response_cache import responses
+from repository import repo
+from percentiles import snapshot
+from name_index import names
 
 
 # define global instances
-codes = {}
+DEPLOY_MODE = os.getenv('DEPLOY_MODE', 'all')  # 'all' in one process, or 'bot' and 'api' run as separate processes
+CODE_TTL = 300  # access codes expire after 5 minutes
+PENDING_POLL_INTERVAL = float(os.getenv('PENDING_POLL_INTERVAL', 2))
+OCR_CONCURRENCY = int(os.getenv('OCR_CONCURRENCY', 4))
+EXPORT_TOKEN = os.getenv('EXPORT_TOKEN')
+RECONCILE_INTERVAL = int(os.getenv('RECONCILE_INTERVAL', 3600))  # seconds between incremental reconciles, 0 disables
+MAX_BATCH_MATCHES = 25  # the review lists a batch in one discord select, which holds at most 25 options
+ocr_slots = asyncio.Semaphore(OCR_CONCURRENCY)
 app = FastAPI()
 
 # Add CORS middleware for development flexibility
@@ -34,22 +59,45 @@ class AccessCodeData(BaseModel):
 
 async def cleanup_codes(interval: int = 300):
     while True:
-        current_time = datetime.datetime.now()
-        expired_keys = [key for key, val in codes.items() if val['expires'] < current_time]
-        for key in expired_keys:
-            del codes[key]
+        try:
+            await pending_store.store.purge_codes()
+        except Exception as e:
+            print(f"Failed to purge access codes: {e}")
         await asyncio.sleep(interval)
 
 
+async def reconcile_aggregates(interval: int = RECONCILE_INTERVAL):
+    """Repair aggregate drift for players whose stats changed since the last pass."""
+    while True:
+        await asyncio.sleep(interval)
+        connection = await utilities.create_connection()
+        if connection is None:
+            print("Reconcile skipped, the database is unreachable")
+            continue
+        try:
+            report = await reconcile.reconcile(connection, incremental=True)
+            for table, (missing, extra, mismatched, _) in report.items():
+                if missing or extra or mismatched:
+                    print(f"Reconciled {table}: {missing} missing, {extra} extra, {mismatched} mismatched rows")
+                    responses.bump()
+                    snapshot.schedule_refresh()
+                    await cache_events.notify('all', connection=connection)
+        except Exception as e:
+            print(f"Reconcile failed: {e}")
+        finally:
+            await connection.close()
+
+
 @app.post("/store_access_code/")
 async def store_access_code(data: AccessCodeData):
-    expiration_time = datetime.datetime.now() + datetime.timedelta(minutes=5)
-    codes[data.access_code] = {'user_id': data.user_id, 'expires': expiration_time}
+    # kept in the pending store so every API worker sees it
+    await pending_store.store.save_code(data.access_code, data.user_id, CODE_TTL)
     return {"message": "Access code stored"}
 
 
 @app.post("/upload/")
 async def upload_image(
+    response: Response,
     team1_names: UploadFile = File(...), 
     team2_names: UploadFile = File(...), 
     team1_stats: UploadFile = File(...), 
@@ -60,84 +108,489 @@ async def upload_image(
     match_type: str = Form(...)
 ):
     print("Endpoint Hit: Received images for processing.")
-    if access_code in codes and datetime.datetime.now() < codes[access_code]['expires']:
-        user_id = codes[access_code]['user_id']
-        files = {
-            "team1_names": team1_names,
-            "team2_names": team2_names,
-            "team1_stats": team1_stats,
-            "team2_stats": team2_stats
+    files = {
+        "team1_names": team1_names,
+        "team2_names": team2_names,
+        "team1_stats": team1_stats,
+        "team2_stats": team2_stats
+    }
+    images = {label: await file.read() for label, file in files.items()}
+    gen_info = [map, match_type, final_score]
+    upload_fingerprint = dedupe.fingerprint(images, map, match_type, final_score)
+    # checked before any stored or in-flight result is handed out, and a duplicate uses up its code too
+    user_id = await check_access_code(access_code)
+
+    # establish connection to the database
+    connection = await open_connection()
+    try:
+        # a resubmission of an already written match returns the stored result
+        previous = await dedupe.fetch_result(connection, upload_fingerprint)
+        if previous is not None:
+            print(f"Duplicate upload {upload_fingerprint[:12]}, returning match {previous['match_id']}")
+            result = {**previous, "duplicate": True}
+        else:
+            # the same submission is still being processed (double click, client retry), share its result
+            future, owner = dedupe.claim(upload_fingerprint)
+            if not owner:
+                print(f"Upload {upload_fingerprint[:12]} already in progress, waiting for it")
+                result = {**await asyncio.shield(future), "duplicate": True}
+            else:
+                try:
+                    result = await process_upload(connection, images, user_id, gen_info, upload_fingerprint)
+                except Exception as e:
+                    dedupe.release(upload_fingerprint, error=e)
+                    raise
+                dedupe.release(upload_fingerprint, result=result)
+    finally:
+        await connection.close()
+
+    await pending_store.store.delete_code(access_code)  # delete access code post-write
+    if result.get("status") == "pending":
+        response.status_code = 202
+    return result
+
+
+async def process_upload(connection, images, user_id, gen_info, upload_fingerprint):
+    match_key = upload_fingerprint[:16]
+    team1_info, team2_info = await ocr_match(images, match_key)
+    # team1 and team2 info are corrected during the review, then written to the db
+    results = await review_and_write(connection, user_id, [(match_key, team1_info, team2_info, gen_info, upload_fingerprint)])
+    return results[0]
+
+
+@app.post("/upload/batch/")
+async def upload_batch(
+    response: Response,
+    team1_names: List[UploadFile] = File(...),
+    team2_names: List[UploadFile] = File(...),
+    team1_stats: List[UploadFile] = File(...),
+    team2_stats: List[UploadFile] = File(...),
+    access_code: str = Form(...),
+    maps: List[str] = Form(...),
+    final_scores: List[str] = Form(...),
+    match_types: List[str] = Form(...)
+):
+    """Upload many matches at once. The n-th entry of every field belongs to the n-th match."""
+    fields = [team1_names, team2_names, team1_stats, team2_stats, maps, final_scores, match_types]
+    if len({len(field) for field in fields}) != 1:
+        raise HTTPException(status_code=400, detail="Every match needs four images, a map, a final score and a match type.")
+    if len(maps) > MAX_BATCH_MATCHES:
+        raise HTTPException(status_code=400, detail=f"A batch can hold at most {MAX_BATCH_MATCHES} matches, split it up.")
+    print(f"Endpoint Hit: Received batch of {len(maps)} matches.")
+
+    submissions = []
+    for index in range(len(maps)):
+        images = {
+            "team1_names": await team1_names[index].read(),
+            "team2_names": await team2_names[index].read(),
+            "team1_stats": await team1_stats[index].read(),
+            "team2_stats": await team2_stats[index].read()
         }
+        gen_info = [maps[index], match_types[index], final_scores[index]]
+        submissions.append((images, gen_info, dedupe.fingerprint(images, *gen_info)))
+    user_id = await check_access_code(access_code)
+
+    connection = await open_connection()
+    try:
+        results = [None] * len(submissions)
+        owned = {}    # fingerprint -> index of the first submission we process
+        waiting = {}  # index -> future owned by another request
+        for index, (images, gen_info, upload_fingerprint) in enumerate(submissions):
+            previous = await dedupe.fetch_result(connection, upload_fingerprint)
+            if previous is not None:
+                results[index] = {**previous, "duplicate": True}
+            elif upload_fingerprint not in owned:
+                future, owner = dedupe.claim(upload_fingerprint)
+                if owner:
+                    owned[upload_fingerprint] = index
+                else:
+                    waiting[index] = future
+
+        try:
+            written = await process_batch(connection, submissions, list(owned.values()), user_id)
+        except Exception as e:
+            for upload_fingerprint in owned:
+                dedupe.release(upload_fingerprint, error=e)
+            raise
+        for upload_fingerprint, index in owned.items():
+            results[index] = written[index]
+            dedupe.release(upload_fingerprint, result=written[index])
+
+        for index, future in waiting.items():
+            results[index] = {**await asyncio.shield(future), "duplicate": True}
+        # repeats inside the same batch point at the result of their first occurrence
+        for index, (_, _, upload_fingerprint) in enumerate(submissions):
+            if results[index] is None:
+                results[index] = {**results[owned[upload_fingerprint]], "duplicate": True}
+    finally:
+        await connection.close()
+
+    await pending_store.store.delete_code(access_code)  # delete access code post-write
+    if any(result.get("status") == "pending" for result in results):
+        response.status_code = 202
+    return {"matches": results}
+
+
+async def process_batch(connection, submissions, indices, user_id):
+    """OCR the given submissions concurrently, confirm them together and write them in one transaction."""
+    if not indices:
+        return {}
+
+    match_keys = [submissions[index][2][:16] for index in indices]
+    boards = await asyncio.gather(*(ocr_match(submissions[index][0], match_key) for index, match_key in zip(indices, match_keys)))
+    staged = [
+        (match_key, team1_info, team2_info, submissions[index][1], submissions[index][2])
+        for index, match_key, (team1_info, team2_info) in zip(indices, match_keys, boards)
+    ]
+    results = await review_and_write(connection, user_id, staged)
+    return dict(zip(indices, results))
+
+
+async def review_and_write(connection, user_id, staged):
+    """Send OCR'd matches for review and write them once confirmed. staged holds (match_key, team1, team2, gen_info, fingerprint)."""
+    if DEPLOY_MODE == 'api':
+        # the bot process sends the review and writes the matches, the review can stay open for a long time
+        # so the uploader polls the status endpoint for the results instead of holding this request open
+        await stage_matches(staged, user_id, pending_store.STAGE_STAGED)
+        return [pending_result(match_key, upload_fingerprint) for match_key, *_, upload_fingerprint in staged]
+
+    await stage_matches(staged, user_id, pending_store.STAGE_OCR_DONE)
+    match_keys = [match_key for match_key, *_ in staged]
+    await confirm_stats(user_id, match_keys)
+    return await finish_matches(connection, match_keys)
+
+
+async def stage_matches(staged, user_id, stage):
+    """Hold OCR'd matches for review and persist them as one batch, so a restart resumes at the review instead of redoing OCR."""
+    batch_key = staged[0][0]
+    for match_key, team1_info, team2_info, gen_info, upload_fingerprint in staged:
+        global_stats_manager.add_match(match_key, team1_info, team2_info, gen_info, user_id, upload_fingerprint, batch_key, stage)
+    await pending_store.store.save_many([pending_store.to_record(match_key, global_stats_manager.get_match(match_key)) for match_key, *_ in staged])
+    if stage == pending_store.STAGE_STAGED:
+        # from here the bot process owns them
+        for match_key, *_ in staged:
+            global_stats_manager.remove_match(match_key)
+
+
+def pending_result(match_key, upload_fingerprint):
+    return {
+        "status": "pending",
+        "match_key": match_key,
+        "status_url": f"/upload/status/{upload_fingerprint}"
+    }
+
+
+@app.get("/upload/status/{upload_fingerprint}")
+async def upload_status(upload_fingerprint: str, response: Response):
+    """Result of a staged upload once the bot process wrote it, 202 while its review is still open."""
+    # the bot process deletes the pending record after the write commits, so checking in this order
+    # never misses an upload that is between the two
+    for record in await pending_store.store.load_all():
+        if record['fingerprint'] == upload_fingerprint:
+            response.status_code = 202
+            return pending_result(record['match_key'], upload_fingerprint)
+
+    connection = await open_connection()
+    try:
+        result = await dedupe.fetch_result(connection, upload_fingerprint)
+    finally:
+        await connection.close()
+    if result is not None:
+        return {**result, "duplicate": False}
+    raise HTTPException(status_code=404, detail="No pending or written upload has this key, its review may have been declined.")
+
+
+async def finish_matches(connection, match_keys):
+    """Write confirmed matches in one transaction, then post their summaries and clear them from the pending store."""
+    for match_key in match_keys:
+        await global_stats_manager.set_stage(match_key, pending_store.STAGE_CONFIRMED)
+    matches = {match_key: global_stats_manager.get_match(match_key) for match_key in match_keys}
+
+    try:
+        for attempt in range(2):
+            results = {}
+            fresh = []
+            for match_key, match in matches.items():
+                previous = await dedupe.fetch_result(connection, match['fingerprint'])
+                if previous is not None:
+                    results[match_key] = {**previous, "duplicate": True}
+                else:
+                    fresh.append(match_key)
+
+            # the matches and their fingerprints are written together so a retry can never double count
+            try:
+                async with connection.transaction():
+                    match_ids = await write_matches(connection, [
+                        (matches[match_key]['team1'], matches[match_key]['team2'], matches[match_key]['gen_info']) for match_key in fresh
+                    ])
+                    for match_key, match_id in zip(fresh, match_ids):
+                        match = matches[match_key]
+                        result = match_result(match_id, match['team1'], match['team2'], match['gen_info'])
+                        await dedupe.record_result(connection, match['fingerprint'], match_id, result)
+                        results[match_key] = {**result, "duplicate": False}
+                break
+            except asyncpg.UniqueViolationError:
+                # another process wrote one of these first and our transaction rolled back, write the rest again
+                if attempt:
+                    raise
+        matches_committed([(matches[match_key]['team1'], matches[match_key]['team2'], matches[match_key]['gen_info']) for match_key in fresh])
+        await pending_store.store.delete(match_keys)
+    finally:
+        for match_key in match_keys:
+            global_stats_manager.remove_match(match_key)
+
+    for match_key in fresh:
+        match = matches[match_key]
+        await post_match_summary(match['team1'], match['team2'], match['gen_info'])
+    return [results[match_key] for match_key in match_keys]
+
+
+# batch keys this process is reviewing or writing, so polling doesn't pick them up twice
+adopted = set()
+
+
+async def recover_pending():
+    """Reload matches that were pending when the process stopped and resume each from its last completed stage."""
+    await bot.wait_until_ready()
+    records = await pending_store.store.load_all()
+    batches = adopt_pending(records)
+    if records:
+        print(f"Recovered {len(records)} pending matches in {len(batches)} reviews")
+
+
+async def watch_pending(interval: float = PENDING_POLL_INTERVAL):
+    """Bot process side of a split deployment, picks up the batches API workers staged."""
+    await bot.wait_until_ready()
+    while True:
+        try:
+            adopt_pending(await pending_store.store.load_all(pending_store.STAGE_STAGED))
+        except Exception as e:
+            print(f"Failed to load staged matches: {e}")
+        await asyncio.sleep(interval)
+
 
+def adopt_pending(records):
+    batches = {}
+    for record in records:
+        if record['batch_key'] in adopted:
+            continue
+        global_stats_manager.add_match(record['match_key'], record['team1'], record['team2'], record['gen_info'],
+                                       record['user_id'], record['fingerprint'], record['batch_key'], record['stage'])
+        batches.setdefault(record['batch_key'], []).append(record)
+
+    for batch_key, batch in batches.items():
+        adopted.add(batch_key)
+        match_keys = [record['match_key'] for record in batch]
+        stages = {record['stage'] for record in batch}
+        if pending_store.STAGE_STAGED in stages:
+            # staged by an API worker, the review hasn't been sent yet
+            asyncio.create_task(review_batch(batch[0]['user_id'], match_keys, batch_key))
+            continue
+        if pending_store.STAGE_OCR_DONE in stages:
+            # the review DM is still out there, re-attach its buttons
+            register_confirmation_view(batch[0]['user_id'], match_keys)
+        else:
+            for match_key in match_keys:
+                global_stats_manager.mark_confirmed(match_key)
+        asyncio.create_task(resume_batch(match_keys, batch_key))
+    return batches
+
+
+async def review_batch(user_id, match_keys, batch_key):
+    for match_key in match_keys:
+        await global_stats_manager.set_stage(match_key, pending_store.STAGE_OCR_DONE)
+    await confirm_stats(user_id, match_keys)
+    await resume_batch(match_keys, batch_key)
+
+
+async def resume_batch(match_keys, batch_key=None):
+    try:
+        await asyncio.gather(*(global_stats_manager.wait_for_confirmation(match_key) for match_key in match_keys))
+        connection = await utilities.create_connection()
+        try:
+            await finish_matches(connection, match_keys)
+        finally:
+            await connection.close()
+    finally:
+        adopted.discard(batch_key)
+
+
+async def open_connection():
+    """Connect for a request, answering 503 when the database is unreachable."""
+    connection = await utilities.create_connection()
+    if connection is None:
+        raise HTTPException(status_code=503, detail="The database is unavailable, please try again later.")
+    return connection
+
+
+async def check_access_code(access_code):
+    """Return the user the access code was issued to, or reject the request."""
+    user_id = await pending_store.store.get_code(access_code)
+    if user_id is None:
+        raise HTTPException(status_code=403, detail="Invalid or expired access code.")
+    return user_id
+
+
+async def run_ocr(paths):
+    """OCR both teams of one match, their images share Vision batches with every other upload in flight."""
+    team1_info = {}
+    team2_info = {}
+    await asyncio.gather(
+        utilities.process_team(paths['team1_names'], paths['team1_stats'], team1_info),
+        utilities.process_team(paths['team2_names'], paths['team2_stats'], team2_info)
+    )
+    return utilities.clean_board(team1_info), utilities.clean_board(team2_info)
+
+
+async def ocr_match(images, match_key):
+    # the saved uploads, the processed stats images and the cell crops are all written in this
+    # directory, and removed with it once the match is read
+    work_dir = tempfile.mkdtemp(prefix=f"match_{match_key}_")
+    try:
         paths = {}
-        for label, file in files.items():
-            image_data = await file.read()
+        for label, image_data in images.items():
             if image_data:  # Check if data is actually received
                 print(f"Data for {label} received, size {len(image_data)} bytes")
             else:
                 print(f"No data received for {label}")
                 continue  # Skip further processing for this file
-            paths[label] = save_image(image_data, label)
+            paths[label] = save_image(image_data, work_dir, label)
 
-        gen_info = [map, match_type, final_score]
-        team1_info = {}
-        team2_info = {}
+        # files are saved now process each team, a few matches at a time
+        async with ocr_slots:
+            return await run_ocr(paths)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
 
-        # files are saved now process each team
-        utilities.process_team(paths['team1_names'], paths['team1_stats'], team1_info)
-        utilities.process_team(paths['team2_names'], paths['team2_stats'], team2_info)
-        team1_info = utilities.clean_board(team1_info)
-        team2_info = utilities.clean_board(team2_info)
 
-        # establish connection to the database
-        connection = await utilities.create_connection()
-     #   db_names = utilities.get_all_player_names(connection)
+def match_result(match_id, team1_info, team2_info, gen_info):
+    return {
+        "match_id": match_id,
+        "map": gen_info[0],
+        "match_type": gen_info[1],
+        "final_score": gen_info[2],
+        "team1": team1_info,
+        "team2": team2_info
+    }
 
-       # await utilities.process_names(team1_info.keys(), db_names, user_id, team1_info)
-       # await utilities.process_names(team2_info.keys(), db_names, user_id, team2_info)
-        
-        global_stats_manager.set_teams(team1_info, team2_info)
-
-        await confirm_stats(user_id, team1_info, team2_info)
+def save_image(image_data, directory, label):
+    """Save the image to the match's temporary directory and return the path."""
+    file_path = os.path.join(directory, f'{label}.png')
+    with open(file_path, 'wb') as image_file:
+        image_file.write(image_data)
+    return file_path
 
-        team1_info = global_stats_manager.get_team_info('team1')
-        team2_info = global_stats_manager.get_team_info('team2')
-        # team1 and team2 info now correct, write to the db
+@app.get("/export/")
+async def export_stats(
+    token: str = Query(...),
+    format: str = Query('csv'),
+    player: str = Query(None),
+    map: str = Query(None),
+    since: datetime.date = Query(None),
+    until: datetime.date = Query(None)
+):
+    # exports are for organisers, the route is off unless EXPORT_TOKEN is set
+    if not EXPORT_TOKEN or token != EXPORT_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid export token")
+    try:
+        export.check_format(format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-        # we write to the db here
-        # Assuming conn is your active database connection
-        await post_match_summary(team1_info, team2_info, gen_info)
-        await write_match_data(connection, team1_info, team2_info, gen_info)
+    async def body():
+        connection = await utilities.create_connection()
+        try:
+            async for chunk in export.stream(connection, format, player, map, since, until):
+                yield chunk
+        finally:
+            await connection.close()
 
-        del codes[access_code]  # delete access code post-write
-    else:
-        raise HTTPException(status_code=403, detail="Invalid or expired access code.")
-    return
+    media_type = "application/gzip" if format == 'csv' else "application/vnd.apache.parquet"
+    name = export.filename(format, player, map)
+    return StreamingResponse(body(), media_type=media_type, headers={"Content-Disposition": f'attachment; filename="{name}"'})
 
-def save_image(image_data, label):
-    """Save the image to a temporary directory and return the path."""
-    os.makedirs('temp_images', exist_ok=True)
-    file_path = f'temp_images/{label}.png'
-    with open(file_path, 'wb') as image_file:
-        image_file.write(image_data)
-    return file_path
 
 @app.get("/ping")
 def ping():
     return {"message": "pong"}
 
 
-async def main():
+@app.get("/health/upstreams")
+def upstream_health():
+    return resilience.status()
+
+
+@app.get("/health/workers")
+def worker_health():
+    return workers.cpu_pool.stats()
+
+
+@app.get("/health/queries")
+def query_health():
+    return repo.stats()
+
+
+@app.get("/health/caches")
+def cache_health():
+    return {'responses': responses.stats(), 'names': names.stats(), 'snapshot': snapshot.stats(),
+            'listener': cache_events.listener.stats()}
+
+
+@app.on_event("startup")
+async def start_api_worker():
+    # in the all-in-one mode main() starts the pool
+    if DEPLOY_MODE == 'api':
+        workers.cpu_pool.start()
+
+
+async def main(mode='all', port=8000):
+    """Run the bot and its background jobs, plus the API unless it runs in its own workers (mode 'bot')."""
+
+    # bring the schema up to date before anything touches the database
+    connection = await utilities.create_connection()
+    try:
+        await migrations.migrate(connection)
+    finally:
+        await connection.close()
 
     asyncio.create_task(cleanup_codes())
+    asyncio.create_task(recover_pending())
+    if RECONCILE_INTERVAL:
+        asyncio.create_task(reconcile_aggregates())
+    if mode == 'bot':
+        # uploads arrive through the API workers, OCR happens there
+        asyncio.create_task(watch_pending())
+        await start_bot()
+        return
+
+    # worker processes load the CNN while the rest of the app starts
+    workers.cpu_pool.start()
     # Create a task for the bot
     bot_task = asyncio.create_task(start_bot())
     # Start the FastAPI app
-    config = uvicorn.Config(app, host="0.0.0.0", port=8000)
+    config = uvicorn.Config(app, host="0.0.0.0", port=port)
     server = uvicorn.Server(config)
     await server.serve()
     # Wait for the bot task to finish (it generally won't unless there's an error or shutdown)
     await bot_task
 
+
+def run_api(worker_count, port=8000):
+    """Run only the API, in worker_count uvicorn processes. The bot process must be running separately."""
+    os.environ['DEPLOY_MODE'] = 'api'  # read by every worker process when it imports this module
+    uvicorn.run("fastapp:app", host="0.0.0.0", port=port, workers=worker_count)
+
+
 if __name__ == "__main__":
-    asyncio.run(main())
+    # python fastapp.py              everything in one process
+    # python fastapp.py bot          the discord bot, reviews, writes and background jobs
+    # python fastapp.py api -w 4     upload API workers, any number of these can run next to one bot process
+    parser = argparse.ArgumentParser(description="Run the PRStats backend.")
+    parser.add_argument('mode', nargs='?', choices=['all', 'bot', 'api'], default=DEPLOY_MODE)
+    parser.add_argument('-w', '--workers', type=int, default=int(os.getenv('API_WORKERS', 2)))
+    parser.add_argument('--port', type=int, default=int(os.getenv('PORT', 8000)))
+    args = parser.parse_args()
+    if args.mode == 'api':
+        run_api(args.workers, args.port)
+    else:
+        asyncio.run(main(args.mode, args.port))
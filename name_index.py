@@ -0,0 +1,71 @@
+# PREFIX INDEX OVER PLAYER AND MAP NAMES
+# slash command autocomplete fires on every keystroke and has to answer within discord's deadline, so
+# suggestions come from tries held in memory instead of the database. they are loaded once when the bot
+# connects and write.py adds players as their first match is written.
+
+import asyncio
+from repository import repo
+
+AUTOCOMPLETE_LIMIT = 25  # discord shows at most 25 choices
+END = ''  # key of the name stored at a node, can't collide with a single character
+
+
+class PrefixTrie:
+    """Case insensitive prefix lookup that keeps the names as they were registered."""
+
+    def __init__(self, names=()):
+        self.root = {}
+        self.size = 0
+        for name in names:
+            self.add(name)
+
+    def add(self, name):
+        node = self.root
+        for char in name.lower():
+            node = node.setdefault(char, {})
+        if END not in node:
+            self.size += 1
+        node[END] = name
+
+    def complete(self, prefix, limit=AUTOCOMPLETE_LIMIT):
+        """Return up to limit names starting with prefix in alphabetical order (a name before the longer ones it starts)."""
+        node = self.root
+        for char in prefix.lower():
+            node = node.get(char)
+            if node is None:
+                return []
+
+        # depth first, children pushed in reverse so they pop in order. stops as soon as the list is full
+        results = []
+        stack = [node]
+        while stack and len(results) < limit:
+            node = stack.pop()
+            if END in node:
+                results.append(node[END])
+            stack.extend(node[char] for char in sorted((char for char in node if char != END), reverse=True))
+        return results
+
+
+class NameIndex:
+    def __init__(self):
+        self.players = PrefixTrie()
+        self.maps = PrefixTrie()
+        self.loaded = False
+
+    async def load(self):
+        """Rebuild both tries from the database, swapped in whole so lookups never see a partial index."""
+        players, maps = await asyncio.gather(repo.fetch('player names'), repo.fetch('map names'))
+        self.players = PrefixTrie(row['name'] for row in players)
+        self.maps = PrefixTrie(row['map_name'] for row in maps)
+        self.loaded = True
+        print(f"Name index loaded with {self.players.size} players and {self.maps.size} maps")
+
+    def add_players(self, names):
+        for name in names:
+            self.players.add(name)
+
+    def stats(self):
+        return {'loaded': self.loaded, 'players': self.players.size, 'maps': self.maps.size}
+
+
+names = NameIndex()
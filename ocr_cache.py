@@ -0,0 +1,114 @@
+# PERCEPTUAL-HASH CACHE FOR OCR RESULTS OF SCOREBOARD STAT CELLS
+# the scoreboard font never changes, so the same digit crops show up on every upload.
+# cells are keyed by a hash of their normalised glyph and the recognised text is reused.
+
+import os
+import json
+import threading
+from collections import OrderedDict
+import cv2
+
+OCR_CACHE_SIZE = int(os.getenv('OCR_CACHE_SIZE', 4096))
+OCR_CACHE_PATH = os.getenv('OCR_CACHE_PATH')  # optional persistence file, disabled when unset
+HASH_SIZE = 16  # 16x16 difference hash -> 256 bit key
+
+
+def normalise_cell(cell_img):
+    """Reduce a cell crop to a binary glyph cropped to its ink, so offsets and lighting don't change the hash."""
+    gray = cell_img if cell_img.ndim == 2 else cv2.cvtColor(cell_img, cv2.COLOR_BGR2GRAY)
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    # the glyph is whichever class covers less of the cell
+    if cv2.countNonZero(binary) > binary.size // 2:
+        binary = cv2.bitwise_not(binary)
+    points = cv2.findNonZero(binary)
+    if points is None:
+        return None
+    x, y, w, h = cv2.boundingRect(points)
+    return binary[y:y+h, x:x+w]
+
+
+def cell_key(cell_img):
+    """Return the cache key for a stat cell: aspect bucket plus a difference hash of the glyph."""
+    glyph = normalise_cell(cell_img)
+    if glyph is None:
+        return 'empty'
+    h, w = glyph.shape
+    # aspect ratio keeps one digit and two digit cells apart once both are squashed to a square
+    aspect = min(int(round(4 * w / h)), 15)
+    small = cv2.resize(glyph, (HASH_SIZE + 1, HASH_SIZE), interpolation=cv2.INTER_AREA)
+    diff = small[:, 1:] > small[:, :-1]
+    bits = 0
+    for bit in diff.flatten():
+        bits = (bits << 1) | int(bit)
+    return f"{aspect:x}:{bits:0{HASH_SIZE * HASH_SIZE // 4}x}"
+
+
+class OCRCache:
+    def __init__(self, max_size=OCR_CACHE_SIZE, path=OCR_CACHE_PATH):
+        self.max_size = max_size
+        self.path = path
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.dirty = False
+        self.lock = threading.Lock()
+        if self.path:
+            self.load()
+
+    def get(self, key):
+        with self.lock:
+            text = self.entries.get(key)
+            if text is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return text
+
+    def put(self, key, text):
+        with self.lock:
+            self.entries[key] = text
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)  # evict least recently used
+            self.dirty = True
+
+    async def read_through(self, key, read):
+        """Cached text for key, or await read() and cache what it returns. Fallback readings aren't cached."""
+        text = self.get(key)
+        if text is None:
+            text = await read()
+            if not getattr(text, 'fallback', False):
+                self.put(key, text)
+        return text
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r') as file:
+                stored = json.load(file)
+        except (OSError, ValueError) as e:
+            print(f"Could not load OCR cache from {self.path}: {e}")
+            return
+        # file is written oldest first, so replaying it restores the LRU order
+        for key, text in stored:
+            self.put(key, text)
+        self.dirty = False
+        print(f"Loaded {len(self.entries)} cached OCR cells from {self.path}")
+
+    def save(self):
+        """Persist the cache if a path is configured and anything changed since the last save."""
+        if not self.path or not self.dirty:
+            return
+        with self.lock:
+            snapshot = list(self.entries.items())
+            self.dirty = False
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as file:
+            json.dump(snapshot, file)
+        os.replace(tmp_path, self.path)
+
+
+# global instance shared by every upload
+cell_cache = OCRCache()
@@ -0,0 +1,100 @@
+# ASYNC OCR GATEWAY
+# images from every in-flight upload are collected for a few milliseconds and sent to
+# Vision as a single batch_annotate_images call, then the answers are handed back to each caller
+
+import os
+import asyncio
+import resilience
+from google.cloud import vision
+
+BATCH_WINDOW = float(os.getenv('OCR_BATCH_WINDOW_MS', 20)) / 1000
+BATCH_LIMIT = 16                    # images per batch_annotate_images request allowed by the API
+BATCH_BYTES = 8 * 1024 * 1024       # stay under the 10MB request payload limit
+
+
+class FallbackText(str):
+    """Text read by the local fallback while Vision was unavailable. Good enough for this upload, but it
+    must not be cached, or every later upload of the same glyph would keep the weaker reading."""
+    fallback = True
+
+
+class OCRGateway:
+    def __init__(self, credentials, local_ocr=None):
+        self.credentials = credentials
+        self.local_ocr = local_ocr  # blocking bytes -> text function used when Vision is down
+        self.client = None
+        self.pending = []  # (image bytes, future) waiting for the next batch
+        self.pending_bytes = 0
+        self.flush_handle = None
+        self.tasks = set()  # batches being sent, the loop only keeps weak references to tasks
+        self.batches_sent = 0
+        self.images_sent = 0
+
+    def get_client(self):
+        # the async client binds to the running loop, so create it on first use
+        if self.client is None:
+            self.client = vision.ImageAnnotatorAsyncClient(credentials=self.credentials)
+        return self.client
+
+    async def detect_text(self, content):
+        """Return the full text Vision finds in the image, or 'No text found'."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        if self.pending and self.pending_bytes + len(content) > BATCH_BYTES:
+            self.flush()
+        self.pending.append((content, future))
+        self.pending_bytes += len(content)
+        if len(self.pending) >= BATCH_LIMIT:
+            self.flush()
+        elif self.flush_handle is None:
+            self.flush_handle = loop.call_later(BATCH_WINDOW, self.flush)
+        return await future
+
+    def flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if not self.pending:
+            return
+        batch, self.pending, self.pending_bytes = self.pending, [], 0
+        task = asyncio.create_task(self.send(batch))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def send(self, batch):
+        requests = [
+            vision.AnnotateImageRequest(
+                image=vision.Image(content=content),
+                features=[vision.Feature(type_=vision.Feature.Type.TEXT_DETECTION)]
+            )
+            for content, _ in batch
+        ]
+        self.batches_sent += 1
+        self.images_sent += len(batch)
+        try:
+            response = await resilience.call('vision', self.get_client().batch_annotate_images, requests=requests)
+        except Exception as e:
+            print(f"Vision batch of {len(batch)} images failed: {e}")
+            await self.fall_back(batch, e)
+            return
+
+        for (_, future), result in zip(batch, response.responses):
+            if future.done():
+                continue
+            if result.error.message:
+                future.set_exception(RuntimeError(f"Vision error: {result.error.message}"))
+            else:
+                texts = result.text_annotations
+                future.set_result(texts[0].description if texts else "No text found")
+
+    async def fall_back(self, batch, error):
+        for content, future in batch:
+            if future.done():
+                continue
+            if self.local_ocr is None:
+                future.set_exception(error)
+                continue
+            try:
+                future.set_result(FallbackText(await asyncio.to_thread(self.local_ocr, content)))
+            except Exception as e:
+                future.set_exception(e)
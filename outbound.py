@@ -0,0 +1,166 @@
+# OUTBOUND DISCORD MESSAGING
+# every message the bot sends goes through a queue per route (channel or DM) with its own send budget,
+# so bursts are smoothed out before discord rate limits kick in and command handlers never wait on a send
+
+import os
+import asyncio
+import time
+import discord
+
+ROUTE_MESSAGES = int(os.getenv('OUTBOUND_ROUTE_MESSAGES', 5))        # messages allowed per route...
+ROUTE_WINDOW = float(os.getenv('OUTBOUND_ROUTE_WINDOW', 5.0))        # ...in this many seconds
+GLOBAL_PER_SECOND = int(os.getenv('OUTBOUND_GLOBAL_PER_SECOND', 40))  # discord's global limit is 50/s
+QUEUE_LIMIT = int(os.getenv('OUTBOUND_QUEUE_LIMIT', 100))
+SUMMARY_DELAY = float(os.getenv('OUTBOUND_SUMMARY_DELAY', 3.0))      # how long summaries wait to be merged
+MAX_RETRIES = 3
+
+
+class TokenBucket:
+    def __init__(self, capacity, period):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def penalise(self, seconds):
+        """Stop handing out tokens for a while, used when discord answers with a 429 anyway."""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                await asyncio.sleep(self.blocked_until - now)
+                continue
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class Route:
+    def __init__(self, key):
+        self.key = key
+        self.queue = asyncio.Queue(maxsize=QUEUE_LIMIT)
+        self.bucket = TokenBucket(ROUTE_MESSAGES, ROUTE_WINDOW)
+        self.worker = None
+
+
+class Outbound:
+    def __init__(self, bot):
+        self.bot = bot
+        self.routes = {}
+        self.global_bucket = TokenBucket(GLOBAL_PER_SECOND, 1.0)
+        self.users = {}
+        self.dm_channels = {}
+        self.summaries = {}  # channel id -> embeds waiting to be merged into one post
+        self.dropped = 0
+
+    def submit(self, route_key, send):
+        """Queue a zero-argument coroutine factory on a route. Returns a future of the sent message.
+
+        Callers that don't care about delivery can ignore the future, a failed send is only logged.
+        """
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(lambda done: done.cancelled() or done.exception())
+        route = self.routes.get(route_key)
+        if route is None:
+            route = self.routes[route_key] = Route(route_key)
+        if route.worker is None or route.worker.done():
+            route.worker = asyncio.create_task(self._drain(route))
+        try:
+            route.queue.put_nowait((send, future))
+        except asyncio.QueueFull:
+            # shed load instead of making the caller wait behind a full queue
+            self.dropped += 1
+            print(f"Outbound queue for {route_key} is full, dropping message")
+            future.set_exception(RuntimeError(f"outbound queue for {route_key} is full"))
+        return future
+
+    async def _drain(self, route):
+        while True:
+            send, future = await route.queue.get()
+            for attempt in range(MAX_RETRIES + 1):
+                await self.global_bucket.acquire()
+                await route.bucket.acquire()
+                try:
+                    result = await send()
+                except discord.HTTPException as e:
+                    if e.status == 429 and attempt < MAX_RETRIES:
+                        retry_after = getattr(e, 'retry_after', None) or ROUTE_WINDOW
+                        print(f"Rate limited on {route.key}, backing off {retry_after:.1f}s")
+                        route.bucket.penalise(retry_after)
+                        continue
+                    print(f"Failed to send on {route.key}: {e}")
+                    if not future.done():
+                        future.set_exception(e)
+                except Exception as e:
+                    print(f"Failed to send on {route.key}: {e}")
+                    if not future.done():
+                        future.set_exception(e)
+                else:
+                    if not future.done():
+                        future.set_result(result)
+                break
+            route.queue.task_done()
+
+    # destinations
+
+    def send(self, messageable, *args, **kwargs):
+        # a command context routes through the channel it was invoked in
+        channel = getattr(messageable, 'channel', messageable)
+        return self.submit(f"channel:{channel.id}", lambda: messageable.send(*args, **kwargs))
+
+    def reply(self, ctx, *args, **kwargs):
+        return self.submit(f"channel:{ctx.channel.id}", lambda: ctx.reply(*args, **kwargs))
+
+    def send_dm(self, user_id, *args, **kwargs):
+        async def send():
+            channel = await self.get_dm_channel(user_id)
+            return await channel.send(*args, **kwargs)
+        return self.submit(f"dm:{user_id}", send)
+
+    # cached lookups, fetch_user and create_dm are REST calls so each user costs them once
+
+    async def get_user(self, user_id):
+        user_id = int(user_id)
+        user = self.users.get(user_id) or self.bot.get_user(user_id)
+        if user is None:
+            user = await self.bot.fetch_user(user_id)
+        self.users[user_id] = user
+        return user
+
+    async def get_dm_channel(self, user_id):
+        user_id = int(user_id)
+        channel = self.dm_channels.get(user_id)
+        if channel is None:
+            user = await self.get_user(user_id)
+            channel = user.dm_channel or await user.create_dm()
+            self.dm_channels[user_id] = channel
+        return channel
+
+    # match summaries are merged so a burst of uploads becomes a few posts of up to 10 embeds
+
+    def post_summary(self, channel, embed):
+        pending = self.summaries.get(channel.id)
+        if pending is None:
+            pending = self.summaries[channel.id] = []
+            asyncio.get_running_loop().call_later(SUMMARY_DELAY, self._flush_summaries, channel)
+        pending.append(embed)
+
+    def _flush_summaries(self, channel):
+        embeds = self.summaries.pop(channel.id, [])
+        for start in range(0, len(embeds), 10):
+            self.send(channel, embeds=embeds[start:start+10])
+
+    def stats(self):
+        return {
+            'queued': {key: route.queue.qsize() for key, route in self.routes.items() if route.queue.qsize()},
+            'dropped': self.dropped,
+            'cached_users': len(self.users),
+            'cached_dm_channels': len(self.dm_channels)
+        }
@@ -0,0 +1,212 @@
+# DURABLE STORE FOR MATCHES BETWEEN OCR AND THE DATABASE WRITE
+# a pending match moves through the stages below. persisting it lets a restart pick the
+# pipeline back up at the last completed stage instead of losing the upload.
+# it also holds the upload access codes, so API workers and the bot process can run apart.
+
+import os
+import json
+import asyncio
+import time
+import sqlite3
+import utilities
+
+STAGE_STAGED = 'staged'        # OCR finished in an API worker, waiting for the bot process to send the review
+STAGE_OCR_DONE = 'ocr_done'    # OCR finished, waiting for the uploader to confirm
+STAGE_CONFIRMED = 'confirmed'  # confirmed by the uploader, waiting to be written
+
+PENDING_STORE = os.getenv('PENDING_STORE', 'postgres')  # 'postgres' or 'sqlite'
+PENDING_STORE_PATH = os.getenv('PENDING_STORE_PATH', 'pending_matches.db')
+
+SAVE_QUERY_POSTGRES = """
+    INSERT INTO Pending_Matches (match_key, batch_key, user_id, fingerprint, gen_info, team1, team2, stage)
+    VALUES ($1, $2, $3, $4, $5::jsonb, $6::jsonb, $7::jsonb, $8)
+    ON CONFLICT (match_key) DO UPDATE SET
+        gen_info = EXCLUDED.gen_info,
+        team1 = EXCLUDED.team1,
+        team2 = EXCLUDED.team2,
+        stage = EXCLUDED.stage,
+        updated_at = NOW()
+"""
+SAVE_QUERY_SQLITE = """
+    INSERT INTO pending_matches (match_key, batch_key, user_id, fingerprint, gen_info, team1, team2, stage)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (match_key) DO UPDATE SET
+        gen_info = excluded.gen_info,
+        team1 = excluded.team1,
+        team2 = excluded.team2,
+        stage = excluded.stage,
+        updated_at = CURRENT_TIMESTAMP
+"""
+
+
+def to_args(record):
+    return (record['match_key'], record['batch_key'], record['user_id'], record['fingerprint'],
+            json.dumps(record['gen_info']), json.dumps(record['team1']), json.dumps(record['team2']), record['stage'])
+
+
+def from_row(row):
+    return {**dict(row), 'gen_info': json.loads(row['gen_info']), 'team1': json.loads(row['team1']), 'team2': json.loads(row['team2'])}
+
+
+def to_record(match_key, match):
+    return {
+        'match_key': match_key,
+        'batch_key': match['batch_key'],
+        'user_id': str(match['user_id']),
+        'fingerprint': match['fingerprint'],
+        'gen_info': match['gen_info'],
+        'team1': match['team1'],
+        'team2': match['team2'],
+        'stage': match['stage']
+    }
+
+
+class PostgresPendingStore:
+    def __init__(self):
+        self.pool = None
+        self.lock = asyncio.Lock()
+
+    async def get_pool(self):
+        async with self.lock:
+            if self.pool is None:
+                # the Pending_Matches table is created by migrations.py
+                self.pool = await utilities.create_pool(min_size=1, max_size=2)
+            return self.pool
+
+    async def save(self, record):
+        pool = await self.get_pool()
+        await pool.execute(SAVE_QUERY_POSTGRES, *to_args(record))
+
+    async def save_many(self, records):
+        """Save records in one transaction, a batch only becomes visible to other processes as a whole."""
+        pool = await self.get_pool()
+        async with pool.acquire() as connection:
+            async with connection.transaction():
+                await connection.executemany(SAVE_QUERY_POSTGRES, [to_args(record) for record in records])
+
+    async def delete(self, match_keys):
+        pool = await self.get_pool()
+        await pool.execute("DELETE FROM Pending_Matches WHERE match_key = ANY($1::text[])", list(match_keys))
+
+    async def load_all(self, stage=None):
+        pool = await self.get_pool()
+        # created order keeps a recovered batch in the order it was reviewed in
+        rows = await pool.fetch(
+            "SELECT * FROM Pending_Matches WHERE $1::text IS NULL OR stage = $1 ORDER BY created_at", stage
+        )
+        return [from_row(row) for row in rows]
+
+    # access codes, the Access_Codes table is created by migrations.py
+
+    async def save_code(self, access_code, user_id, ttl):
+        pool = await self.get_pool()
+        await pool.execute("""
+            INSERT INTO Access_Codes (access_code, user_id, expires_at) VALUES ($1, $2, NOW() + make_interval(secs => $3))
+            ON CONFLICT (access_code) DO UPDATE SET user_id = EXCLUDED.user_id, expires_at = EXCLUDED.expires_at
+        """, access_code, str(user_id), float(ttl))
+
+    async def get_code(self, access_code):
+        """Return the user the code was issued to, or None if it doesn't exist or has expired."""
+        pool = await self.get_pool()
+        return await pool.fetchval(
+            "SELECT user_id FROM Access_Codes WHERE access_code = $1 AND expires_at > NOW()", access_code
+        )
+
+    async def delete_code(self, access_code):
+        pool = await self.get_pool()
+        await pool.execute("DELETE FROM Access_Codes WHERE access_code = $1", access_code)
+
+    async def purge_codes(self):
+        pool = await self.get_pool()
+        await pool.execute("DELETE FROM Access_Codes WHERE expires_at <= NOW()")
+
+
+class SqlitePendingStore:
+    """Local stand-in with the same interface, for running without a shared Postgres."""
+
+    def __init__(self, path=PENDING_STORE_PATH):
+        self.path = path
+        with self.connect() as connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS pending_matches (
+                    match_key TEXT PRIMARY KEY,
+                    batch_key TEXT NOT NULL,
+                    user_id TEXT NOT NULL,
+                    fingerprint TEXT,
+                    gen_info TEXT NOT NULL,
+                    team1 TEXT NOT NULL,
+                    team2 TEXT NOT NULL,
+                    stage TEXT NOT NULL,
+                    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS access_codes (
+                    access_code TEXT PRIMARY KEY,
+                    user_id TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+
+    def connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    def _save(self, records):
+        with self.connect() as connection:
+            connection.executemany(SAVE_QUERY_SQLITE, [to_args(record) for record in records])
+
+    def _delete(self, match_keys):
+        with self.connect() as connection:
+            connection.executemany("DELETE FROM pending_matches WHERE match_key = ?", [(key,) for key in match_keys])
+
+    def _load_all(self, stage):
+        with self.connect() as connection:
+            rows = connection.execute(
+                "SELECT * FROM pending_matches WHERE ? IS NULL OR stage = ? ORDER BY rowid", (stage, stage)
+            ).fetchall()
+        return [from_row(row) for row in rows]
+
+    def _execute(self, query, args=()):
+        with self.connect() as connection:
+            return connection.execute(query, args).fetchone()
+
+    async def save(self, record):
+        await asyncio.to_thread(self._save, [record])
+
+    async def save_many(self, records):
+        await asyncio.to_thread(self._save, records)
+
+    async def delete(self, match_keys):
+        await asyncio.to_thread(self._delete, match_keys)
+
+    async def load_all(self, stage=None):
+        return await asyncio.to_thread(self._load_all, stage)
+
+    async def save_code(self, access_code, user_id, ttl):
+        await asyncio.to_thread(self._execute, """
+            INSERT INTO access_codes (access_code, user_id, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT (access_code) DO UPDATE SET user_id = excluded.user_id, expires_at = excluded.expires_at
+        """, (access_code, str(user_id), time.time() + ttl))
+
+    async def get_code(self, access_code):
+        row = await asyncio.to_thread(
+            self._execute, "SELECT user_id FROM access_codes WHERE access_code = ? AND expires_at > ?", (access_code, time.time())
+        )
+        return row['user_id'] if row else None
+
+    async def delete_code(self, access_code):
+        await asyncio.to_thread(self._execute, "DELETE FROM access_codes WHERE access_code = ?", (access_code,))
+
+    async def purge_codes(self):
+        await asyncio.to_thread(self._execute, "DELETE FROM access_codes WHERE expires_at <= ?", (time.time(),))
+
+
+def create_store():
+    if PENDING_STORE == 'sqlite':
+        return SqlitePendingStore()
+    return PostgresPendingStore()
+
+
+store = create_store()
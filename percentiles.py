@@ -0,0 +1,93 @@
+# PERCENTILE RANKS OVER ALL-TIME PLAYER STATS
+# an in-memory NumPy snapshot of Player_Aggregate_Stats with every metric sorted once, so ranking a value is
+# a binary search (searchsorted) instead of a query over every player. write.py schedules a refresh after
+# each committed write, refreshes that pile up while one is running are folded into a single reload.
+
+import os
+import asyncio
+import numpy as np
+from repository import repo
+
+# players with fewer matches are still ranked, but don't count towards everyone else's percentiles
+MIN_MATCHES = int(os.getenv('PERCENTILE_MIN_MATCHES', 5))
+METRICS = ['kd', 'win_rate', 'assists_per_game', 'matches_played']
+
+
+class StatsSnapshot:
+    def __init__(self):
+        self.index = {}      # lowercased name -> row
+        self.names = []
+        self.values = {}     # metric -> value per row
+        self.sorted = {}     # metric -> values of the ranked population, ascending
+        self.version = 0
+        self.loaded = False
+        self.refreshing = None
+        self.stale = False
+
+    async def load(self):
+        rows = await repo.fetch('aggregate stats snapshot')
+        kills = np.array([row['total_kills'] for row in rows], dtype=np.float64)
+        deaths = np.array([row['total_deaths'] for row in rows], dtype=np.float64)
+        assists = np.array([row['total_assists'] for row in rows], dtype=np.float64)
+        played = np.array([row['matches_played'] for row in rows], dtype=np.float64)
+        won = np.array([row['matches_won'] for row in rows], dtype=np.float64)
+        games = np.maximum(played, 1)
+        values = {
+            # same K/D as !player, kills alone when there are no deaths
+            'kd': np.where(deaths > 0, kills / np.maximum(deaths, 1), kills),
+            'win_rate': won / games * 100,
+            'assists_per_game': assists / games,
+            'matches_played': played,
+        }
+        ranked = played >= MIN_MATCHES
+        # built aside and swapped in together, a lookup never mixes two snapshots
+        self.names = [row['name'] for row in rows]
+        self.index = {name.lower(): row for row, name in enumerate(self.names)}
+        self.values = values
+        self.sorted = {metric: np.sort(column[ranked]) for metric, column in values.items()}
+        self.version += 1
+        self.loaded = True
+
+    def schedule_refresh(self):
+        """Reload in the background. Called after every committed write, bursts share one reload."""
+        if repo.pool is None:
+            return
+        if self.refreshing is not None and not self.refreshing.done():
+            self.stale = True
+            return
+        self.refreshing = asyncio.create_task(self._refresh())
+
+    async def _refresh(self):
+        while True:
+            self.stale = False
+            try:
+                await self.load()
+            except Exception as e:
+                print(f"Failed to refresh the stats snapshot: {e}")
+            if not self.stale:
+                return
+
+    def percentile(self, metric, value):
+        """Share of ranked players at or below value, 0-100."""
+        column = self.sorted[metric]
+        if not len(column):
+            return 0
+        return int(np.searchsorted(column, value, side='right') * 100 // len(column))
+
+    def player(self, name):
+        """{metric: (value, percentile)} for a player, or None if they have no stats."""
+        row = self.index.get(name.lower())
+        if row is None:
+            return None
+        stats = {'name': self.names[row]}
+        for metric in METRICS:
+            value = float(self.values[metric][row])
+            stats[metric] = (value, self.percentile(metric, value))
+        return stats
+
+    def stats(self):
+        return {'loaded': self.loaded, 'version': self.version, 'players': len(self.names),
+                'ranked': len(self.sorted.get('kd', ())), 'min_matches': MIN_MATCHES}
+
+
+snapshot = StatsSnapshot()
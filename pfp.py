@@ -0,0 +1,48 @@
+# PROFILE PICTURE INGESTION
+# uploads are decoded and checked once, then cut into the fixed sizes the bot actually shows:
+# 256x256 for the !h2h composite and a small thumbnail for embeds. the work runs in the worker pool
+# (workers.py) so a large or animated upload never holds up the event loop.
+
+import workers
+from io import BytesIO
+from PIL import Image, ImageOps
+
+MAX_UPLOAD_BYTES = 8 * 1024 * 1024
+MAX_PIXELS = 4096 * 4096
+VARIANTS = {'h2h': (256, 256), 'thumb': (128, 128)}
+
+
+class InvalidImage(ValueError):
+    pass
+
+
+def make_variants(data):
+    """Decode an upload and return {variant name: PNG bytes}. Raises InvalidImage for anything unusable."""
+    if len(data) > MAX_UPLOAD_BYTES:
+        raise InvalidImage("the image is larger than 8MB")
+    try:
+        image = Image.open(BytesIO(data))
+        if image.format not in ('PNG', 'JPEG', 'GIF', 'WEBP'):
+            raise InvalidImage("only png, jpg, gif and webp images are supported")
+        if image.width * image.height > MAX_PIXELS:
+            raise InvalidImage("the image dimensions are too large")
+        image.seek(0)  # animated gifs keep their first frame
+        image = ImageOps.exif_transpose(image).convert('RGBA')
+    except InvalidImage:
+        raise
+    except Exception as e:
+        raise InvalidImage(f"the file could not be read as an image ({e})")
+
+    variants = {}
+    for name, size in VARIANTS.items():
+        # crop to a centred square rather than squashing non-square pictures
+        variant = ImageOps.fit(image, size, Image.LANCZOS)
+        output = BytesIO()
+        variant.save(output, format='PNG', optimize=True)
+        variants[name] = output.getvalue()
+    return variants
+
+
+async def process_upload(data):
+    """Run make_variants in the shared worker pool."""
+    return await workers.cpu_pool.run(make_variants, data)
@@ -0,0 +1,147 @@
+# SKILL RATINGS
+# a team Elo: each side is rated as the mean of its players, the winners gain what the losers lose, scaled by
+# how surprising the result was and by the round margin. write.py applies it as each match is written, only
+# reading and updating the ratings of the players in that match. a parameter change needs a full recompute:
+#
+#   python ratings.py --dry-run --k 32      (recompute the whole history with K=32 and show the top 10)
+#   python ratings.py                       (recompute with the current settings and replace the stored ratings)
+#
+# draws don't move ratings, Player_Stats stores 'l' for both sides of a draw so the history can't tell them apart.
+# migration 9 seeds the table with a recompute when it creates it. run one again after backfill.py imports old
+# matches, they are merged without going through write.py.
+
+import os
+import math
+import asyncio
+import argparse
+import asyncpg
+import numpy as np
+
+BASE_RATING = 1500.0  # also the column default in Player_Ratings
+SCALE = 400.0
+K_FACTOR = float(os.getenv('RATING_K', 24))
+LEADERBOARD_MIN_MATCHES = int(os.getenv('LEADERBOARD_MIN_MATCHES', 10))
+
+
+def match_delta(winner_mean, loser_mean, margin, k=K_FACTOR):
+    """Rating points every winner gains and every loser gives up."""
+    expected = 1 / (1 + 10 ** ((loser_mean - winner_mean) / SCALE))
+    return k * math.log(margin + 1) * (1 - expected)
+
+
+def team_deltas(team1_ratings, team2_ratings, team1_score, team2_score, k=K_FACTOR):
+    """(change for each team 1 player, change for each team 2 player)."""
+    if team1_score == team2_score:
+        return 0.0, 0.0
+    team1_mean = sum(team1_ratings) / len(team1_ratings)
+    team2_mean = sum(team2_ratings) / len(team2_ratings)
+    margin = abs(team1_score - team2_score)
+    if team1_score > team2_score:
+        delta = match_delta(team1_mean, team2_mean, margin, k)
+        return delta, -delta
+    delta = match_delta(team2_mean, team1_mean, margin, k)
+    return -delta, delta
+
+
+HISTORY_QUERY = """
+    SELECT ps.match_id, ps.player_id, ps.result = 'w' AS won,
+           trim(split_part(m.score, '-', 1))::INTEGER AS team1_score,
+           trim(split_part(m.score, '-', 2))::INTEGER AS team2_score
+    FROM Player_Stats ps
+    JOIN Matches m ON m.match_id = ps.match_id
+    ORDER BY m.date, m.match_id
+"""
+
+
+def replay(match_ids, player_ids, won, team1_scores, team2_scores, k=K_FACTOR):
+    """Replay the whole history in order. The arrays hold one entry per Player_Stats row, grouped by match.
+
+    Returns (player ids, ratings, peak ratings, matches rated), one entry per player.
+    """
+    if not len(match_ids):
+        return player_ids, np.empty(0), np.empty(0), np.empty(0, dtype=np.int64)
+    players, slots = np.unique(player_ids, return_inverse=True)
+    ratings = np.full(len(players), BASE_RATING)
+    peaks = ratings.copy()
+    matches_rated = np.bincount(slots, minlength=len(players))
+
+    # match boundaries and margins are worked out for the whole history at once,
+    # only the rating updates themselves have to go match by match
+    starts = np.flatnonzero(np.r_[True, match_ids[1:] != match_ids[:-1]])
+    ends = np.r_[starts[1:], len(match_ids)]
+    margins = np.abs(team1_scores[starts] - team2_scores[starts])
+    scale = k * np.log(margins + 1)
+    for start, end, match_scale in zip(starts, ends, scale):
+        if not match_scale:
+            continue  # a draw
+        match_slots = slots[start:end]
+        winners = won[start:end]
+        if winners.all() or not winners.any():
+            continue
+        winner_mean = ratings[match_slots[winners]].mean()
+        loser_mean = ratings[match_slots[~winners]].mean()
+        delta = match_scale * (1 - 1 / (1 + 10 ** ((loser_mean - winner_mean) / SCALE)))
+        ratings[match_slots] += np.where(winners, delta, -delta)
+        peaks[match_slots] = np.maximum(peaks[match_slots], ratings[match_slots])
+    return players, ratings, peaks, matches_rated
+
+
+async def recompute(connection, k=K_FACTOR, dry_run=False):
+    """Recompute every rating from the match history and replace the stored ones. Returns the top 10."""
+    async with connection.transaction():
+        # match writes wait until the new ratings are in, so none of their updates get lost
+        await connection.execute("LOCK TABLE Player_Ratings IN EXCLUSIVE MODE")
+        rows = await connection.fetch(HISTORY_QUERY)
+        players, ratings, peaks, matches_rated = replay(
+            np.array([row['match_id'] for row in rows], dtype=np.int64),
+            np.array([row['player_id'] for row in rows], dtype=np.int64),
+            np.array([row['won'] for row in rows], dtype=bool),
+            np.array([row['team1_score'] for row in rows], dtype=np.int64),
+            np.array([row['team2_score'] for row in rows], dtype=np.int64),
+            k
+        )
+        await connection.execute("""
+            CREATE TEMP TABLE recomputed_ratings (
+                player_id INTEGER, rating DOUBLE PRECISION, peak_rating DOUBLE PRECISION, matches_rated INTEGER
+            ) ON COMMIT DROP
+        """)
+        await connection.copy_records_to_table('recomputed_ratings', records=[
+            (int(player_id), float(rating), float(peak), int(count))
+            for player_id, rating, peak, count in zip(players, ratings, peaks, matches_rated)
+        ])
+        top = await connection.fetch("""
+            SELECT P.name, R.rating, R.matches_rated
+            FROM recomputed_ratings R
+            JOIN Players P ON P.player_id = R.player_id
+            WHERE R.matches_rated >= $1
+            ORDER BY R.rating DESC
+            LIMIT 10
+        """, LEADERBOARD_MIN_MATCHES)
+        if not dry_run:
+            await connection.execute("DELETE FROM Player_Ratings")
+            await connection.execute("""
+                INSERT INTO Player_Ratings (player_id, rating, peak_rating, matches_rated)
+                SELECT player_id, rating, peak_rating, matches_rated FROM recomputed_ratings
+            """)
+    print(f"{'Would rate' if dry_run else 'Rated'} {len(players)} players over {len(rows)} stat rows with K={k}")
+    return top
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Recompute every skill rating from the match history.")
+    parser.add_argument('--k', type=float, default=K_FACTOR, help="K factor, defaults to $RATING_K")
+    parser.add_argument('--dry-run', action='store_true', help="show the resulting top 10 without storing anything")
+    parser.add_argument('--dsn', default=os.getenv('DATABASE_URL'), help="defaults to $DATABASE_URL")
+    args = parser.parse_args()
+
+    connection = await asyncpg.connect(args.dsn)
+    try:
+        top = await recompute(connection, args.k, args.dry_run)
+    finally:
+        await connection.close()
+    for rank, row in enumerate(top, start=1):
+        print(f"{rank:>3}. {row['name']:<24} {row['rating']:>7.1f}  ({row['matches_rated']} maps)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
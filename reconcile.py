@@ -0,0 +1,229 @@
+# AGGREGATE RECONCILIATION
+# the aggregate tables are only ever incremented by write.py, so a manual fix to Player_Stats, a deleted match
+# or a half written upload leaves them drifted for good. this recomputes them from Player_Stats and Matches,
+# diffs the result against what is stored and repairs the difference in one transaction.
+#
+#   python reconcile.py --dry-run           (report drift without touching anything)
+#   python reconcile.py                     (recompute everything and repair)
+#   python reconcile.py --incremental       (only players whose stats changed since the last run)
+
+import os
+import sys
+import asyncio
+import argparse
+import asyncpg
+
+CHECKPOINT = 'aggregates'
+
+# $1 is the players to check, NULL for everyone
+SCOPE = "($1::INTEGER[] IS NULL OR {column} = ANY($1))"
+
+# a draw is stored as 'l' for both sides but write.py doesn't count it as a loss
+LOST = "ps.result = 'l' AND trim(split_part(m.score, '-', 1))::INTEGER <> trim(split_part(m.score, '-', 2))::INTEGER"
+
+# table -> key columns, value columns, which stored rows are in scope and the query that recomputes them.
+# the expected query returns key columns then value columns, in that order
+CHECKS = {
+    'Player_Aggregate_Stats': {
+        'keys': ['player_id', 'map_id', 'match_type_id'],
+        'values': ['total_kills', 'total_deaths', 'total_assists', 'matches_played', 'matches_won', 'matches_lost'],
+        # write.py only maintains the all-time row
+        'stored': "map_id IS NULL AND match_type_id IS NULL AND " + SCOPE.format(column='player_id'),
+        'expected': f"""
+            SELECT ps.player_id, NULL::INTEGER, NULL::INTEGER,
+                   SUM(ps.kills)::INTEGER, SUM(ps.deaths)::INTEGER, SUM(ps.assists)::INTEGER, COUNT(*)::INTEGER,
+                   COUNT(*) FILTER (WHERE ps.result = 'w')::INTEGER, COUNT(*) FILTER (WHERE {LOST})::INTEGER
+            FROM Player_Stats ps
+            JOIN Matches m ON m.match_id = ps.match_id
+            WHERE {SCOPE.format(column='ps.player_id')}
+            GROUP BY ps.player_id
+        """
+    },
+    'Player_Season_Stats': {
+        'keys': ['player_id', 'season_id'],
+        'values': ['total_kills', 'total_deaths', 'total_assists', 'matches_played', 'matches_won', 'matches_lost'],
+        'stored': SCOPE.format(column='player_id'),
+        'expected': f"""
+            SELECT ps.player_id, s.season_id,
+                   SUM(ps.kills)::INTEGER, SUM(ps.deaths)::INTEGER, SUM(ps.assists)::INTEGER, COUNT(*)::INTEGER,
+                   COUNT(*) FILTER (WHERE ps.result = 'w')::INTEGER, COUNT(*) FILTER (WHERE {LOST})::INTEGER
+            FROM Player_Stats ps
+            JOIN Matches m ON m.match_id = ps.match_id
+            CROSS JOIN LATERAL (
+                SELECT season_id FROM Seasons
+                WHERE starts_at <= ps.match_date AND (ends_at IS NULL OR ends_at > ps.match_date)
+                ORDER BY starts_at DESC LIMIT 1
+            ) s
+            WHERE {SCOPE.format(column='ps.player_id')}
+            GROUP BY ps.player_id, s.season_id
+        """
+    },
+    # opponents are players of the same match with opposite results, as in the H2H_Pair_Stats backfill. draws
+    # don't count towards head-to-head (write.py and backfill.py skip them too). rows written before that rule
+    # credited draws to team 2, a full run repairs them once
+    'H2H_Records': {
+        'keys': ['player_one_id', 'player_two_id'],
+        'values': ['player_one_wins', 'player_two_wins'],
+        'stored': f"({SCOPE.format(column='player_one_id')} OR {SCOPE.format(column='player_two_id')})",
+        'expected': f"""
+            SELECT a.player_id, b.player_id,
+                   COUNT(*) FILTER (WHERE a.result = 'w')::INTEGER, COUNT(*) FILTER (WHERE b.result = 'w')::INTEGER
+            FROM Player_Stats a
+            JOIN Player_Stats b ON b.match_id = a.match_id AND b.match_date = a.match_date
+                               AND a.player_id < b.player_id AND a.result <> b.result
+            WHERE {SCOPE.format(column='a.player_id')} OR {SCOPE.format(column='b.player_id')}
+            GROUP BY a.player_id, b.player_id
+        """
+    },
+    'H2H_Pair_Stats': {
+        'keys': ['player_one_id', 'player_two_id', 'map_id'],
+        'values': ['shared_matches', 'player_one_wins', 'player_two_wins',
+                   'player_one_kills', 'player_one_deaths', 'player_two_kills', 'player_two_deaths'],
+        'stored': f"({SCOPE.format(column='player_one_id')} OR {SCOPE.format(column='player_two_id')})",
+        'expected': f"""
+            SELECT a.player_id, b.player_id, m.map_id, COUNT(*)::INTEGER,
+                   COUNT(*) FILTER (WHERE a.result = 'w')::INTEGER, COUNT(*) FILTER (WHERE b.result = 'w')::INTEGER,
+                   SUM(a.kills)::INTEGER, SUM(a.deaths)::INTEGER, SUM(b.kills)::INTEGER, SUM(b.deaths)::INTEGER
+            FROM Player_Stats a
+            JOIN Player_Stats b ON b.match_id = a.match_id AND b.match_date = a.match_date
+                               AND a.player_id < b.player_id AND a.result <> b.result
+            JOIN Matches m ON m.match_id = a.match_id
+            WHERE {SCOPE.format(column='a.player_id')} OR {SCOPE.format(column='b.player_id')}
+            GROUP BY a.player_id, b.player_id, m.map_id
+        """
+    },
+}
+
+
+async def check_table(connection, table, check, player_ids, repair):
+    """Diff one table against its recomputed values. Returns (missing, extra, mismatched, samples)."""
+    keys, values = check['keys'], check['values']
+    columns = keys + values
+    # temp tables are created up front and filled with INSERT, CREATE TABLE AS can't take parameters
+    await connection.execute(f"""
+        DROP TABLE IF EXISTS expected_rows;
+        DROP TABLE IF EXISTS drifted_rows;
+        CREATE TEMP TABLE expected_rows ({', '.join(f'{column} INTEGER' for column in columns)}) ON COMMIT DROP;
+        CREATE TEMP TABLE drifted_rows ({', '.join(f'{key} INTEGER' for key in keys)},
+                                        missing BOOLEAN, extra BOOLEAN, stored JSONB, expected JSONB) ON COMMIT DROP;
+    """)
+    await connection.execute(f"INSERT INTO expected_rows {check['expected']}", player_ids)
+
+    same_key = ' AND '.join(f"s.{key} IS NOT DISTINCT FROM e.{key}" for key in keys)
+    await connection.execute(f"""
+        INSERT INTO drifted_rows
+        SELECT {', '.join(f'COALESCE(s.{key}, e.{key})' for key in keys)},
+               s.{values[0]} IS NULL AND s.{keys[0]} IS NULL,
+               e.{values[0]} IS NULL AND e.{keys[0]} IS NULL,
+               to_jsonb(s), to_jsonb(e)
+        FROM (SELECT {', '.join(columns)} FROM {table} WHERE {check['stored']}) s
+        FULL JOIN expected_rows e ON {same_key}
+        WHERE ROW({', '.join(f's.{column}' for column in columns)}) IS DISTINCT FROM ROW({', '.join(f'e.{column}' for column in columns)})
+    """, player_ids)
+
+    counts = await connection.fetchrow("""
+        SELECT COUNT(*) FILTER (WHERE missing) AS missing, COUNT(*) FILTER (WHERE extra) AS extra,
+               COUNT(*) FILTER (WHERE NOT missing AND NOT extra) AS mismatched
+        FROM drifted_rows
+    """)
+    samples = await connection.fetch("SELECT stored, expected FROM drifted_rows LIMIT 5")
+
+    if repair and (counts['missing'] or counts['extra'] or counts['mismatched']):
+        drifted = ' AND '.join(f"t.{key} IS NOT DISTINCT FROM d.{key}" for key in keys)
+        await connection.execute(f"DELETE FROM {table} t USING drifted_rows d WHERE {drifted}")
+        await connection.execute(f"""
+            INSERT INTO {table} ({', '.join(columns)})
+            SELECT {', '.join(f'e.{column}' for column in columns)}
+            FROM expected_rows e
+            JOIN drifted_rows d ON {' AND '.join(f'e.{key} IS NOT DISTINCT FROM d.{key}' for key in keys)}
+        """)
+    return counts['missing'], counts['extra'], counts['mismatched'], [(row['stored'], row['expected']) for row in samples]
+
+
+async def reconcile(connection, incremental=False, repair=True):
+    """Recompute the aggregate tables and repair drift. Returns {table: (missing, extra, mismatched, samples)}.
+
+    Everything runs in one transaction, with writers locked out so an upload can't land between
+    reading Player_Stats and rewriting the aggregates.
+    """
+    report = {}
+    async with connection.transaction():
+        # SHARE blocks new Player_Stats rows, EXCLUSIVE blocks increments, reads carry on
+        await connection.execute("LOCK TABLE Player_Stats, Matches IN SHARE MODE")
+        await connection.execute(f"LOCK TABLE {', '.join(CHECKS)} IN EXCLUSIVE MODE")
+
+        latest = await connection.fetchval("SELECT COALESCE(MAX(change_id), 0) FROM Reconcile_Touched_Players")
+        player_ids = None
+        if incremental:
+            checkpoint = await connection.fetchval(
+                "SELECT change_id FROM Reconcile_Checkpoints WHERE name = $1", CHECKPOINT
+            ) or 0
+            player_ids = [row['player_id'] for row in await connection.fetch(
+                "SELECT player_id FROM Reconcile_Touched_Players WHERE change_id > $1", checkpoint
+            )]
+            if not player_ids:
+                return report
+
+        for table, check in CHECKS.items():
+            report[table] = await check_table(connection, table, check, player_ids, repair)
+
+        if repair:
+            # every touched player up to latest is now consistent
+            await connection.execute("""
+                INSERT INTO Reconcile_Checkpoints (name, change_id) VALUES ($1, $2)
+                ON CONFLICT (name) DO UPDATE SET change_id = EXCLUDED.change_id, reconciled_at = NOW()
+            """, CHECKPOINT, latest)
+            await connection.execute("DELETE FROM Reconcile_Touched_Players WHERE change_id <= $1", latest)
+        else:
+            # a dry run leaves nothing behind, including the temp tables
+            raise DryRun(report)
+    return report
+
+
+class DryRun(Exception):
+    """Raised inside the transaction to roll back a report-only run."""
+    def __init__(self, report):
+        super().__init__("dry run")
+        self.report = report
+
+
+async def report_drift(connection, incremental=False):
+    """Report drift without repairing it."""
+    try:
+        return await reconcile(connection, incremental, repair=False)
+    except DryRun as dry_run:
+        return dry_run.report
+
+
+def print_report(report):
+    if not report:
+        print("Nothing to reconcile")
+    for table, (missing, extra, mismatched, samples) in report.items():
+        print(f"{table:<24} missing {missing:>6}  extra {extra:>6}  mismatched {mismatched:>6}")
+        for stored, expected in samples:
+            print(f"    stored   {stored}\n    expected {expected}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Recompute aggregate tables from Player_Stats and repair drift.")
+    parser.add_argument('--incremental', action='store_true', help="only players changed since the last run")
+    parser.add_argument('--dry-run', action='store_true', help="report drift without repairing it")
+    parser.add_argument('--dsn', default=os.getenv('DATABASE_URL'), help="defaults to $DATABASE_URL")
+    args = parser.parse_args()
+
+    connection = await asyncpg.connect(args.dsn)
+    try:
+        if args.dry_run:
+            report = await report_drift(connection, args.incremental)
+        else:
+            report = await reconcile(connection, args.incremental)
+    finally:
+        await connection.close()
+    print_report(report)
+    drifted = any(missing or extra or mismatched for missing, extra, mismatched, _ in report.values())
+    if args.dry_run and drifted:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,354 @@
+# DATA ACCESS FOR THE BOT COMMANDS AND THE MATCH WRITE PATH
+# every hot query lives here under a name. the pool is created once, however often on_ready fires, and each
+# pool connection prepares a query the first time it runs there, so later runs skip parsing and planning.
+# independent queries can run side by side with asyncio.gather, each takes its own pool connection.
+# set QUERY_TIMING=1 to collect per-query call counts and timings (repo.stats()).
+
+import os
+import time
+import asyncio
+import asyncpg
+
+QUERY_TIMING = os.getenv('QUERY_TIMING', '0') == '1'
+POOL_MIN_SIZE = int(os.getenv('POOL_MIN_SIZE', 2))
+POOL_MAX_SIZE = int(os.getenv('POOL_MAX_SIZE', 10))
+
+QUERIES = {
+    # players and maps
+    'player id': "SELECT player_id FROM Players WHERE name = $1",
+    'player id by name': "SELECT player_id FROM Players WHERE lower(name) = lower($1)",
+    'player exists': "SELECT EXISTS(SELECT 1 FROM Players WHERE lower(name) = lower($1))",
+    'insert player': "INSERT INTO Players (name) VALUES ($1) RETURNING player_id",
+    'player names': "SELECT name FROM Players ORDER BY name ASC",
+    'update pfp': "UPDATE Players SET profile_pic_url = $1, pfp_256_url = $2, pfp_thumb_url = $3 WHERE lower(name) = lower($4)",
+    'map id': "SELECT map_id FROM Maps WHERE map_name = $1",
+    'map by name': "SELECT map_id, full_name FROM Maps WHERE lower(map_name) = lower($1)",
+    'map names': "SELECT map_name FROM Maps",
+    'match type id': "SELECT match_type_id FROM Match_Types WHERE description = $1",
+    'notify cache': "SELECT pg_notify($1, $2)",
+
+    # !player, all-time, one season (kept up to date by write.py) or a rolling window
+    'player stats': """
+        SELECT
+            P.name AS registered_name,
+            COALESCE(P.pfp_thumb_url, P.profile_pic_url) AS profile_pic_url,
+            COALESCE(SUM(PS.kills), 0) AS total_kills,
+            COALESCE(SUM(PS.deaths), 0) AS total_deaths,
+            COUNT(PS.player_id) AS matches_played,
+            COALESCE(SUM(CASE WHEN PS.result = 'w' THEN 1 ELSE 0 END), 0) AS matches_won,
+            COALESCE(SUM(CASE WHEN PS.result = 'l' THEN 1 ELSE 0 END), 0) AS matches_lost,
+            COALESCE(SUM(PS.assists), 0) AS total_assists
+        FROM Players P
+        LEFT JOIN Player_Stats PS ON P.player_id = PS.player_id
+        WHERE lower(P.name) = lower($1)
+        GROUP BY P.player_id
+    """,
+    'player season stats': """
+        SELECT
+            P.name AS registered_name,
+            COALESCE(P.pfp_thumb_url, P.profile_pic_url) AS profile_pic_url,
+            COALESCE(SS.total_kills, 0) AS total_kills,
+            COALESCE(SS.total_deaths, 0) AS total_deaths,
+            COALESCE(SS.matches_played, 0) AS matches_played,
+            COALESCE(SS.matches_won, 0) AS matches_won,
+            COALESCE(SS.matches_lost, 0) AS matches_lost,
+            COALESCE(SS.total_assists, 0) AS total_assists
+        FROM Players P
+        LEFT JOIN Player_Season_Stats SS ON P.player_id = SS.player_id AND SS.season_id = $2
+        WHERE lower(P.name) = lower($1)
+    """,
+    # filtering on match_date lets postgres skip the partitions outside the window
+    'player window stats': """
+        SELECT
+            P.name AS registered_name,
+            COALESCE(P.pfp_thumb_url, P.profile_pic_url) AS profile_pic_url,
+            COALESCE(SUM(PS.kills), 0) AS total_kills,
+            COALESCE(SUM(PS.deaths), 0) AS total_deaths,
+            COUNT(PS.player_id) AS matches_played,
+            COALESCE(SUM(CASE WHEN PS.result = 'w' THEN 1 ELSE 0 END), 0) AS matches_won,
+            COALESCE(SUM(CASE WHEN PS.result = 'l' THEN 1 ELSE 0 END), 0) AS matches_lost,
+            COALESCE(SUM(PS.assists), 0) AS total_assists
+        FROM Players P
+        LEFT JOIN Player_Stats PS ON P.player_id = PS.player_id AND PS.match_date >= LOCALTIMESTAMP - $2::interval
+        WHERE lower(P.name) = lower($1)
+        GROUP BY P.player_id
+    """,
+
+    # !map
+    'player map stats': """
+        SELECT
+            COUNT(*) AS matches_played,
+            COUNT(*) FILTER (WHERE ps.result = 'w') AS matches_won,
+            COUNT(*) FILTER (WHERE ps.result = 'l') AS matches_lost,
+            SUM(ps.kills) AS total_kills,
+            SUM(ps.deaths) AS total_deaths
+        FROM Player_Stats ps
+        JOIN Matches m ON ps.match_id = m.match_id
+        WHERE ps.player_id = $1 AND m.map_id = $2
+    """,
+
+    # !h2h
+    'h2h players': """
+        SELECT player_id, name, COALESCE(pfp_256_url, profile_pic_url) AS profile_pic_url
+        FROM Players WHERE lower(name) IN (lower($1), lower($2))
+    """,
+    'h2h record': """
+        SELECT player_one_id, player_two_id, player_one_wins, player_two_wins
+        FROM H2H_Records
+        WHERE (player_one_id = $1 AND player_two_id = $2)
+           OR (player_one_id = $2 AND player_two_id = $1)
+    """,
+    # keyed like H2H_Records with the lower player_id first
+    'h2h pair stats': """
+        SELECT COALESCE(M.full_name, M.map_name) AS map_name, HP.*
+        FROM H2H_Pair_Stats HP
+        JOIN Maps M ON M.map_id = HP.map_id
+        WHERE HP.player_one_id = $1 AND HP.player_two_id = $2
+        ORDER BY HP.shared_matches DESC
+    """,
+
+    # all-time rows for the percentile snapshot, see percentiles.py
+    'aggregate stats snapshot': """
+        SELECT P.name, A.total_kills, A.total_deaths, A.total_assists, A.matches_played, A.matches_won
+        FROM Player_Aggregate_Stats A
+        JOIN Players P ON P.player_id = A.player_id
+        WHERE A.map_id IS NULL AND A.match_type_id IS NULL
+    """,
+
+    # !rating and !leaderboard, see ratings.py
+    'player rating': """
+        SELECT P.name, R.rating, R.peak_rating, R.matches_rated,
+               (SELECT COUNT(*) FROM Player_Ratings O WHERE O.matches_rated >= $2 AND O.rating > R.rating) + 1 AS rank
+        FROM Players P
+        JOIN Player_Ratings R ON R.player_id = P.player_id
+        WHERE lower(P.name) = lower($1)
+    """,
+    'rating leaderboard': """
+        SELECT P.name, R.rating, R.matches_rated
+        FROM Player_Ratings R
+        JOIN Players P ON P.player_id = R.player_id
+        WHERE R.matches_rated >= $1
+        ORDER BY R.rating DESC
+        LIMIT $2
+    """,
+
+    # !balance, every player and the head-to-head results between them in two independent queries
+    'balance players': """
+        SELECT P.name, COALESCE(R.rating, 1500) AS rating, A.total_kills, A.total_deaths
+        FROM Players P
+        LEFT JOIN Player_Ratings R ON R.player_id = P.player_id
+        LEFT JOIN Player_Aggregate_Stats A ON A.player_id = P.player_id AND A.map_id IS NULL AND A.match_type_id IS NULL
+        WHERE lower(P.name) = ANY($1::text[])
+    """,
+    'balance h2h': """
+        SELECT lower(P1.name) AS player_one, lower(P2.name) AS player_two, H.player_one_wins, H.player_two_wins
+        FROM H2H_Records H
+        JOIN Players P1 ON P1.player_id = H.player_one_id
+        JOIN Players P2 ON P2.player_id = H.player_two_id
+        WHERE lower(P1.name) = ANY($1::text[]) AND lower(P2.name) = ANY($1::text[])
+    """,
+
+    # !history, keyset pages newest first. each page starts after the (match_date, match_id) the last one
+    # ended on, so a deep page costs the same as the first (see player_stats_player_history_idx)
+    'history first page': """
+        SELECT PS.match_id, PS.match_date, PS.kills, PS.deaths, PS.assists, PS.result, M.score,
+               COALESCE(MP.full_name, MP.map_name) AS map_name
+        FROM Player_Stats PS
+        JOIN Matches M ON M.match_id = PS.match_id
+        JOIN Maps MP ON MP.map_id = M.map_id
+        WHERE PS.player_id = $1
+        ORDER BY PS.match_date DESC, PS.match_id DESC
+        LIMIT $2
+    """,
+    'history page': """
+        SELECT PS.match_id, PS.match_date, PS.kills, PS.deaths, PS.assists, PS.result, M.score,
+               COALESCE(MP.full_name, MP.map_name) AS map_name
+        FROM Player_Stats PS
+        JOIN Matches M ON M.match_id = PS.match_id
+        JOIN Maps MP ON MP.map_id = M.map_id
+        WHERE PS.player_id = $1 AND (PS.match_date, PS.match_id) < ($2, $3)
+        ORDER BY PS.match_date DESC, PS.match_id DESC
+        LIMIT $4
+    """,
+    'player name and id': "SELECT player_id, name FROM Players WHERE lower(name) = lower($1)",
+
+    # !apply
+    'application exists': "SELECT EXISTS(SELECT 1 FROM tms_apps WHERE discord_id = $1)",
+    'insert application': "INSERT INTO tms_apps (player_id, discord_id, name, tracker_link) VALUES ($1, $2, $3, $4)",
+
+    # match writes, see write.py
+    'insert match': """
+        INSERT INTO Matches (map_id, match_type_id, score, date)
+        VALUES ($1, $2, $3, NOW())
+        RETURNING match_id, date
+    """,
+    'ensure partition': "SELECT ensure_player_stats_partition($1)",
+    'find season': """
+        SELECT season_id FROM Seasons
+        WHERE starts_at <= $1 AND (ends_at IS NULL OR ends_at > $1)
+        ORDER BY starts_at DESC
+        LIMIT 1
+    """,
+    # match_date is the partition key
+    'insert player stats': """
+        INSERT INTO Player_Stats (player_id, match_id, match_date, kills, deaths, assists, result)
+        VALUES ($1, $2, $3, $4, $5, $6, $7)
+    """,
+    'upsert aggregate stats': """
+        INSERT INTO Player_Aggregate_Stats (player_id, map_id, match_type_id, total_kills, total_deaths, total_assists, matches_played, matches_won, matches_lost)
+        VALUES ($1, NULL, NULL, $2, $3, $4, 1, $5, $6)
+        ON CONFLICT (player_id) WHERE map_id IS NULL AND match_type_id IS NULL
+        DO UPDATE SET
+            total_kills = Player_Aggregate_Stats.total_kills + EXCLUDED.total_kills,
+            total_deaths = Player_Aggregate_Stats.total_deaths + EXCLUDED.total_deaths,
+            total_assists = Player_Aggregate_Stats.total_assists + EXCLUDED.total_assists,
+            matches_played = Player_Aggregate_Stats.matches_played + 1,
+            matches_won = Player_Aggregate_Stats.matches_won + EXCLUDED.matches_won,
+            matches_lost = Player_Aggregate_Stats.matches_lost + EXCLUDED.matches_lost
+    """,
+    'upsert season stats': """
+        INSERT INTO Player_Season_Stats (player_id, season_id, total_kills, total_deaths, total_assists, matches_played, matches_won, matches_lost)
+        VALUES ($1, $2, $3, $4, $5, 1, $6, $7)
+        ON CONFLICT (player_id, season_id)
+        DO UPDATE SET
+            total_kills = Player_Season_Stats.total_kills + EXCLUDED.total_kills,
+            total_deaths = Player_Season_Stats.total_deaths + EXCLUDED.total_deaths,
+            total_assists = Player_Season_Stats.total_assists + EXCLUDED.total_assists,
+            matches_played = Player_Season_Stats.matches_played + 1,
+            matches_won = Player_Season_Stats.matches_won + EXCLUDED.matches_won,
+            matches_lost = Player_Season_Stats.matches_lost + EXCLUDED.matches_lost
+    """,
+    # ratings of the players in a match, locked in player_id order so concurrent writes can't deadlock
+    'ensure ratings': """
+        INSERT INTO Player_Ratings (player_id)
+        SELECT player_id FROM Players WHERE name = ANY($1::text[])
+        ON CONFLICT (player_id) DO NOTHING
+    """,
+    'lock ratings': """
+        SELECT R.player_id, P.name, R.rating
+        FROM Player_Ratings R
+        JOIN Players P ON P.player_id = R.player_id
+        WHERE P.name = ANY($1::text[])
+        ORDER BY R.player_id
+        FOR UPDATE OF R
+    """,
+    'apply rating': """
+        UPDATE Player_Ratings
+        SET rating = rating + $2, peak_rating = GREATEST(peak_rating, rating + $2),
+            matches_rated = matches_rated + 1, updated_at = NOW()
+        WHERE player_id = $1
+    """,
+    'upsert h2h record': """
+        INSERT INTO H2H_Records (player_one_id, player_two_id, player_one_wins, player_two_wins)
+        VALUES ($1, $2, $3, $4)
+        ON CONFLICT (player_one_id, player_two_id)
+        DO UPDATE SET
+            player_one_wins = H2H_Records.player_one_wins + EXCLUDED.player_one_wins,
+            player_two_wins = H2H_Records.player_two_wins + EXCLUDED.player_two_wins
+    """,
+    'upsert h2h pair stats': """
+        INSERT INTO H2H_Pair_Stats (player_one_id, player_two_id, map_id, shared_matches, player_one_wins, player_two_wins,
+                                    player_one_kills, player_one_deaths, player_two_kills, player_two_deaths)
+        VALUES ($1, $2, $3, 1, $4, $5, $6, $7, $8, $9)
+        ON CONFLICT (player_one_id, player_two_id, map_id)
+        DO UPDATE SET
+            shared_matches = H2H_Pair_Stats.shared_matches + 1,
+            player_one_wins = H2H_Pair_Stats.player_one_wins + EXCLUDED.player_one_wins,
+            player_two_wins = H2H_Pair_Stats.player_two_wins + EXCLUDED.player_two_wins,
+            player_one_kills = H2H_Pair_Stats.player_one_kills + EXCLUDED.player_one_kills,
+            player_one_deaths = H2H_Pair_Stats.player_one_deaths + EXCLUDED.player_one_deaths,
+            player_two_kills = H2H_Pair_Stats.player_two_kills + EXCLUDED.player_two_kills,
+            player_two_deaths = H2H_Pair_Stats.player_two_deaths + EXCLUDED.player_two_deaths
+    """,
+}
+
+
+class Repository:
+    def __init__(self):
+        self.pool = None
+        self.lock = asyncio.Lock()
+        self.statements = {}  # backend pid -> {query name: prepared statement}
+        self.timing = QUERY_TIMING
+        self.timings = {}     # query name -> [calls, total seconds, max seconds]
+
+    async def start(self, **connect_kwargs):
+        """Create the pool the first time it is called and return it, later calls return the same pool."""
+        async with self.lock:
+            if self.pool is None:
+                self.pool = await asyncpg.create_pool(
+                    min_size=POOL_MIN_SIZE, max_size=POOL_MAX_SIZE, init=self.forget, **connect_kwargs
+                )
+        return self.pool
+
+    async def forget(self, connection):
+        """Pool init hook, runs once for every new connection (including replacements after a drop).
+
+        A new backend can get the pid of a dropped one, whatever was prepared under it is gone.
+        """
+        self.statements[connection.get_server_pid()] = {}
+
+    async def prepare(self, connection, name):
+        """The named query prepared on this pooled connection, prepared the first time it runs there.
+
+        Lazily, so queries on tables a later migration creates are never prepared before the table exists.
+        """
+        statements = self.statements.setdefault(connection.get_server_pid(), {})
+        statement = statements.get(name)
+        if statement is None:
+            statement = statements[name] = await connection.prepare(QUERIES[name])
+        return statement
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+            self.statements.clear()
+
+    async def run(self, method, name, args, connection=None):
+        started = time.perf_counter()
+        try:
+            if connection is not None:
+                # a caller's own connection (a write transaction), asyncpg's statement cache prepares it there
+                return await getattr(connection, method)(QUERIES[name], *args)
+            async with self.pool.acquire() as pooled:
+                if method == 'executemany':
+                    # prepared statements have no executemany in asyncpg 0.29, the connection's cache prepares it
+                    return await pooled.executemany(QUERIES[name], *args)
+                statement = await self.prepare(pooled, name)
+                # prepared statements run commands through fetch
+                return await getattr(statement, 'fetch' if method == 'execute' else method)(*args)
+        finally:
+            if self.timing:
+                elapsed = time.perf_counter() - started
+                timing = self.timings.setdefault(name, [0, 0.0, 0.0])
+                timing[0] += 1
+                timing[1] += elapsed
+                timing[2] = max(timing[2], elapsed)
+
+    async def fetch(self, name, *args, connection=None):
+        return await self.run('fetch', name, args, connection)
+
+    async def fetchrow(self, name, *args, connection=None):
+        return await self.run('fetchrow', name, args, connection)
+
+    async def fetchval(self, name, *args, connection=None):
+        return await self.run('fetchval', name, args, connection)
+
+    async def execute(self, name, *args, connection=None):
+        return await self.run('execute', name, args, connection)
+
+    async def executemany(self, name, args_list, connection=None):
+        return await self.run('executemany', name, (args_list,), connection)
+
+    def stats(self):
+        return {
+            'pool_size': self.pool.get_size() if self.pool else 0,
+            'pool_idle': self.pool.get_idle_size() if self.pool else 0,
+            'queries': {
+                name: {'calls': calls, 'avg_ms': round(total / calls * 1000, 3), 'max_ms': round(peak * 1000, 3)}
+                for name, (calls, total, peak) in self.timings.items()
+            }
+        }
+
+
+repo = Repository()
@@ -0,0 +1,184 @@
+# RESILIENCE LAYER FOR EXTERNAL SERVICES (VISION, CLOUDINARY, GCS)
+# every call gets a deadline, jittered retries, an optional hedged duplicate for slow tails
+# and a circuit breaker per upstream that switches to the local fallback while it is degraded
+
+import os
+import time
+import random
+import asyncio
+
+# per upstream policy: seconds per attempt, extra attempts, seconds before a hedge is fired (None disables).
+# a losing hedge can't be called back once its thread runs, so only hedge calls that are idempotent and free
+# to repeat. vision and cloudinary bill every request and cloudinary creates an upload each time, gcs writes
+# aren't worth doubling either. picture downloads are plain GETs, a hedge cuts their slow tail in !h2h
+POLICIES = {
+    'vision': {'deadline': 15.0, 'retries': 2, 'hedge_after': None},
+    'cloudinary': {'deadline': 20.0, 'retries': 1, 'hedge_after': None},
+    'gcs': {'deadline': 10.0, 'retries': 2, 'hedge_after': None},
+    'gcs_read': {'deadline': 10.0, 'retries': 2, 'hedge_after': 1.5},
+}
+DEFAULT_POLICY = {'deadline': 10.0, 'retries': 1, 'hedge_after': None}
+BACKOFF_BASE = 0.5
+FAILURE_THRESHOLD = int(os.getenv('BREAKER_FAILURES', 5))      # consecutive failures that open a breaker
+RESET_TIMEOUT = float(os.getenv('BREAKER_RESET_SECONDS', 30))  # how long a breaker stays open before a trial call
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half_open'
+        return 'open'
+
+    def allow(self):
+        state = self.state
+        if state == 'closed':
+            return True
+        if state == 'half_open' and not self.trial_running:
+            # let a single call through to find out whether the upstream recovered
+            self.trial_running = True
+            return True
+        return False
+
+    def record_success(self):
+        if self.opened_at is not None:
+            print(f"Circuit for {self.name} closed")
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.trial_running = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            if self.state != 'open':
+                print(f"Circuit for {self.name} opened after {self.failures} failures")
+            self.opened_at = time.monotonic()
+
+
+breakers = {}
+
+
+def get_breaker(name):
+    if name not in breakers:
+        breakers[name] = CircuitBreaker(name)
+    return breakers[name]
+
+
+# fault injection, so the fallbacks can be exercised locally without a real outage.
+# RESILIENCE_FAULTS="cloudinary=error:0.5,vision=delay:3" fails half the cloudinary calls and slows vision by 3s
+faults = {}
+
+
+def set_fault(name, error_rate=0.0, delay=0.0):
+    faults[name] = {'error_rate': error_rate, 'delay': delay}
+
+
+def clear_faults():
+    faults.clear()
+
+
+def load_faults(spec):
+    for entry in filter(None, (part.strip() for part in spec.split(','))):
+        name, _, fault = entry.partition('=')
+        kind, _, value = fault.partition(':')
+        if kind == 'error':
+            set_fault(name, error_rate=float(value), delay=faults.get(name, {}).get('delay', 0.0))
+        elif kind == 'delay':
+            set_fault(name, error_rate=faults.get(name, {}).get('error_rate', 0.0), delay=float(value))
+
+
+load_faults(os.getenv('RESILIENCE_FAULTS', ''))
+
+
+async def invoke(name, fn, args, kwargs):
+    fault = faults.get(name)
+    if fault:
+        if fault['delay']:
+            await asyncio.sleep(fault['delay'])
+        if random.random() < fault['error_rate']:
+            raise ConnectionError(f"injected fault for {name}")
+    if asyncio.iscoroutinefunction(fn):
+        return await fn(*args, **kwargs)
+    # blocking clients run in a thread. a thread can't be cancelled, a timed out one is simply abandoned
+    return await asyncio.to_thread(fn, *args, **kwargs)
+
+
+async def attempt(name, fn, args, kwargs, deadline, hedge_after):
+    """One attempt with a deadline. If it is still running after hedge_after, a duplicate races it."""
+    primary = asyncio.ensure_future(asyncio.wait_for(invoke(name, fn, args, kwargs), deadline))
+    if hedge_after is None or hedge_after >= deadline:
+        return await primary
+
+    done, _ = await asyncio.wait({primary}, timeout=hedge_after)
+    if done:
+        return primary.result()
+    hedge = asyncio.ensure_future(asyncio.wait_for(invoke(name, fn, args, kwargs), deadline - hedge_after))
+    racing = {primary, hedge}
+    error = None
+    while racing:
+        done, racing = await asyncio.wait(racing, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task.exception() is None:
+                for loser in racing:
+                    loser.cancel()
+                return task.result()
+            error = task.exception()
+    raise error
+
+
+async def call(name, fn, *args, fallback=None, **kwargs):
+    """Call an external service through its breaker and policy, using fallback when it is unavailable.
+
+    fn and fallback may be coroutine functions or blocking functions, they receive the same arguments.
+    """
+    policy = POLICIES.get(name, DEFAULT_POLICY)
+    breaker = get_breaker(name)
+    if not breaker.allow():
+        if fallback is None:
+            raise CircuitOpenError(f"{name} is unavailable")
+        print(f"Circuit for {name} is open, using fallback")
+        return await invoke(f"{name}_fallback", fallback, args, kwargs)
+
+    trial = breaker.trial_running  # only ever set for the one call let through a half open breaker
+    error = None
+    try:
+        for retry in range(policy['retries'] + 1):
+            if retry:
+                # full jitter so retries from concurrent uploads don't line up
+                await asyncio.sleep(random.uniform(0, BACKOFF_BASE * 2 ** retry))
+            try:
+                result = await attempt(name, fn, args, kwargs, policy['deadline'], policy['hedge_after'])
+            except Exception as e:
+                error = e
+                print(f"{name} attempt {retry + 1} failed: {e!r}")
+                continue
+            breaker.record_success()
+            return result
+        breaker.record_failure()
+    finally:
+        # a cancelled trial call reports neither outcome, without this the breaker would never let another through
+        if trial:
+            breaker.trial_running = False
+    if fallback is None:
+        raise error
+    print(f"{name} failed, using fallback")
+    return await invoke(f"{name}_fallback", fallback, args, kwargs)
+
+
+def status():
+    return {name: {'state': breaker.state, 'failures': breaker.failures} for name, breaker in breakers.items()}
@@ -0,0 +1,60 @@
+# RESPONSE CACHE FOR STAT COMMANDS
+# !player, !map and !h2h answers only change when a match involving those players is written,
+# so their embeds are kept in memory and tagged with the data versions of the players they show.
+# a write bumps the versions of everyone in the match, which makes their cached answers miss.
+
+import os
+from collections import OrderedDict
+
+RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', 1024))
+
+
+class ResponseCache:
+    def __init__(self, max_size=RESPONSE_CACHE_SIZE):
+        self.max_size = max_size
+        self.entries = OrderedDict()  # (command, args) -> (versions, value)
+        self.global_version = 0       # bumped for changes that can touch anyone (reconcile, imports)
+        self.player_versions = {}     # lowercased name -> version
+        self.hits = 0
+        self.misses = 0
+
+    def versions(self, players):
+        """Snapshot of the versions an answer about these players depends on.
+
+        Take it before querying, so a write landing mid-query leaves the entry already stale.
+        """
+        return (self.global_version,) + tuple(self.player_versions.get(player.lower(), 0) for player in players)
+
+    def get(self, command, args, players):
+        key = (command, tuple(str(arg).lower() for arg in args))
+        entry = self.entries.get(key)
+        if entry is None or entry[0] != self.versions(players):
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, command, args, versions, value):
+        key = (command, tuple(str(arg).lower() for arg in args))
+        self.entries[key] = (versions, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def bump(self, players=None):
+        """Invalidate answers about these players, or about everyone when players is None."""
+        if players is None:
+            self.global_version += 1
+            self.entries.clear()
+            return
+        for player in players:
+            player = player.lower()
+            self.player_versions[player] = self.player_versions.get(player, 0) + 1
+
+    def stats(self):
+        return {'entries': len(self.entries), 'hits': self.hits, 'misses': self.misses}
+
+
+# shared by the bot commands and write.py, which run in the same process
+responses = ResponseCache()
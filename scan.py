@@ -1,7 +1,8 @@
-import cv2
-import io
-import os
+import asyncio
 import utilities
+import ocr_cache
+import workers
+from cpu_tasks import slice_cells, classify_six_nine
 from model_handling import load_model, preprocess_image, predict
 
 # Global model and device initialization
@@ -33,48 +34,63 @@ def correct_mismatches(text):
     return text
 
 
+def finish_cell(char_text, char_path):
+    """Apply the OCR corrections and the 6/9 model to the raw text of one cell."""
+    # Correct any common OCR mismatches first
+    char_text = correct_mismatches(char_text)
+
+    # Additional ML check if OCR detects '6' or '9'
+    if char_text in ['6', '9']:
+        image_for_model = preprocess_image(char_path)  # Ensure this function returns correctly formatted tensor
+        predicted_class = predict(model, device, image_for_model)
+        char_text = '6' if predicted_class == 0 else '9'
+    return char_text
+
+
 def process_stats(image_path):
     global model, device
     if model is None or device is None:
         initialize_model()  # Ensure the model is loaded if not already done
 
-    img = cv2.imread(image_path)
-    row_height = img.shape[0] // 5
-    cropped_dir = 'chars_cropped'
-    if not os.path.exists(cropped_dir):
-        os.makedirs(cropped_dir)
-
     stats = []
-    for i in range(5):
-        row_img = img[i*row_height:(i+1)*row_height, :]
-        char_width = row_img.shape[1] // 3
-
+    for row_cells in slice_cells(image_path):
         row_stats = []
-        for j in range(3):
-            margin_w = int(0.1 * char_width)
-            margin_h = int(0.1 * row_height)
-            char_img = row_img[margin_h:-margin_h, (j*char_width+margin_w):((j+1)*char_width-margin_w)]
-            char_path = os.path.join(cropped_dir, f'row_{i+1}_char_{j+1}.png')
-            cv2.imwrite(char_path, char_img)
+        for cell_png, char_path, cache_key in row_cells:
+            # identical glyphs recur across uploads, only send unseen ones to OCR
+            char_text = ocr_cache.cell_cache.get(cache_key)
+            if char_text is None:
+                # Use utilities to perform OCR
+                char_text = utilities.detect_text_byte(cell_png)
+                ocr_cache.cell_cache.put(cache_key, char_text)
+            row_stats.append(finish_cell(char_text, char_path))
+        stats.append(row_stats)
+    ocr_cache.cell_cache.save()
+    return stats
 
-            _, buffer = cv2.imencode('.png', char_img)
-            byte_img = io.BytesIO(buffer).getvalue()
 
-            # Use utilities to perform OCR
-            char_text = utilities.detect_text_byte(byte_img)
+async def process_stats_async(image_path):
+    """Same as process_stats, but every uncached cell is sent to the OCR gateway at once so they share batches.
 
-            # Correct any common OCR mismatches first
-            char_text = correct_mismatches(char_text)
+    Slicing and the 6/9 model run in the worker pool, the event loop only waits on them.
+    """
+    cells = await workers.cpu_pool.run(slice_cells, image_path)
 
-            # Additional ML check if OCR detects '6' or '9'
-            if char_text in ['6', '9']:
-                image_for_model = preprocess_image(char_path)  # Ensure this function returns correctly formatted tensor
-                predicted_class = predict(model, device, image_for_model)
-                char_text = '6' if predicted_class == 0 else '9'
+    def read_cell(cell_png, cache_key):
+        return ocr_cache.cell_cache.read_through(cache_key, lambda: utilities.detect_text_async(cell_png))
 
-            row_stats.append(char_text)
+    # cells with the same glyph are only looked up once
+    unique_cells = {cache_key: cell_png for row_cells in cells for cell_png, _, cache_key in row_cells}
+    texts = await asyncio.gather(*(read_cell(cell_png, cache_key) for cache_key, cell_png in unique_cells.items()))
+    texts = dict(zip(unique_cells, texts))
+    stats = [[correct_mismatches(texts[cache_key]) for _, _, cache_key in row_cells] for row_cells in cells]
 
-        stats.append(row_stats)
+    # every ambiguous cell of the image goes to the CNN in one task
+    ambiguous = [(i, j) for i, row in enumerate(stats) for j, char_text in enumerate(row) if char_text in ['6', '9']]
+    if ambiguous:
+        predictions = await workers.cpu_pool.run(classify_six_nine, [cells[i][j][1] for i, j in ambiguous])
+        for (i, j), char_text in zip(ambiguous, predictions):
+            stats[i][j] = char_text
+    await asyncio.to_thread(ocr_cache.cell_cache.save)
     return stats
 
 if __name__ == "__main__":
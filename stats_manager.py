@@ -1,35 +1,82 @@
+import asyncio
+
+DEFAULT_MATCH = 'default'
+
+
 class StatsManager:
     def __init__(self):
-        self.team1_info = {}
-        self.team2_info = {}
+        # match_key -> {'team1': {...}, 'team2': {...}, 'gen_info': [...]}
+        self.matches = {}
+        self.confirmed = {}
+
+    def add_match(self, match_key, team1_info, team2_info, gen_info=None, user_id=None, fingerprint=None, batch_key=None, stage='ocr_done'):
+        self.matches[match_key] = {
+            'team1': team1_info,
+            'team2': team2_info,
+            'gen_info': gen_info,
+            'user_id': user_id,
+            'fingerprint': fingerprint,
+            'batch_key': batch_key or match_key,
+            'stage': stage
+        }
+        self.confirmed[match_key] = asyncio.Event()
+        print(f"set teams for match {match_key}")
+
+    async def persist(self, match_key):
+        """Save the match and its stage to the pending store so it survives a restart."""
+        import pending_store
+        match = self.matches.get(match_key)
+        if match is not None:
+            await pending_store.store.save(pending_store.to_record(match_key, match))
+
+    async def set_stage(self, match_key, stage):
+        match = self.matches.get(match_key)
+        if match is not None:
+            match['stage'] = stage
+            await self.persist(match_key)
+
+    def remove_match(self, match_key):
+        self.matches.pop(match_key, None)
+        self.confirmed.pop(match_key, None)
 
-    def get_team_info(self, team):
+    def get_match(self, match_key):
+        return self.matches.get(match_key)
+
+    def get_team_info(self, team, match_key=DEFAULT_MATCH):
+        match = self.matches.get(match_key)
+        if match is None:
+            return None
         if team == 'team1':
-            return self.team1_info
+            return match['team1']
         elif team == 'team2':
-            return self.team2_info
-    
-    def set_teams(self, team1_info, team2_info):
-        self.team1_info = team1_info
-        self.team2_info = team2_info
-        print("set teams")
-
-    def update_team_info(self, team, player, stats):
-        team_info = self.get_team_info(team)
+            return match['team2']
+
+    def get_gen_info(self, match_key=DEFAULT_MATCH):
+        match = self.matches.get(match_key)
+        return match['gen_info'] if match else None
+
+    def set_teams(self, team1_info, team2_info, match_key=DEFAULT_MATCH):
+        self.add_match(match_key, team1_info, team2_info)
+
+    def find_team(self, player, match_key=DEFAULT_MATCH):
+        return 'team1' if player in (self.get_team_info('team1', match_key) or {}) else 'team2'
+
+    def update_team_info(self, team, player, stats, match_key=DEFAULT_MATCH):
+        team_info = self.get_team_info(team, match_key)
         if team_info is not None:
             team_info[player] = stats
 
-    def update_name(self, team, new_name, old_name):
-        team_info = self.get_team_info(team)
-        if old_name in team_info:
+    def update_name(self, team, new_name, old_name, match_key=DEFAULT_MATCH):
+        team_info = self.get_team_info(team, match_key)
+        if team_info is not None and old_name in team_info:
             # Capture the current stats under the old name
             player_stats = team_info.pop(old_name)
             # Assign these stats to the new name
             team_info[new_name] = player_stats
 
-    def update_stat(self, team, player, stat_index, value):
-        team_info = self.get_team_info(team)
-        if player in team_info:
+    def update_stat(self, team, player, stat_index, value, match_key=DEFAULT_MATCH):
+        team_info = self.get_team_info(team, match_key)
+        if team_info is not None and player in team_info:
             # Ensure the stat_index is valid for the stats list
             if stat_index < len(team_info[player]):
                 team_info[player][stat_index] = value
@@ -37,5 +84,15 @@ class StatsManager:
                 # Optionally handle the case where the stat_index is out of range
                 print(f"Stat index {stat_index} is out of range for player {player}")
 
+    def mark_confirmed(self, match_key):
+        event = self.confirmed.get(match_key)
+        if event is not None:
+            event.set()
+
+    async def wait_for_confirmation(self, match_key):
+        event = self.confirmed.get(match_key)
+        if event is not None:
+            await event.wait()
+
 # Create a global instance that can be imported and used throughout your application
 global_stats_manager = StatsManager()
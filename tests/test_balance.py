@@ -0,0 +1,76 @@
+# the team generator picks the most balanced of the 126 splits, checked by hand and against a plain loop
+
+import itertools
+import random
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('asyncpg')
+import ratings
+import balance
+
+NAMES = [f'p{index}' for index in range(10)]
+NO_H2H = np.zeros((10, 10))
+
+
+def test_every_split_is_listed_once():
+    assert balance.SPLITS.shape == (126, 10)
+    assert balance.SPLITS[:, 0].all() and (balance.SPLITS.sum(axis=1) == 5).all()
+    assert len({tuple(split) for split in balance.SPLITS}) == 126
+
+
+def test_strongest_and_weakest_together_balance_the_ratings():
+    # p0 is 400 above everyone else and p1 400 below, so only sharing a team evens the averages out
+    player_ratings = [1900, 1100] + [1500] * 8
+    best = balance.best_splits(NAMES, player_ratings, [1.0] * 10, NO_H2H)
+    for split in best:
+        assert split['score'] == pytest.approx(0)
+        assert split['win_chance'] == pytest.approx(0.5)
+        assert {'p0', 'p1'} <= set(split['team_a'])
+
+    # apart, the team with p0 averages 1580 against 1420
+    scored = balance.score_splits(np.array(player_ratings, dtype=float), np.ones(10), NO_H2H)
+    apart = [index for index, split in enumerate(balance.SPLITS) if not split[1]]
+    expected = 1 / (1 + 10 ** (-160 / ratings.SCALE))
+    assert scored['win_chance'][apart] == pytest.approx(np.full(len(apart), expected))
+    assert scored['score'][apart] == pytest.approx(np.full(len(apart), balance.RATING_WEIGHT * (expected - 0.5) * 2))
+
+
+def test_fraggers_are_split_up():
+    kd = [3.0, 3.0] + [1.0] * 8
+    best = balance.best_splits(NAMES, [1500] * 10, kd, NO_H2H)
+    for split in best:
+        assert split['kd_a'] == pytest.approx(split['kd_b'])
+        assert 'p1' in split['team_b']
+
+
+def test_rivals_on_the_same_team_have_no_edge():
+    wins = NO_H2H.copy()
+    wins[0, 1] = 12  # p0 always beats p1
+    best = balance.best_splits(NAMES, [1500] * 10, [1.0] * 10, wins)
+    assert all({'p0', 'p1'} <= set(split['team_a']) for split in best)
+    assert all(split['score'] == pytest.approx(0) for split in best)
+
+
+def test_best_split_matches_a_plain_search():
+    rng = random.Random(3)
+    player_ratings = [rng.uniform(1200, 1800) for _ in range(10)]
+    kd = [rng.uniform(0.5, 2.0) for _ in range(10)]
+    wins = np.array([[0 if i == j else rng.randint(0, 4) for j in range(10)] for i in range(10)], dtype=float)
+
+    def score(team_a):
+        team_b = [player for player in range(10) if player not in team_a]
+        rating_a = sum(player_ratings[player] for player in team_a) / 5
+        rating_b = sum(player_ratings[player] for player in team_b) / 5
+        win_chance = 1 / (1 + 10 ** ((rating_b - rating_a) / ratings.SCALE))
+        kd_gap = abs(sum(kd[player] for player in team_a) - sum(kd[player] for player in team_b)) / 5 / (sum(kd) / 10)
+        lead = sum(wins[a, b] - wins[b, a] for a in team_a for b in team_b)
+        decided = sum(wins[a, b] + wins[b, a] for a in team_a for b in team_b)
+        edge = lead / decided if decided else 0.0
+        return (balance.RATING_WEIGHT * abs(win_chance - 0.5) * 2 + balance.KD_WEIGHT * kd_gap
+                + balance.H2H_WEIGHT * abs(edge) * decided / (decided + balance.H2H_CONFIDENCE))
+
+    # every way to pick five, so each split shows up twice (once from each side) with the same score
+    plain = sorted(score(team_a) for team_a in itertools.combinations(range(10), 5))
+    best = balance.best_splits(NAMES, player_ratings, kd, wins, count=3)
+    assert [split['score'] for split in best] == pytest.approx(plain[0:6:2])
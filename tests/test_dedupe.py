@@ -0,0 +1,38 @@
+# upload fingerprints: the same submission always hashes the same, a different one never does
+
+import dedupe
+
+IMAGES = {
+    "team1_names": b'\x89PNG names one',
+    "team2_names": b'\x89PNG names two',
+    "team1_stats": b'\x89PNG stats one',
+    "team2_stats": b'\x89PNG stats two'
+}
+
+
+def test_fingerprint_is_stable():
+    first = dedupe.fingerprint(IMAGES, 'Ascent', 'Competitive', '13-11')
+    # a resubmission reads the same bytes into new objects, in whatever order the form lists the files
+    reread = {label: bytearray(IMAGES[label]) for label in reversed(list(IMAGES))}
+    assert dedupe.fingerprint(reread, 'Ascent', 'Competitive', '13-11') == first
+    # the form fields are normalised the way people type them
+    assert dedupe.fingerprint(IMAGES, ' ascent ', 'COMPETITIVE', '13 - 11') == first
+    # and the digest itself doesn't change between runs or versions, the stored fingerprints stay valid
+    assert first == '6a033890b619bcea6d2017755f9a9b32262d8ca1a3566d6e49a91b04707cb9a5'
+
+
+def test_fingerprint_tells_submissions_apart():
+    base = dedupe.fingerprint(IMAGES, 'Ascent', 'Competitive', '13-11')
+    assert dedupe.fingerprint(IMAGES, 'Bind', 'Competitive', '13-11') != base
+    assert dedupe.fingerprint(IMAGES, 'Ascent', 'Competitive', '11-13') != base
+    assert dedupe.fingerprint({**IMAGES, "team2_stats": b'\x89PNG stats 2'}, 'Ascent', 'Competitive', '13-11') != base
+    # swapped screenshots are a different match
+    swapped = {**IMAGES, "team1_stats": IMAGES["team2_stats"], "team2_stats": IMAGES["team1_stats"]}
+    assert dedupe.fingerprint(swapped, 'Ascent', 'Competitive', '13-11') != base
+
+
+def test_bytes_moving_between_images_change_the_fingerprint():
+    # every image is length prefixed, so the boundary between two images is part of the hash
+    one = {**IMAGES, "team1_names": b'ab', "team2_names": b'c'}
+    two = {**IMAGES, "team1_names": b'a', "team2_names": b'bc'}
+    assert dedupe.fingerprint(one, 'Ascent', 'Competitive', '13-11') != dedupe.fingerprint(two, 'Ascent', 'Competitive', '13-11')
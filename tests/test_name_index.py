@@ -0,0 +1,32 @@
+# autocomplete order, limit and case handling of the in-memory name tries
+
+import pytest
+
+pytest.importorskip('asyncpg')
+from name_index import PrefixTrie
+
+
+def test_completions_are_alphabetical_with_a_name_before_its_extensions():
+    trie = PrefixTrie(['Sam', 'samuel', 'Sabre', 'sa', 'Zed', 'Sam_2'])
+    assert trie.complete('sa') == ['sa', 'Sabre', 'Sam', 'Sam_2', 'samuel']
+    assert trie.complete('SAM') == ['Sam', 'Sam_2', 'samuel']
+
+
+def test_limit_keeps_the_first_names_in_order():
+    trie = PrefixTrie([f'player{index:02d}' for index in range(40)])
+    assert trie.complete('p') == [f'player{index:02d}' for index in range(25)]
+    assert trie.complete('player1', limit=3) == ['player10', 'player11', 'player12']
+
+
+def test_unknown_prefix_and_empty_prefix():
+    trie = PrefixTrie(['alpha', 'beta'])
+    assert trie.complete('c') == []
+    assert trie.complete('') == ['alpha', 'beta']
+
+
+def test_names_keep_their_case_and_count_once():
+    trie = PrefixTrie()
+    trie.add('Ghost')
+    trie.add('ghost')
+    assert trie.size == 1
+    assert trie.complete('gh') == ['ghost']  # the latest registration wins
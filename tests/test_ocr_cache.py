@@ -0,0 +1,66 @@
+# the LRU bound and order, persistence, and the cell keys staying put when a glyph moves or the lighting changes
+
+import pytest
+
+np = pytest.importorskip('numpy')
+cv2 = pytest.importorskip('cv2')
+import ocr_cache
+
+
+def cell(text, offset=(0, 0), ink=230, background=30, size=(48, 64)):
+    """A stat cell crop: light digits on a dark background, like the scoreboard."""
+    image = np.full((size[0], size[1], 3), background, dtype=np.uint8)
+    cv2.putText(image, text, (12 + offset[0], 36 + offset[1]), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (ink, ink, ink), 2)
+    return image
+
+
+def test_size_is_bounded_and_least_recently_used_goes_first():
+    cache = ocr_cache.OCRCache(max_size=3, path=None)
+    for key in 'abc':
+        cache.put(key, key.upper())
+    assert cache.get('a') == 'A'  # a is now the most recently used
+    cache.put('d', 'D')
+    assert list(cache.entries) == ['c', 'a', 'd']
+    assert cache.get('b') is None
+    cache.put('e', 'E')
+    assert list(cache.entries) == ['a', 'd', 'e']
+    assert len(cache.entries) == 3
+
+
+def test_save_and_load_keep_entries_and_order(tmp_path):
+    path = str(tmp_path / 'cells.json')
+    cache = ocr_cache.OCRCache(max_size=4, path=path)
+    for key, text in [('one', '1'), ('two', '2'), ('three', '3')]:
+        cache.put(key, text)
+    cache.get('one')
+    cache.save()
+    assert not cache.dirty
+
+    loaded = ocr_cache.OCRCache(max_size=4, path=path)
+    assert list(loaded.entries.items()) == [('two', '2'), ('three', '3'), ('one', '1')]
+    assert not loaded.dirty
+    # the restored order decides what goes first
+    loaded.put('four', '4')
+    loaded.put('five', '5')
+    assert 'two' not in loaded.entries and 'one' in loaded.entries
+
+
+def test_unreadable_cache_file_starts_empty(tmp_path):
+    path = tmp_path / 'cells.json'
+    path.write_text('not json')
+    assert len(ocr_cache.OCRCache(path=str(path)).entries) == 0
+
+
+def test_cell_key_is_stable():
+    key = ocr_cache.cell_key(cell('7'))
+    assert ocr_cache.cell_key(cell('7')) == key
+    assert ocr_cache.cell_key(cell('7', offset=(5, 3))) == key
+    assert ocr_cache.cell_key(cell('7', ink=200, background=60)) == key
+    # dark on light is the same glyph
+    assert ocr_cache.cell_key(cell('7', ink=30, background=230)) == key
+
+
+def test_cell_key_tells_glyphs_apart():
+    keys = {ocr_cache.cell_key(cell(text)) for text in ['1', '4', '7', '8', '14']}
+    assert len(keys) == 5
+    assert ocr_cache.cell_key(np.full((48, 64), 30, dtype=np.uint8)) == 'empty'
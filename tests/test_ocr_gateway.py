@@ -0,0 +1,86 @@
+# readings from the local fallback are used for the upload but never cached, real Vision readings are
+
+import asyncio
+from types import SimpleNamespace
+import pytest
+
+pytest.importorskip('cv2')
+pytest.importorskip('google.cloud.vision')
+import resilience
+import ocr_cache
+import ocr_gateway
+
+
+class FailingVision:
+    async def batch_annotate_images(self, requests):
+        raise ConnectionError("vision is down")
+
+
+class WorkingVision:
+    async def batch_annotate_images(self, requests):
+        result = SimpleNamespace(error=SimpleNamespace(message=''), text_annotations=[SimpleNamespace(description='7')])
+        return SimpleNamespace(responses=[result for _ in requests])
+
+
+@pytest.fixture(autouse=True)
+def isolated(monkeypatch):
+    monkeypatch.setattr(resilience, 'BACKOFF_BASE', 0)
+    resilience.breakers.clear()
+    yield
+    resilience.breakers.clear()
+
+
+def read(gateway, cache):
+    async def run():
+        return await cache.read_through('cell', lambda: gateway.detect_text(b'glyph'))
+    return asyncio.run(run())
+
+
+def test_failing_vision_leaves_the_cache_empty():
+    gateway = ocr_gateway.OCRGateway(credentials=None, local_ocr=lambda content: '1')
+    gateway.client = FailingVision()
+    cache = ocr_cache.OCRCache(path=None)
+
+    text = read(gateway, cache)
+    assert text == '1' and isinstance(text, ocr_gateway.FallbackText)
+    assert len(cache.entries) == 0 and not cache.dirty
+
+
+def test_open_breaker_reading_is_not_cached():
+    gateway = ocr_gateway.OCRGateway(credentials=None, local_ocr=lambda content: '1')
+    gateway.client = WorkingVision()
+    breaker = resilience.get_breaker('vision')
+    breaker.failures = breaker.failure_threshold
+    breaker.record_failure()
+    cache = ocr_cache.OCRCache(path=None)
+
+    assert read(gateway, cache) == '1'
+    assert len(cache.entries) == 0
+
+
+def test_vision_readings_are_cached():
+    gateway = ocr_gateway.OCRGateway(credentials=None)
+    gateway.client = WorkingVision()
+    cache = ocr_cache.OCRCache(path=None)
+
+    assert read(gateway, cache) == '7'
+    assert cache.entries == {'cell': '7'}
+    # served from the cache from now on, even with Vision gone
+    gateway.client = FailingVision()
+    assert read(gateway, cache) == '7'
+
+
+def test_batches_in_flight_are_tracked_until_done():
+    gateway = ocr_gateway.OCRGateway(credentials=None)
+    gateway.client = WorkingVision()
+
+    async def run():
+        reading = asyncio.ensure_future(gateway.detect_text(b'glyph'))
+        await asyncio.sleep(0)
+        gateway.flush()
+        assert len(gateway.tasks) == 1
+        assert await reading == '7'
+        await asyncio.sleep(0)
+        assert not gateway.tasks
+
+    asyncio.run(run())
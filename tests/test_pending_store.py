@@ -0,0 +1,65 @@
+# the sqlite pending store keeps matches and access codes across a restart, and expired codes stop working
+
+import asyncio
+import pytest
+
+pytest.importorskip('asyncpg')
+pytest.importorskip('cloudinary')  # pending_store imports utilities
+import pending_store
+
+
+def record(match_key, stage=pending_store.STAGE_OCR_DONE, batch_key='batch'):
+    return {
+        'match_key': match_key,
+        'batch_key': batch_key,
+        'user_id': '1234',
+        'fingerprint': f'{match_key}-fingerprint',
+        'gen_info': ['Ascent', 'Competitive', '13-11'],
+        'team1': {'alpha': [20, 10, 5]},
+        'team2': {'bravo': [10, 20, 3]},
+        'stage': stage
+    }
+
+
+def test_matches_survive_a_reopen(tmp_path):
+    path = str(tmp_path / 'pending.db')
+
+    async def run():
+        store = pending_store.SqlitePendingStore(path)
+        await store.save_many([record('one'), record('two', stage=pending_store.STAGE_STAGED)])
+        await store.save(record('one', stage=pending_store.STAGE_CONFIRMED))
+
+        reopened = pending_store.SqlitePendingStore(path)
+        loaded = await reopened.load_all()
+        assert [match['match_key'] for match in loaded] == ['one', 'two']
+        assert loaded[0]['stage'] == pending_store.STAGE_CONFIRMED
+        assert loaded[0]['team1'] == {'alpha': [20, 10, 5]} and loaded[0]['gen_info'] == ['Ascent', 'Competitive', '13-11']
+        assert [match['match_key'] for match in await reopened.load_all(pending_store.STAGE_STAGED)] == ['two']
+
+        await reopened.delete(['one'])
+        assert [match['match_key'] for match in await pending_store.SqlitePendingStore(path).load_all()] == ['two']
+
+    asyncio.run(run())
+
+
+def test_access_codes_survive_a_reopen_and_expire(tmp_path):
+    path = str(tmp_path / 'pending.db')
+
+    async def run():
+        store = pending_store.SqlitePendingStore(path)
+        await store.save_code('expired', 42, ttl=-1)
+        await store.save_code('long', 43, ttl=600)
+
+        reopened = pending_store.SqlitePendingStore(path)
+        assert await reopened.get_code('long') == '43'
+        assert await reopened.get_code('expired') is None
+        assert await reopened.get_code('missing') is None
+        # the expired code is still stored until the purge
+        assert reopened._execute("SELECT COUNT(*) AS codes FROM access_codes")['codes'] == 2
+        await reopened.purge_codes()
+        assert reopened._execute("SELECT COUNT(*) AS codes FROM access_codes")['codes'] == 1
+
+        await reopened.delete_code('long')
+        assert await pending_store.SqlitePendingStore(path).get_code('long') is None
+
+    asyncio.run(run())
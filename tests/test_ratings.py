@@ -0,0 +1,76 @@
+# the incremental update write.py applies and the full replay must give the same ratings
+
+import random
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('asyncpg')
+import ratings
+
+
+def incremental(matches, k=ratings.K_FACTOR):
+    """Apply team_deltas match by match, like write.update_ratings does."""
+    current, peaks, rated = {}, {}, {}
+    for team1, team2, team1_score, team2_score in matches:
+        team1_delta, team2_delta = ratings.team_deltas(
+            [current.get(player, ratings.BASE_RATING) for player in team1],
+            [current.get(player, ratings.BASE_RATING) for player in team2],
+            team1_score, team2_score, k
+        )
+        for players, delta in ((team1, team1_delta), (team2, team2_delta)):
+            for player in players:
+                current[player] = current.get(player, ratings.BASE_RATING) + delta
+                peaks[player] = max(peaks.get(player, ratings.BASE_RATING), current[player])
+                rated[player] = rated.get(player, 0) + 1
+    return current, peaks, rated
+
+
+def history_arrays(matches):
+    """One entry per Player_Stats row, grouped by match, the shape ratings.HISTORY_QUERY returns."""
+    match_ids, player_ids, won, team1_scores, team2_scores = [], [], [], [], []
+    for match_id, (team1, team2, team1_score, team2_score) in enumerate(matches, start=1):
+        for players, team_won in ((team1, team1_score > team2_score), (team2, team2_score > team1_score)):
+            for player in players:
+                match_ids.append(match_id)
+                player_ids.append(player)
+                won.append(team_won)
+                team1_scores.append(team1_score)
+                team2_scores.append(team2_score)
+    return (np.array(match_ids), np.array(player_ids), np.array(won, dtype=bool),
+            np.array(team1_scores), np.array(team2_scores))
+
+
+def random_matches(count, seed=7):
+    rng = random.Random(seed)
+    matches = []
+    for _ in range(count):
+        players = rng.sample(range(1, 31), 10)
+        team1_score = rng.randint(0, 13)
+        team2_score = rng.choice([13, team1_score, rng.randint(0, 13)])
+        matches.append((players[:5], players[5:], team1_score, team2_score))
+    return matches
+
+
+def test_replay_matches_incremental_updates():
+    matches = random_matches(300)
+    current, peaks, rated = incremental(matches)
+    players, replayed, replayed_peaks, matches_rated = ratings.replay(*history_arrays(matches))
+    for player, rating, peak, count in zip(players, replayed, replayed_peaks, matches_rated):
+        assert rating == pytest.approx(current[player])
+        assert peak == pytest.approx(peaks[player])
+        assert count == rated[player]
+
+
+def test_draws_and_upsets():
+    assert ratings.team_deltas([1500] * 5, [1500] * 5, 7, 7) == (0.0, 0.0)
+    favourite_win, _ = ratings.team_deltas([1700] * 5, [1300] * 5, 13, 11)
+    upset_win, _ = ratings.team_deltas([1300] * 5, [1700] * 5, 13, 11)
+    assert 0 < favourite_win < upset_win
+    team1_delta, team2_delta = ratings.team_deltas([1500] * 5, [1500] * 5, 2, 13)
+    assert team1_delta == -team2_delta < 0
+
+
+def test_replay_of_an_empty_history():
+    empty = np.empty(0, dtype=np.int64)
+    players, replayed, _, matches_rated = ratings.replay(empty, empty, empty.astype(bool), empty, empty)
+    assert len(players) == len(replayed) == len(matches_rated) == 0
@@ -0,0 +1,178 @@
+# breaker state machine, retries, deadlines and hedging, with the faults hook standing in for a bad upstream
+
+import time
+import asyncio
+import pytest
+import resilience
+
+
+@pytest.fixture(autouse=True)
+def isolated(monkeypatch):
+    monkeypatch.setattr(resilience, 'BACKOFF_BASE', 0)
+    monkeypatch.setitem(resilience.POLICIES, 'test', {'deadline': 1.0, 'retries': 2, 'hedge_after': None})
+    resilience.breakers.clear()
+    resilience.clear_faults()
+    yield
+    resilience.breakers.clear()
+    resilience.clear_faults()
+
+
+def reopen_window_passed(breaker):
+    breaker.opened_at = time.monotonic() - breaker.reset_timeout
+
+
+def test_breaker_opens_after_threshold_and_rejects():
+    breaker = resilience.CircuitBreaker('test', failure_threshold=3, reset_timeout=30)
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.state == 'closed' and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    assert not breaker.allow()
+
+
+def test_half_open_lets_one_trial_through():
+    breaker = resilience.CircuitBreaker('test', failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    reopen_window_passed(breaker)
+    assert breaker.state == 'half_open'
+    assert breaker.allow()
+    assert not breaker.allow()
+
+
+def test_trial_success_closes_and_failure_reopens():
+    breaker = resilience.CircuitBreaker('test', failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    reopen_window_passed(breaker)
+    breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == 'open'
+
+    reopen_window_passed(breaker)
+    breaker.allow()
+    breaker.record_success()
+    assert breaker.state == 'closed' and breaker.failures == 0
+
+
+def test_retries_until_success():
+    calls = []
+
+    async def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise ConnectionError("down")
+        return 'ok'
+
+    assert asyncio.run(resilience.call('test', flaky)) == 'ok'
+    assert len(calls) == 3
+    assert resilience.get_breaker('test').failures == 0
+
+
+def test_injected_errors_exhaust_retries_then_fall_back():
+    resilience.set_fault('test', error_rate=1.0)
+    fallback_calls = []
+
+    def fallback(value):
+        fallback_calls.append(value)
+        return value * 2
+
+    async def never_reached(value):
+        raise AssertionError("the fault fires before the call")
+
+    assert asyncio.run(resilience.call('test', never_reached, 21, fallback=fallback)) == 42
+    assert fallback_calls == [21]
+    assert resilience.get_breaker('test').failures == 1
+
+
+def test_injected_errors_without_fallback_raise():
+    resilience.set_fault('test', error_rate=1.0)
+
+    async def service():
+        return 'ok'
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(resilience.call('test', service))
+
+
+def test_open_breaker_skips_the_upstream():
+    resilience.set_fault('test', error_rate=1.0)
+    breaker = resilience.get_breaker('test')
+    calls = []
+
+    async def service():
+        calls.append(1)
+        return 'upstream'
+
+    async def run():
+        for _ in range(breaker.failure_threshold):
+            await resilience.call('test', service, fallback=lambda: 'fallback')
+        assert breaker.state == 'open'
+        resilience.clear_faults()
+        return await resilience.call('test', service, fallback=lambda: 'fallback')
+
+    assert asyncio.run(run()) == 'fallback'
+    assert calls == []
+    with pytest.raises(resilience.CircuitOpenError):
+        asyncio.run(resilience.call('test', service))
+
+
+def test_injected_delay_hits_the_deadline(monkeypatch):
+    monkeypatch.setitem(resilience.POLICIES, 'test', {'deadline': 0.05, 'retries': 1, 'hedge_after': None})
+    resilience.set_fault('test', delay=0.5)
+
+    async def service():
+        return 'upstream'
+
+    assert asyncio.run(resilience.call('test', service, fallback=lambda: 'fallback')) == 'fallback'
+
+
+def test_hedge_wins_over_a_slow_primary(monkeypatch):
+    monkeypatch.setitem(resilience.POLICIES, 'test', {'deadline': 2.0, 'retries': 0, 'hedge_after': 0.05})
+    calls = []
+
+    async def service():
+        calls.append(1)
+        if len(calls) == 1:
+            await asyncio.sleep(1.0)
+            return 'primary'
+        return 'hedge'
+
+    started = time.monotonic()
+    assert asyncio.run(resilience.call('test', service)) == 'hedge'
+    assert time.monotonic() - started < 0.5
+    assert len(calls) == 2
+
+
+def test_fast_primary_is_not_hedged(monkeypatch):
+    monkeypatch.setitem(resilience.POLICIES, 'test', {'deadline': 2.0, 'retries': 0, 'hedge_after': 0.5})
+    calls = []
+
+    async def service():
+        calls.append(1)
+        return 'primary'
+
+    assert asyncio.run(resilience.call('test', service)) == 'primary'
+    assert len(calls) == 1
+
+
+def test_cancelled_trial_lets_the_next_call_try():
+    breaker = resilience.get_breaker('test')
+    breaker.record_failure()
+    breaker.opened_at = time.monotonic() - breaker.reset_timeout
+    breaker.failures = breaker.failure_threshold
+
+    async def hangs():
+        await asyncio.sleep(10)
+
+    async def run():
+        trial = asyncio.ensure_future(resilience.call('test', hangs))
+        await asyncio.sleep(0.01)
+        assert breaker.trial_running
+        trial.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await trial
+        assert not breaker.trial_running
+        return await resilience.call('test', lambda: 'ok')
+
+    assert asyncio.run(run()) == 'ok'
+    assert breaker.state == 'closed'
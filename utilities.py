@@ -6,14 +6,25 @@ import cloudinary.api
 import requests
 import os
 import re
+import uuid
 import asyncpg
+import asyncio
+import cv2
+import numpy as np
 import bot
+import ocr_gateway
+import resilience
+from repository import repo
 from fuzzywuzzy import process
 from psycopg2 import OperationalError
 from google.cloud import vision
 from dotenv import load_dotenv
 from google.oauth2 import service_account
 
+try:
+    import pytesseract  # optional, local OCR used while Vision is unavailable
+except ImportError:
+    pytesseract = None
 
 
 # Configure your Cloudinary credentials
@@ -42,6 +53,17 @@ credentials = service_account.Credentials.from_service_account_info({
 
 client = vision.ImageAnnotatorClient(credentials=credentials)
 
+
+def detect_text_local(byte_content):
+    """Local OCR fallback, only as good as tesseract on game fonts but keeps uploads moving."""
+    image = cv2.imdecode(np.frombuffer(byte_content, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+    text = pytesseract.image_to_string(image).strip()
+    return text if text else "No text found"
+
+
+# batches OCR requests from concurrent uploads, used by the async pipeline
+gateway = ocr_gateway.OCRGateway(credentials, local_ocr=detect_text_local if pytesseract else None)
+
 def detect_text_path(image_path):
     """Use Google Vision API for OCR."""
     with open(image_path, "rb") as image_file:
@@ -60,6 +82,11 @@ def detect_text_byte(byte_content):
     return texts[0].description if texts else "No text found"
 
 
+async def detect_text_async(byte_content):
+    """Use Google Vision API for OCR through the batching gateway."""
+    return await gateway.detect_text(byte_content)
+
+
 def process_team_stats(file_path):
     """Uploads an image to Cloudinary, applies color inversion and contrast enhancement, and saves it locally."""
     # Upload the image and apply the 'negate' effect to invert colors followed by increasing contrast
@@ -74,14 +101,36 @@ def process_team_stats(file_path):
     print("Processed image URL:", processed_image_url)
 
     # Download the processed image and save it locally
-    image_data = requests.get(processed_image_url).content
-    local_filename = "processed_image.png"  # Local filename to save the image
+    download = requests.get(processed_image_url, timeout=resilience.POLICIES['cloudinary']['deadline'])
+    download.raise_for_status()
+    image_data = download.content
+    local_filename = processed_path(file_path)
     with open(local_filename, 'wb') as file:
         file.write(image_data)
     print(f"Processed image saved locally as {local_filename}")
     return local_filename
 
 
+def process_team_stats_local(file_path):
+    """Local stand-in for the Cloudinary transform: invert the colors, then boost contrast with CLAHE."""
+    image = cv2.imread(file_path)
+    inverted = cv2.bitwise_not(image)
+    lab = cv2.cvtColor(inverted, cv2.COLOR_BGR2LAB)
+    lightness, a, b = cv2.split(lab)
+    lightness = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8)).apply(lightness)
+    enhanced = cv2.cvtColor(cv2.merge((lightness, a, b)), cv2.COLOR_LAB2BGR)
+    local_filename = processed_path(file_path)
+    cv2.imwrite(local_filename, enhanced)
+    print(f"Processed image locally as {local_filename}")
+    return local_filename
+
+
+def processed_path(file_path):
+    """A new output path for every attempt. A timed out Cloudinary thread keeps running and could otherwise
+    overwrite the file a retry or the local fallback already returned."""
+    return os.path.join(os.path.dirname(file_path), f"processed_{uuid.uuid4().hex[:8]}_{os.path.basename(file_path)}")
+
+
 def convert_path(path):
     return path.replace("\\", "/")
 
@@ -99,13 +148,16 @@ def clean_and_convert_stats(stats_text):
             cleaned_stats.append(0)  # Append zero or any other default value
     return cleaned_stats
 
-def process_team(names_path : str, stats_path : str, team_dict : dict):
+async def process_team(names_path : str, stats_path : str, team_dict : dict):
 
     import scan
-    names_text = detect_text_path(names_path)
-    stats_path_processed = process_team_stats(stats_path)
-    stats_text = scan.process_stats(stats_path_processed)
-    names_text = names_text.splitlines()
+    with open(names_path, "rb") as image_file:
+        names_content = image_file.read()
+    # names OCR runs while the stats image is being processed
+    names_task = asyncio.ensure_future(detect_text_async(names_content))
+    stats_path_processed = await resilience.call('cloudinary', process_team_stats, stats_path, fallback=process_team_stats_local)
+    stats_text = await scan.process_stats_async(stats_path_processed)
+    names_text = (await names_task).splitlines()
     for index in range(len(names_text)):
         stats_as_ints = clean_and_convert_stats(stats_text[index])
         team_dict[names_text[index]] = stats_as_ints
@@ -126,6 +178,17 @@ async def create_connection():
         print(f"An error occurred: {e}")
         return None
 
+async def create_pool(**kwargs):
+    """Create a connection pool with the same settings as create_connection."""
+    return await asyncpg.create_pool(
+        database= os.getenv('DB_NAME'),
+        user= os.getenv('USER'),
+        password= os.getenv('PASSWORD'),
+        host= os.getenv('HOST_NAME'),
+        ssl="require",
+        **kwargs
+    )
+
 # remove new line chars from scoreboard strings
 def clean_board(scbd):
     cleaned_scbd = {}
@@ -180,11 +243,6 @@ def get_exact_match(name, list_of_names):
 
 
 # obtain a list of all known player names from db
-def get_all_player_names(connection):
-    query = "SELECT name FROM players;"
-    with connection.cursor() as cursor:
-        cursor.execute(query)
-        # Fetch all rows, each containing one name
-        names = [row[0] for row in cursor.fetchall()]
-    return names 
+async def get_all_player_names():
+    return [row['name'] for row in await repo.fetch('player names')]
 
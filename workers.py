@@ -0,0 +1,99 @@
+# PROCESS POOL FOR CPU-BOUND STAGES
+# cell slicing, the 6/9 CNN, picture compositing and profile picture variants run here instead of on the
+# event loop shared by uvicorn and the discord client. tasks are the functions in cpu_tasks.py (or any
+# other top level function), workers preload the CNN, and stats() reports queue depth and timings.
+
+import os
+import time
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import cpu_tasks
+
+CPU_WORKERS = int(os.getenv('CPU_WORKERS', min(4, os.cpu_count() or 1)))  # 0 runs tasks in threads instead
+# spawn keeps grpc and torch state from the parent out of the workers, fork starts faster
+START_METHOD = os.getenv('CPU_POOL_START_METHOD', 'spawn')
+
+
+class WorkerPool:
+    def __init__(self, max_workers=CPU_WORKERS, start_method=START_METHOD):
+        self.max_workers = max_workers
+        self.start_method = start_method
+        self.executor = None
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.restarts = 0
+        self.timings = {}  # task name -> [calls, total seconds]
+
+    def start(self):
+        """Create the pool and have every worker load the CNN now rather than on its first task."""
+        if self.executor is None and self.max_workers:
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context(self.start_method),
+                initializer=cpu_tasks.warm
+            )
+            # processes are started lazily, one trivial task per worker brings them all up
+            for _ in range(self.max_workers):
+                self.executor.submit(os.getpid)
+        return self
+
+    async def run(self, fn, *args):
+        """Run fn(*args) in a worker process and return its result."""
+        name = fn.__name__
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        started = time.perf_counter()
+        try:
+            if not self.max_workers:
+                result = await asyncio.to_thread(fn, *args)
+            else:
+                result = await self.run_in_pool(name, fn, args)
+            self.completed += 1
+            return result
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            timing = self.timings.setdefault(name, [0, 0.0])
+            timing[0] += 1
+            timing[1] += time.perf_counter() - started
+
+    async def run_in_pool(self, name, fn, args):
+        executor = self.start().executor
+        try:
+            return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+        except BrokenProcessPool:
+            # a worker died (out of memory, segfault in native code), replace the pool and retry once.
+            # every task in flight on it gets here, only the first replaces it and the rest retry on the new one
+            if self.executor is executor:
+                print(f"Worker pool broke while running {name}, restarting it")
+                executor.shutdown(wait=False, cancel_futures=True)
+                self.executor = None
+                self.restarts += 1
+            return await asyncio.get_running_loop().run_in_executor(self.start().executor, fn, *args)
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    def stats(self):
+        return {
+            'workers': self.max_workers,
+            'in_flight': self.in_flight,
+            # tasks waiting for a free worker
+            'queue_depth': max(0, self.in_flight - self.max_workers) if self.max_workers else 0,
+            'peak_in_flight': self.peak_in_flight,
+            'completed': self.completed,
+            'failed': self.failed,
+            'restarts': self.restarts,
+            'avg_seconds': {name: round(total / calls, 4) for name, (calls, total) in self.timings.items()}
+        }
+
+
+cpu_pool = WorkerPool()
@@ -1,3 +1,10 @@
+from response_cache import responses
+from name_index import names
+from repository import repo
+from percentiles import snapshot
+import ratings
+import cache_events
+
 
 async def write_match_data(connection, team1_info, team2_info, gen_info):
     map_name, match_type, final_score = gen_info
@@ -7,28 +14,36 @@ async def write_match_data(connection, team1_info, team2_info, gen_info):
 
 
     # Ensure map and match type exist and get their IDs
-    map_id = await ensure_exists(connection, 'Maps', 'map_name', map_name, 'map_id')
-    match_type_id = await ensure_exists(connection, 'Match_Types', 'description', match_type, 'match_type_id')
+    map_id = await ensure_exists(connection, 'Maps', map_name)
+    match_type_id = await ensure_exists(connection, 'Match_Types', match_type)
 
-    # Insert the match and get its ID
-    match_id = await insert_match(connection, map_id, match_type_id, final_score)
+    # Insert the match and get its ID and date
+    match_id, match_date = await insert_match(connection, map_id, match_type_id, final_score)
+    await ensure_player_stats_partition(connection, match_date)
+    season_id = await find_season(connection, match_date)
 
     # Process stats for each team
-    await process_team_stats(connection, match_id, team1_info, team1_score, team2_score)
-    await process_team_stats(connection, match_id, team2_info, team2_score, team1_score)
+    await process_team_stats(connection, match_id, match_date, season_id, team1_info, team1_score, team2_score)
+    await process_team_stats(connection, match_id, match_date, season_id, team2_info, team2_score, team1_score)
 
     # Update head-to-head records
-    await update_h2h_records(connection, team1_info, team2_info, team1_score, team2_score)
+    await update_h2h_records(connection, team1_info, team2_info, team1_score, team2_score, map_id)
+    await update_ratings(connection, team1_info, team2_info, team1_score, team2_score)
+    # delivered to the other processes when the transaction commits
+    await cache_events.notify('match', [*team1_info, *team2_info], connection=connection)
+    return match_id
+
+# table -> the repository query that looks up its ID by name
+ID_QUERIES = {'Players': 'player id', 'Maps': 'map id', 'Match_Types': 'match type id'}
 
-async def ensure_exists(connection, table, column, value, id_column):
+async def ensure_exists(connection, table, value):
     """Ensure the entity exists in the database and return its ID. Insert if not exists."""
-    query = f"SELECT {id_column} FROM {table} WHERE {column} = $1"
-    entity_id = await connection.fetchval(query, value)
+    entity_id = await repo.fetchval(ID_QUERIES[table], value, connection=connection)
     if entity_id is None:
         if table == 'Players':
             # Insert new player since it's expected that new players might not exist
-            insert_query = f"INSERT INTO {table} ({column}) VALUES ($1) RETURNING {id_column}"
-            entity_id = await connection.fetchval(insert_query, value)
+            entity_id = await repo.fetchval('insert player', value, connection=connection)
+            await cache_events.notify('player', [value], connection=connection)
         else:
             # For maps and match types, raise an error as these are expected to be preloaded
             raise ValueError(f"Expected entity '{value}' not found in table '{table}'. Please check your database initialization.")
@@ -37,74 +52,112 @@ async def ensure_exists(connection, table, column, value, id_column):
 
 
 async def insert_match(connection, map_id, match_type_id, score):
-    """Insert a match record and return the match ID."""
-    query = """
-        INSERT INTO Matches (map_id, match_type_id, score, date)
-        VALUES ($1, $2, $3, NOW())
-        RETURNING match_id
-    """
-    return await connection.fetchval(query, map_id, match_type_id, score)
+    """Insert a match record and return the match ID and date."""
+    row = await repo.fetchrow('insert match', map_id, match_type_id, score, connection=connection)
+    return row['match_id'], row['date']
+
+async def ensure_player_stats_partition(connection, match_date):
+    """Player_Stats is partitioned by month, make sure the partition for this match exists."""
+    await repo.execute('ensure partition', match_date, connection=connection)
+
+async def find_season(connection, match_date):
+    """Return the season the date falls in, or None if no season covers it."""
+    return await repo.fetchval('find season', match_date, connection=connection)
 
-async def process_team_stats(connection, match_id, team_info, team_score, opponent_score):
-    """Insert player stats and update aggregate stats for each player."""
+async def process_team_stats(connection, match_id, match_date, season_id, team_info, team_score, opponent_score):
+    """Insert player stats and update aggregate and season stats for each player."""
     result = 'w' if team_score > opponent_score else 'l'
     for player_name, stats in team_info.items():
-        player_id = await ensure_exists(connection, 'Players', 'name', player_name, 'player_id')
+        player_id = await ensure_exists(connection, 'Players', player_name)
         kills, deaths, assists = stats
-        await insert_player_stats(connection, player_id, match_id, kills, deaths, assists, result)
+        await insert_player_stats(connection, player_id, match_id, match_date, kills, deaths, assists, result)
         await update_player_aggregate_stats(connection, player_id, kills, deaths, assists, team_score, opponent_score)
+        if season_id is not None:
+            await update_player_season_stats(connection, player_id, season_id, kills, deaths, assists, team_score, opponent_score)
 
-async def insert_player_stats(connection, player_id, match_id, kills, deaths, assists, result):
-    """Insert player stats for a single match."""
-    query = """
-        INSERT INTO Player_Stats (player_id, match_id, kills, deaths, assists, result)
-        VALUES ($1, $2, $3, $4, $5, $6)
-    """
-    await connection.execute(query, player_id, match_id, kills, deaths, assists, result)
+async def insert_player_stats(connection, player_id, match_id, match_date, kills, deaths, assists, result):
+    """Insert player stats for a single match. match_date is the partition key."""
+    await repo.execute('insert player stats', player_id, match_id, match_date, kills, deaths, assists, result, connection=connection)
 
 async def update_player_aggregate_stats(connection, player_id, kills, deaths, assists, wins, losses):
     """Update aggregate stats for a player."""
-    query = """
-        INSERT INTO Player_Aggregate_Stats (player_id, map_id, match_type_id, total_kills, total_deaths, total_assists, matches_played, matches_won, matches_lost)
-        VALUES ($1, NULL, NULL, $2, $3, $4, 1, $5, $6)
-        ON CONFLICT (player_id, map_id, match_type_id)
-        DO UPDATE SET
-            total_kills = Player_Aggregate_Stats.total_kills + EXCLUDED.total_kills,
-            total_deaths = Player_Aggregate_Stats.total_deaths + EXCLUDED.total_deaths,
-            total_assists = Player_Aggregate_Stats.total_assists + EXCLUDED.total_assists,
-            matches_played = Player_Aggregate_Stats.matches_played + 1,
-            matches_won = Player_Aggregate_Stats.matches_won + EXCLUDED.matches_won,
-            matches_lost = Player_Aggregate_Stats.matches_lost + EXCLUDED.matches_lost
-    """
-    await connection.execute(query, player_id, kills, deaths, assists, (1 if wins > losses else 0), (1 if losses > wins else 0))
+    await repo.execute('upsert aggregate stats', player_id, kills, deaths, assists, (1 if wins > losses else 0), (1 if losses > wins else 0), connection=connection)
 
+async def update_player_season_stats(connection, player_id, season_id, kills, deaths, assists, wins, losses):
+    """Update a player's totals for the season the match was played in."""
+    await repo.execute('upsert season stats', player_id, season_id, kills, deaths, assists, (1 if wins > losses else 0), (1 if losses > wins else 0), connection=connection)
 
-async def update_h2h_records(connection, team1_info, team2_info, team1_score, team2_score):
-    """ Update H2H records for all combinations of players from two teams """
+
+async def update_h2h_records(connection, team1_info, team2_info, team1_score, team2_score, map_id):
+    """ Update H2H records and per-map pair stats for all combinations of players from two teams """
+    if team1_score == team2_score:
+        # Player_Stats stores a draw as 'l' for both sides, so the history can't tell who played against whom.
+        # head-to-head leaves draws out everywhere (backfill.py, reconcile.py and migration 4 do the same)
+        return
     team1_won = team1_score > team2_score
-    for player1 in team1_info.keys():
-        player1_id = await ensure_exists(connection, 'Players', 'name', player1, 'player_id')
-        for player2 in team2_info.keys():
-            player2_id = await ensure_exists(connection, 'Players', 'name', player2, 'player_id')
-            if player1_id and player2_id:
-                # Ensure player_one_id is always less than player_two_id
-                if player1_id < player2_id:
-                    await update_individual_h2h_record(connection, player1_id, player2_id, team1_won)
-                else:
-                    await update_individual_h2h_record(connection, player2_id, player1_id, not team1_won)
-
-async def update_individual_h2h_record(connection, player_one_id, player_two_id, team1_won):
-    """ Insert or update an individual H2H record """
-    query = """
-        INSERT INTO H2H_Records (player_one_id, player_two_id, player_one_wins, player_two_wins)
-        VALUES ($1, $2, $3, $4)
-        ON CONFLICT (player_one_id, player_two_id)
-        DO UPDATE SET
-            player_one_wins = H2H_Records.player_one_wins + EXCLUDED.player_one_wins,
-            player_two_wins = H2H_Records.player_two_wins + EXCLUDED.player_two_wins;
+    team2_won = team2_score > team1_score
+    team1_ids = {player: await ensure_exists(connection, 'Players', player) for player in team1_info}
+    team2_ids = {player: await ensure_exists(connection, 'Players', player) for player in team2_info}
+
+    records = []
+    pair_stats = []
+    for player1, player1_id in team1_ids.items():
+        kills1, deaths1, _ = team1_info[player1]
+        for player2, player2_id in team2_ids.items():
+            kills2, deaths2, _ = team2_info[player2]
+            if not player1_id or not player2_id or player1_id == player2_id:
+                continue
+            # Ensure player_one_id is always less than player_two_id
+            if player1_id < player2_id:
+                records.append((player1_id, player2_id, int(team1_won), int(not team1_won)))
+                pair_stats.append((player1_id, player2_id, map_id, int(team1_won), int(team2_won), kills1, deaths1, kills2, deaths2))
+            else:
+                records.append((player2_id, player1_id, int(not team1_won), int(team1_won)))
+                pair_stats.append((player2_id, player1_id, map_id, int(team2_won), int(team1_won), kills2, deaths2, kills1, deaths1))
+
+    await update_individual_h2h_records(connection, records)
+    await update_h2h_pair_stats(connection, pair_stats)
+
+async def update_individual_h2h_records(connection, records):
+    """ Insert or update H2H records, one (player_one_id, player_two_id, player_one_wins, player_two_wins) per pair """
+    await repo.executemany('upsert h2h record', records, connection=connection)
+
+async def update_h2h_pair_stats(connection, pair_stats):
+    """ Add one shared match to the per-map stats of each opposing pair """
+    await repo.executemany('upsert h2h pair stats', pair_stats, connection=connection)
+
+async def update_ratings(connection, team1_info, team2_info, team1_score, team2_score):
+    """Move the skill ratings of the players in the match, no other rating is read or written."""
+    players = [*team1_info, *team2_info]
+    await repo.execute('ensure ratings', players, connection=connection)
+    rows = await repo.fetch('lock ratings', players, connection=connection)
+    current = {row['name']: row['rating'] for row in rows}
+    team1_delta, team2_delta = ratings.team_deltas(
+        [current[player] for player in team1_info], [current[player] for player in team2_info], team1_score, team2_score
+    )
+    updates = [(row['player_id'], team1_delta if row['name'] in team1_info else team2_delta) for row in rows]
+    await repo.executemany('apply rating', updates, connection=connection)
+
+async def write_matches(connection, matches):
+    """Write several matches in one transaction. matches is a list of (team1_info, team2_info, gen_info).
+
+    It can run inside a caller's transaction, so the in-memory caches are left alone here, call
+    matches_committed once the outermost transaction has committed.
     """
-    wins_for_player_one = 1 if team1_won else 0
-    wins_for_player_two = 1 if not team1_won else 0
-    await connection.execute(query, player_one_id, player_two_id, wins_for_player_one, wins_for_player_two)
+    match_ids = []
+    async with connection.transaction():
+        for team1_info, team2_info, gen_info in matches:
+            match_ids.append(await write_match_data(connection, team1_info, team2_info, gen_info))
+    return match_ids
 
+def matches_committed(matches):
+    """Update the in-memory caches for matches that are now committed.
 
+    Bumping earlier would let a command cache the old answer under the new version until the next write,
+    and the percentile reload could read the aggregates on another connection before the match is in them.
+    """
+    players = [player for team1_info, team2_info, _ in matches for player in (*team1_info, *team2_info)]
+    responses.bump(players)
+    # new players become available to slash command autocomplete straight away
+    names.add_players(players)
+    snapshot.schedule_refresh()